@@ -2,13 +2,14 @@
 ATMO-ACCESS time series service
 """
 
+import gc
 import os
+import flask
 import pandas as pd
 
 # Local imports
 import data_access
 import gui
-from data_access import query_actris
 
 # Dash imports; for documentation (including tutorial), see: https://dash.plotly.com/
 import dash
@@ -21,6 +22,14 @@ from dash.exceptions import PreventUpdate
 import plotly.graph_objects as go
 
 from utils import charts
+from utils.session_store import SessionStore
+from utils.figure_cache import FigureCache, fingerprint
+from utils import serialization
+from utils import colocation
+from utils import memory
+from utils import metrics
+from utils import profiler
+from utils import tracing
 
 # Provides a version of Dash application which can be run in Jupyter notebook/lab
 # See: https://github.com/plotly/jupyter-dash
@@ -36,6 +45,11 @@ if RUNNING_IN_BINDER:
 else:
     app_conf.update({'host': 'localhost', 'port': 9235})
 
+# traffic to RI's services can be recorded, or replayed from a local stand-in server (see the package offline)
+if os.environ.get('OFFLINE_MODE'):
+    import offline
+    offline.configure_from_env()
+
 # Below there are id's of Dash JS components.
 # The components themselves are declared in the dashboard layout (see the function get_dashboard_layout).
 # Essential properties of each component are explained in the comments below.
@@ -72,6 +86,9 @@ LAT_MIN_ID = 'lat-min'
 LON_MAX_ID = 'lon-max'
 LON_MIN_ID = 'lon-min'
     # 'value' contains a number (or None)
+VALUE_MIN_ID = 'value-min'
+VALUE_MAX_ID = 'value-max'
+    # 'value' contains a number (or None); datasets with known summary statistics outside this range are filtered out
 GANTT_VIEW_RADIO_ID = 'gantt-view-radio'
     # 'value' contains 'compact' or 'detailed'
 GANTT_GRAPH_ID = 'gantt-graph'
@@ -79,8 +96,23 @@ TIMESERIES_GRAPH_ID = 'timeseries-graph'
     # 'figure' contains a Plotly figure object
 TIMESERIES_GRAPH_INFO_ID = 'plot_datasets-info'
 TIMESERIES_GRAPH_INFOTAB_ID = 'plot_datasets-infotab'
+COLOCATION_METHOD_RADIO_ID = 'colocation-method-radio'
+    # 'value' contains 'nearest' or 'bins' (see utils.colocation)
+COLOCATION_WINDOW_INPUT_ID = 'colocation-window-input'
+    # 'value' contains a tolerance of matching (method 'nearest') or a width of bins (method 'bins') in minutes,
+    # or None (chosen from sampling of the datasets)
+COLOCATION_GRAPH_ID = 'colocation-graph'
+COLOCATION_INFOTAB_ID = 'colocation-infotab'
+AIRPORTS_DROPDOWN_ID = 'airports-dropdown'
+    # 'value' contains a list of IAGOS platform_id's of airports
+AIRPORT_LAYERS_DROPDOWN_ID = 'airport-layers-dropdown'
+    # 'value' contains a list of layers of IAGOS vertical profiles
+AIRPORT_RADIUS_INPUT_ID = 'airport-radius-input'
+    # 'value' contains a radius in km (or None)
+AIRPORT_STATIONS_TABLE_ID = 'airport-stations-table'
+    # 'data' contains pairs of IAGOS airports and ground stations nearby (see data_access.get_airport_station_pairs)
 DATASETS_STORE_ID = 'datasets-store'
-    # 'data' stores datasets metadata in JSON, as provided by the method pd.DataFrame.to_json(orient='split', date_format='iso')
+    # 'data' stores a handle {'session_id': str, 'version': int} of datasets metadata kept on the server (see datasets_store)
 DATASETS_PLOTTING_STORE_ID = 'datasets-plotting-store'
 DATASETS_TABLE_CHECKLIST_ALL_NONE_SWITCH_ID = 'datasets-table-checklist-all-none-switch'
     # 'columns' contains list of dictionaries {'name' -> column name, 'id' -> column id}
@@ -90,6 +122,7 @@ QUICKLOOK_POPUP_ID = 'quicklook-popup'
 # Maximum number of variables comparable at the same time.
 MODAL_MAX_VARIABLES_ID="modal-max-variables"
 MAX_VARIABLES=3
+IAGOS_LAYERS = ['500m', 'PBL', 'FT', 'UT']
 MODAL_DISCLAIMER_ID="modal-disclaimer"
 
 # Atmo-Access logo url
@@ -97,14 +130,30 @@ ATMO_ACCESS_LOGO_URL = \
     'https://www7.obs-mip.fr/wp-content-aeris/uploads/sites/82/2021/03/ATMO-ACCESS-Logo-final_horizontal-payoff-grey-blue.png'
 
 # Initialization of global objects
-app = JupyterDash(__name__, external_stylesheets=[
+# callback outputs are serialized with orjson (if available) and responses are compressed with brotli or gzip
+serialization.use_fast_json_engine()
+server = flask.Flask(__name__)
+server.config['COMPRESS_ALGORITHM'] = serialization.get_compress_algorithms()
+app = JupyterDash(__name__, server=server, compress=True, external_stylesheets=[
     dbc.themes.BOOTSTRAP,
     'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/4.7.0/css/font-awesome.min.css',
 ])
 stations = data_access.get_stations()
-station_by_shortnameRI = gui.get_station_by_shortnameRI(stations)
+station_by_idx = gui.get_station_by_idx(stations)
 variables = data_access.get_vars()
 std_variables = gui.get_std_variables(variables)
+# datasets metadata (pandas.DataFrame) found by users' searches; browsers keep only handles (see DATASETS_STORE_ID);
+# with several worker processes, SESSION_STORE_DIR must point to a directory shared by the workers (see create_app)
+datasets_store = SessionStore(directory=os.environ.get('SESSION_STORE_DIR'))
+# figures (and tables accompanying them) keyed by (fingerprint of datasets metadata, view type, ids of datasets)
+figure_cache = FigureCache()
+# both are accounted in the memory budget of the worker (see utils.memory); if it is exceeded, figures are evicted, and
+# sessions only if they can be loaded back from SESSION_STORE_DIR (otherwise users would lose their searches)
+memory.register(
+    'session_store', lambda: datasets_store.nbytes,
+    datasets_store.evict if datasets_store.directory is not None else None
+)
+memory.register('figure_cache', lambda: figure_cache.nbytes, figure_cache.evict)
 
 
 def get_description_table():
@@ -257,6 +306,11 @@ def get_dashboard_layout():
                                  end_date=data_access.get_end_date()
                              ),
                          ]),
+                         html.Div(style={'margin-top': '15px'}, children=[
+                             html.P('Value range (optional):', style={'display': 'inline', 'font-weight': 'bold', 'margin-right': '20px'}),
+                             dcc.Input(id=VALUE_MIN_ID, placeholder='min', type='number', style={'margin-right': '10px'}),
+                             dcc.Input(id=VALUE_MAX_ID, placeholder='max', type='number'),
+                         ]),
                          gui.get_bbox_selection_div(LAT_MAX_ID, LAT_MIN_ID, LON_MAX_ID, LON_MIN_ID),
                          html.Div(id='selected-stations-div',
                                   style={'margin-top': '20px'},
@@ -374,12 +428,86 @@ def get_dashboard_layout():
     ]))
 
 
+    colocation_tab = dcc.Tab(label='Colocate datasets', value=COLOCATION_TAB_VALUE,
+                             children=html.Div(style={'margin': '20px'}, children=[
+        html.Div(id='colocation-controls-div', className='twelve columns', children=[
+            html.Div(className='four columns', children=
+                dbc.RadioItems(
+                    id=COLOCATION_METHOD_RADIO_ID,
+                    options=[
+                        {'label': 'nearest in time', 'value': colocation.NEAREST},
+                        {'label': 'common time bins', 'value': colocation.BINS},
+                    ],
+                    value=colocation.NEAREST,
+                    inline=True)
+            ),
+            html.Div(className='four columns', children=
+                dcc.Input(style={'width': '100%'}, id=COLOCATION_WINDOW_INPUT_ID, type='number', min=1, debounce=True,
+                          placeholder='tolerance / bin width [minutes]'),
+            ),
+            html.Div(className='four columns', children=
+                html.P('Variables of the selected datasets are aligned onto a common time base.'),
+            ),
+        ]),
+        dash_table.DataTable(
+            id=COLOCATION_INFOTAB_ID,
+            sort_action='native',
+            style_data={
+                'whiteSpace': 'normal',
+                'height': 'auto',
+                'lineHeight': '15px'
+            },
+            style_cell={'textAlign': 'left'},
+        ),
+        dcc.Graph(
+            id=COLOCATION_GRAPH_ID,
+        ),
+        html.Hr(),
+        html.P('Ground stations near IAGOS airports which measure the same variables as the IAGOS profiles:'),
+        html.Div(id='airport-stations-controls-div', className='twelve columns', children=[
+            html.Div(className='five columns', children=
+                dcc.Dropdown(
+                    id=AIRPORTS_DROPDOWN_ID,
+                    options=[
+                        {'label': f"{station['short_name']} ({station['long_name']})", 'value': station['short_name']}
+                        for _, station in stations[stations['RI'] == 'IAGOS'].sort_values('short_name').iterrows()
+                    ],
+                    multi=True,
+                    placeholder='all airports',
+                ),
+            ),
+            html.Div(className='four columns', children=
+                dcc.Dropdown(
+                    id=AIRPORT_LAYERS_DROPDOWN_ID,
+                    options=[{'label': layer, 'value': layer} for layer in IAGOS_LAYERS],
+                    multi=True,
+                    placeholder='all layers',
+                ),
+            ),
+            html.Div(className='three columns', children=
+                dcc.Input(style={'width': '100%'}, id=AIRPORT_RADIUS_INPUT_ID, type='number', min=1, max=500,
+                          value=100, debounce=True, placeholder='radius [km]'),
+            ),
+        ]),
+        dash_table.DataTable(
+            id=AIRPORT_STATIONS_TABLE_ID,
+            columns=[{'name': name, 'id': i} for name, i in zip(
+                ['Airport', 'Layer', 'Variable', 'Station', 'RI', 'Distance [km]'],
+                ['airport', 'layer', 'std_ECV_name', 'station_fullname', 'RI', 'distance_km'],
+            )],
+            sort_action='native',
+            page_size=20,
+            style_cell={'textAlign': 'left'},
+        ),
+    ]))
+
     app_tabs = dcc.Tabs(id=APP_TABS_ID, value=SEARCH_DATASETS_TAB_VALUE,
                         children=[
                             description_data_tab,
                             stations_vars_tab,
                             select_datasets_tab,
                             plot_data_tab,
+                            colocation_tab,
                         ])
 
     layout = html.Div(id='app-container-div', style={'margin': '30px', 'padding-bottom': '50px'}, children=stores + [
@@ -433,6 +561,27 @@ app.layout = get_dashboard_layout()
 # See: https://dash.plotly.com/basic-callbacks for a basic tutorial and
 # https://dash.plotly.com/  -->  Dash Callback in left menu for more detailed documentation
 
+def get_datasets_df(datasets_handle):
+    """
+    Provide datasets metadata from the server-side store; if the handle is None or the data has been evicted,
+    the callback is not updated.
+    """
+    datasets_df = datasets_store.get(datasets_handle)
+    if datasets_df is None:
+        raise PreventUpdate
+    return datasets_df
+
+def get_figure_key(datasets_handle, *view):
+    """
+    Provide a key of figure_cache for a view of the datasets of the handle. The fingerprint of the datasets is taken
+    from the server-side store, never from the handle sent by the browser; if it is unknown, the key is None and the
+    figure is not cached.
+    """
+    datasets_fingerprint = datasets_store.get_fingerprint(datasets_handle)
+    if datasets_fingerprint is None:
+        return None
+    return (datasets_fingerprint, ) + view
+
 @app.callback(
     Output(MODAL_DISCLAIMER_ID, "is_open"),
     Input("close", "n_clicks"),
@@ -485,12 +634,14 @@ def get_selected_stations_bbox_and_dropdown(selected_stations):
     State('my-date-picker-range', 'start_date'),
     State('my-date-picker-range', 'end_date'),
     State(SELECTED_STATIONS_DROPDOWN_ID, 'value'),
+    State(VALUE_MIN_ID, 'value'),
+    State(VALUE_MAX_ID, 'value'),
     State(DATASETS_STORE_ID, 'data'),  # TODO: if no station or variable selected, do not launch Search datasets action; instead, return an old data
     State(DATASETS_TABLE_ID, 'selected_row_ids'),
 )
 def change_tab(
         n_clicks_search, n_clicks_select, selected_variables, lon_min, lon_max, lat_min, lat_max, start, end,
-        selected_stations_idx, previous_datasets_json, selected_row_ids
+        selected_stations_idx, value_min, value_max, previous_datasets_handle, selected_row_ids
     ):
     
     from dash.exceptions import PreventUpdate
@@ -502,14 +653,10 @@ def change_tab(
         empty_datasets_df = pd.DataFrame(
             columns=['title', 'url', 'ecv_variables', 'platform_id', 'RI', 'var_codes', 'ecv_variables_filtered',
                      'std_ecv_variables_filtered', 'var_codes_filtered', 'time_period_start', 'time_period_end',
-                     'platform_id_RI', 'id']
+                     'platform_id_RI', 'station_idx', 'var_stats', 'id']
         )   # TODO: do it cleanly
     
         if not selected_variables or None in [lon_min, lon_max, lat_min, lat_max]:
-            if previous_datasets_json is not None:
-                datasets_json = previous_datasets_json
-            else:
-                datasets_json = empty_datasets_df.to_json(orient='split', date_format='iso')
             return None, SEARCH_DATASETS_TAB_VALUE, "", None, None, False
         
         if trigger == SEARCH_DATASETS_BUTTON_ID:
@@ -525,24 +672,27 @@ def change_tab(
             if datasets_df is None:
                 datasets_df = empty_datasets_df   
             datasets_df_filtered = datasets_df[
-                datasets_df['platform_id'].isin(selected_stations['short_name']) &
-                datasets_df['RI'].isin(selected_stations['RI'])     # short_name of the station might not be unique among RI's
+                datasets_df['station_idx'].isin(selected_stations['idx'])
                 & datasets_df['ecv_variables'].apply(lambda vs: not set(vs).isdisjoint(selected_variables))
             ]
+            datasets_df_filtered = data_access.filter_datasets_on_value_range(datasets_df_filtered, value_min, value_max)
         
             datasets_df_filtered = datasets_df_filtered.reset_index(drop=True)
             datasets_df_filtered['id'] = datasets_df_filtered.index
         
             new_active_tab = SELECT_DATASETS_TAB_VALUE if n_clicks_search > 0 else SEARCH_DATASETS_TAB_VALUE
-            return datasets_df_filtered.to_json(orient='split', date_format='iso'), new_active_tab, "", 0, 0, False
+            datasets_handle = datasets_store.put(
+                datasets_df_filtered, previous_datasets_handle, fingerprint=fingerprint(datasets_df_filtered)
+            )
+            return datasets_handle, new_active_tab, "", 0, 0, False
         
         if trigger == SELECT_DATASETS_BUTTON_ID:
             if not selected_row_ids:
                 raise PreventUpdate
             if len(selected_row_ids) > MAX_VARIABLES:
-                return previous_datasets_json, SELECT_DATASETS_TAB_VALUE, "", 0, 0, True
+                return previous_datasets_handle, SELECT_DATASETS_TAB_VALUE, "", 0, 0, True
             new_active_tab = PLOT_DATASETS_TAB_VALUE 
-            return previous_datasets_json, new_active_tab, "", 0, 0, False
+            return previous_datasets_handle, new_active_tab, "", 0, 0, False
 
 @app.callback(
     Output(TIMESERIES_GRAPH_ID, 'figure'),
@@ -554,9 +704,9 @@ def change_tab(
     State(DATASETS_TABLE_ID, 'selected_row_ids'),
     State(APP_TABS_ID, 'value'),
 )
-def get_timeseries_figure(datasets_json, selected_variables, selected_row_ids, tab_id):
+def get_timeseries_figure(datasets_handle, selected_variables, selected_row_ids, tab_id):
     trigger = dash.callback_context.triggered[0]['prop_id'].split('.')[0]
-    if datasets_json is None or not selected_row_ids or tab_id != PLOT_DATASETS_TAB_VALUE:
+    if datasets_handle is None or not selected_row_ids or tab_id != PLOT_DATASETS_TAB_VALUE:
         raise PreventUpdate
 
     titles_ids=["dataset", "ri", "station", "stationcode", "ecv", "legend"] #, "status"
@@ -566,17 +716,19 @@ def get_timeseries_figure(datasets_json, selected_variables, selected_row_ids, t
     table_data=[]
     datasets=[]
     #figure = go.Figure()
-    datasets_df = pd.read_json(datasets_json, orient='split', convert_dates=['time_period_start', 'time_period_end'])
-    datasets_df = datasets_df.join(station_by_shortnameRI['station_fullname'], on='platform_id_RI')  # column 'station_fullname' joined to datasets_df
+    datasets_df = get_datasets_df(datasets_handle)
+    datasets_df = datasets_df.join(station_by_idx['station_fullname'], on='station_idx')  # column 'station_fullname' joined to datasets_df
     axes=[]
     i = 0
     dfs={}
+    range_by_var = {}
     for id in selected_row_ids:
         s = datasets_df.loc[id]
         #try:
         pnsd = False
         ds, dataset_id = data_access.read_dataset(s['RI'], s['url'], s)
         if s['RI'].lower() == "actris":
+            from data_access import query_actris
             dss = data_access.get_dataset_from_cache(s['RI'], dataset_id)
             pnsd = query_actris.test_particle_number_size_distribution(dss)
         dd={'info' : s, 'loaded': False} 
@@ -584,6 +736,7 @@ def get_timeseries_figure(datasets_json, selected_variables, selected_row_ids, t
             i=i+1
             dd['loaded'] = True 
             ds_vars = [v for v in ds if ds[v].squeeze().ndim == 1]
+            var_stats = data_access.get_summary_stats(dataset_id, s) or {}
             if pnsd:
                 # Ignore 2D data for ACTRIS.
                 # opendap_url = [url['url'] for url in s['url'] if url['type'] == 'opendap'][0]
@@ -597,10 +750,17 @@ def get_timeseries_figure(datasets_json, selected_variables, selected_row_ids, t
                             da = ds[v]
                             units=da.attrs['units'] if 'units' in da.attrs else "no units"
                             dfs[v + ' (' + str(i) + ') - ' + units] = ds[v].to_series()
+                            if v in var_stats:
+                                range_by_var[v + ' (' + str(i) + ') - ' + units] = (var_stats[v]['min'], var_stats[v]['max'])
             
         datasets.append(dd)
-    figure=charts.multi_line(dfs)
-    charts.add_watermark(figure)
+    figure=charts.multi_line(dfs, range_by_var=range_by_var)
+    if figure is None:
+        # none of the selected datasets has a time series (e.g. they could not be read)
+        figure = go.Figure()
+    else:
+        charts.add_watermark(figure)
+    serialization.compact_figure(figure)
     figure.update_layout(
         legend=dict(orientation='h', title='Variables')
     )
@@ -643,7 +803,7 @@ def get_timeseries_figure(datasets_json, selected_variables, selected_row_ids, t
     Input(DATASETS_STORE_ID, 'data'),
     State(APP_TABS_ID, 'value'),
 )
-def get_gantt_figure(gantt_view_type, datasets_json, tab_id):
+def get_gantt_figure(gantt_view_type, datasets_handle, tab_id):
     trigger = dash.callback_context.triggered[0]['prop_id'].split('.')[0]
 
     titles_ids=["code", "name"] #, "status"
@@ -652,46 +812,55 @@ def get_gantt_figure(gantt_view_type, datasets_json, tab_id):
     table_data=[]
 
 
-    if datasets_json is None or tab_id == PLOT_DATASETS_TAB_VALUE:
+    if datasets_handle is None or tab_id == PLOT_DATASETS_TAB_VALUE:
         raise PreventUpdate
 
     selectedData = {'points': []}
-    datasets_df = pd.read_json(datasets_json, orient='split', convert_dates=['time_period_start', 'time_period_end'])
-    datasets_df = datasets_df.join(station_by_shortnameRI['station_fullname'], on='platform_id_RI')  # column 'station_fullname' joined to datasets_df
+    datasets_df = get_datasets_df(datasets_handle)
 
-    try:
-        df_unique = datasets_df.loc[datasets_df.astype(str).drop_duplicates(subset = "ecv_variables").index] 
-    except Exception as err:
-        print(err)
-    var_legend={}
-    k=0
-    while k < len(df_unique.index):
-        code=df_unique.iloc[k]['var_codes_filtered'].split(", ")
-        ecv=df_unique.iloc[k]['ecv_variables']
-        j=0
-        for vl in code:
-            var_legend[vl] = ecv[j]
-            j=j+1
-        k=k+1
-    i = 1
-    for var in var_legend.keys():
-        table_data.append({
-                "id": i, 
-                "code": var, 
-                "name": var_legend[var], 
-        })
-        i=i+1
+    def get_gantt_figure_and_legend(datasets_df):
+        datasets_df = datasets_df.join(station_by_idx['station_fullname'], on='station_idx')  # column 'station_fullname' joined to datasets_df
 
-    if len(datasets_df) == 0:
-       return {}, selectedData   
+        try:
+            df_unique = datasets_df.loc[datasets_df.astype(str).drop_duplicates(subset = "ecv_variables").index] 
+        except Exception as err:
+            print(err)
+        var_legend={}
+        k=0
+        while k < len(df_unique.index):
+            code=df_unique.iloc[k]['var_codes_filtered'].split(", ")
+            ecv=df_unique.iloc[k]['ecv_variables']
+            j=0
+            for vl in code:
+                var_legend[vl] = ecv[j]
+                j=j+1
+            k=k+1
+        i = 1
+        for var in var_legend.keys():
+            table_data.append({
+                    "id": i, 
+                    "code": var, 
+                    "name": var_legend[var], 
+            })
+            i=i+1
 
-    if gantt_view_type == 'compact':
-        fig = gui.get_timeline_by_station(datasets_df)
-    else:
-        fig = gui.get_timeline_by_station_and_vars(datasets_df)
-    fig.update_traces(
-        selectedpoints=[],
-        unselected={'marker': {'opacity': 0.4}, }
+        if len(datasets_df) == 0:
+            return {}, table_data
+
+        if gantt_view_type == 'compact':
+            fig = gui.get_timeline_by_station(datasets_df)
+        else:
+            fig = gui.get_timeline_by_station_and_vars(datasets_df)
+        fig.update_traces(
+            selectedpoints=[],
+            unselected={'marker': {'opacity': 0.4}, }
+        )
+        serialization.compact_figure(fig)
+        return fig, table_data
+
+    fig, table_data = figure_cache.get_or_build(
+        get_figure_key(datasets_handle, 'gantt', gantt_view_type),
+        lambda: get_gantt_figure_and_legend(datasets_df)
     )
     return fig, selectedData, table_columns, table_data
 
@@ -700,13 +869,14 @@ def get_gantt_figure(gantt_view_type, datasets_json, tab_id):
     Output(DATASETS_TABLE_ID, 'data'),
     Output(DATASETS_TABLE_ID, 'selected_rows'),
     Output(DATASETS_TABLE_ID, 'selected_row_ids'),
+    Output(DATASETS_TABLE_ID, 'tooltip_data'),
     Input(GANTT_GRAPH_ID, 'selectedData'),
     Input(DATASETS_TABLE_CHECKLIST_ALL_NONE_SWITCH_ID, 'value'),
     State(DATASETS_STORE_ID, 'data'),
     State(DATASETS_TABLE_ID, 'selected_row_ids'),
 )
 def datasets_as_table(gantt_figure_selectedData, datasets_table_checklist_all_none_switch,
-                      datasets_json, previously_selected_row_ids):
+                      datasets_handle, previously_selected_row_ids):
     table_col_ids = ['eye', 'title', 'var_codes_filtered', 'RI', 'long_name', 'platform_id', 'time_period_start', 'time_period_end',
                      #_#'url', 'ecv_variables', 'ecv_variables_filtered', 'std_ecv_variables_filtered', 'var_codes', 'platform_id_RI'
                      ]
@@ -717,11 +887,11 @@ def datasets_as_table(gantt_figure_selectedData, datasets_table_checklist_all_no
     # on rendering HTML snipplets in DataTable cells: https://github.com/plotly/dash-table/pull/916
     table_columns[0]['presentation'] = 'markdown'
     
-    if datasets_json is None:
-        return table_columns, [], [], []
+    datasets_df = datasets_store.get(datasets_handle)
+    if datasets_df is None:
+        return table_columns, [], [], [], []
 
-    datasets_df = pd.read_json(datasets_json, orient='split', convert_dates=['time_period_start', 'time_period_end'])
-    datasets_df = datasets_df.join(station_by_shortnameRI['long_name'], on='platform_id_RI')
+    datasets_df = datasets_df.join(station_by_idx['long_name'], on='station_idx')
 
     # filter on selected timeline bars on the Gantt figure
     if gantt_figure_selectedData and 'points' in gantt_figure_selectedData:
@@ -734,6 +904,10 @@ def datasets_as_table(gantt_figure_selectedData, datasets_table_checklist_all_no
     datasets_df['eye'] = '<i class="fa fa-eye"></i>'
 
     table_data = datasets_df[['id'] + table_col_ids].to_dict(orient='records')
+    tooltip_data = [
+        {'var_codes_filtered': {'value': gui.get_summary_stats_tooltip(var_stats), 'type': 'markdown'}}
+        for var_stats in datasets_df['var_stats'].to_list()
+    ]
 
     # see here for explanation how dash.callback_context works
     # https://community.plotly.com/t/select-all-rows-in-dash-datatable/41466/2
@@ -754,56 +928,46 @@ def datasets_as_table(gantt_figure_selectedData, datasets_table_checklist_all_no
         idx = idx.loc[selected_row_ids]
         selected_row_ids = idx.index.to_list()
         selected_rows = idx['n'].to_list()
-    return table_columns, table_data, selected_rows, selected_row_ids
-
-_tmp_dataset = None
-_tmp_ds = None
-_active_cell = None
+    return table_columns, table_data, selected_rows, selected_row_ids, tooltip_data
 
 @app.callback(
     Output(QUICKLOOK_POPUP_ID, 'children'),
     Input(DATASETS_TABLE_ID, 'active_cell'),
     State(DATASETS_STORE_ID, 'data'),
 )
-def popup_graphs(active_cell, datasets_json):
-    global _tmp_dataset, _tmp_ds, _active_cell
-    
-    _active_cell = active_cell
-
-    if datasets_json is None or active_cell is None:
+def popup_graphs(active_cell, datasets_handle):
+    if datasets_handle is None or active_cell is None:
         raise PreventUpdate
 
-    datasets_df = pd.read_json(datasets_json, orient='split', convert_dates=['time_period_start', 'time_period_end'])
+    datasets_df = get_datasets_df(datasets_handle)
     s = datasets_df.loc[active_cell['row_id']]
-    _tmp_dataset = s
 
-    try:
+    def get_quicklook_figure():
         ds, dataset_id = data_access.read_dataset(s['RI'], s['url'], s)
-        ds_exc = None
-    except Exception as e:
-        ds = None
-        ds_exc = e
+        ds_vars = [v for v in ds if ds[v].squeeze().ndim == 1]
+        if len(ds_vars) == 0:
+            return None
+        df = {v: ds[v].to_series() for v in ds_vars}
+        var_stats = data_access.get_summary_stats(dataset_id, s) or {}
+        range_by_var = {v: (var_stats[v]['min'], var_stats[v]['max']) for v in ds_vars if v in var_stats}
 
-    _tmp_ds = ds
+        fig=charts.multi_line(df, range_by_var=range_by_var)
+        charts.add_watermark(fig)
+        fig.update_layout(
+            legend=dict(orientation='h', title='Variables')
+        )
+        serialization.compact_figure(fig)
+        return fig
 
-    if ds is not None:
-        ds_vars = [v for v in ds if ds[v].squeeze().ndim == 1]
-        if len(ds_vars) > 0:
-            df = {v: ds[v].to_series() for v in ds_vars}
-            
-            fig=charts.multi_line(df)
-            charts.add_watermark(fig)
-            fig.update_layout(
-                legend=dict(orientation='h', title='Variables')
-            )
-            ds_plot = dcc.Graph(
-                id='quick-plot',
-                figure=fig
-            )
-        else:
-            ds_plot = None
-    else:
-        ds_plot = repr(ds_exc)
+    # the figure is cached only if it was built successfully
+    try:
+        fig = figure_cache.get_or_build(
+            get_figure_key(datasets_handle, 'quicklook', active_cell['row_id']),
+            get_quicklook_figure
+        )
+        ds_plot = dcc.Graph(id='quick-plot', figure=fig) if fig is not None else None
+    except Exception as e:
+        ds_plot = repr(e)
 
     return dbc.Modal(
         [
@@ -815,11 +979,153 @@ def popup_graphs(active_cell, datasets_json):
         is_open=True,
     )
 
+def get_variables_series(datasets_df, row_ids):
+    """
+    Read datasets and provide their 1-dimensional variables, labelled like in the time series figure.
+    :param datasets_df: pandas.DataFrame with datasets metadata
+    :param row_ids: list of ids of rows of datasets_df
+    :return: dict {label: xarray.DataArray}
+    """
+    series_by_label = {}
+    i = 0
+    for row_id in row_ids:
+        s = datasets_df.loc[row_id]
+        ds, _ = data_access.read_dataset(s['RI'], s['url'], s)
+        if ds is None or len(ds) == 0:
+            continue
+        i = i + 1
+        for v in ds:
+            da = ds[v].squeeze()
+            if da.ndim != 1 or v in ['station_id', 'latitude', 'longitude'] or da[da.dims[0]].dtype.kind != 'M':
+                continue
+            units = da.attrs['units'] if 'units' in da.attrs else 'no units'
+            series_by_label[v + ' (' + str(i) + ') - ' + units] = da
+    return series_by_label
+
+@app.callback(
+    Output(COLOCATION_GRAPH_ID, 'figure'),
+    Output(COLOCATION_INFOTAB_ID, 'columns'),
+    Output(COLOCATION_INFOTAB_ID, 'data'),
+    Input(APP_TABS_ID, 'value'),
+    Input(COLOCATION_METHOD_RADIO_ID, 'value'),
+    Input(COLOCATION_WINDOW_INPUT_ID, 'value'),
+    State(DATASETS_STORE_ID, 'data'),
+    State(DATASETS_TABLE_ID, 'selected_row_ids'),
+)
+def get_colocation_figure(tab_id, method, window_minutes, datasets_handle, selected_row_ids):
+    if tab_id != COLOCATION_TAB_VALUE or datasets_handle is None or not selected_row_ids:
+        raise PreventUpdate
+
+    window = pd.Timedelta(minutes=window_minutes) if window_minutes else None
+    if method == colocation.NEAREST:
+        titles_ids = ['variable', 'samples', 'matched', 'match_ratio', 'median_offset']
+        titles = ['Variable', 'Samples', 'Matched', 'Match ratio', 'Median time offset']
+    else:
+        titles_ids = ['variable', 'samples', 'matched', 'match_ratio', 'median_count']
+        titles = ['Variable', 'Samples', 'Matched bins', 'Match ratio', 'Median samples per bin']
+    table_columns = [{'name': name, 'id': i} for name, i in zip(titles, titles_ids)]
+
+    def get_colocation_figure_and_stats():
+        datasets_df = get_datasets_df(datasets_handle)
+        series_by_label = get_variables_series(datasets_df, selected_row_ids)
+        res = colocation.colocate(series_by_label, method=method, tolerance=window, freq=window)
+        table_data = []
+        for label, stats in res.stats.items():
+            row = {'variable': label, 'samples': stats['samples'], 'matched': stats['matched'],
+                   'match_ratio': f"{100 * stats['match_ratio']:.0f}%"}
+            if method == colocation.NEAREST:
+                row['median_offset'] = str(stats['median_offset'])
+            else:
+                row['median_count'] = stats['median_count']
+            table_data.append(row)
+        fig = charts.colocation_scatter(res)
+        if fig is None:
+            fig = charts.empty_figure()
+        serialization.compact_figure(fig)
+        return fig, table_data
+
+    fig, table_data = figure_cache.get_or_build(
+        get_figure_key(datasets_handle, 'colocation', tuple(selected_row_ids), method, window_minutes),
+        get_colocation_figure_and_stats
+    )
+    return fig, table_columns, table_data
+
+@app.callback(
+    Output(AIRPORT_STATIONS_TABLE_ID, 'data'),
+    Input(AIRPORTS_DROPDOWN_ID, 'value'),
+    Input(AIRPORT_LAYERS_DROPDOWN_ID, 'value'),
+    Input(AIRPORT_RADIUS_INPUT_ID, 'value'),
+    State(VARIABLES_CHECKLIST_ID, 'value'),
+)
+def get_airport_stations_table(airports, layers, radius_km, selected_variables):
+    pairs_df = data_access.get_airport_station_pairs(
+        airports=airports or None, layers=layers or None, variables=selected_variables or None, radius_km=radius_km
+    )
+    pairs_df = pairs_df.join(station_by_idx[['station_fullname', 'RI']], on='station_idx')
+    pairs_df['distance_km'] = pairs_df['distance_km'].round(1)
+    return pairs_df[['airport', 'layer', 'std_ECV_name', 'station_fullname', 'RI', 'distance_km']].to_dict(orient='records')
+
 # End of callback definitions
 
+# durations of the callbacks and of requests to RI's are exported, with other metrics, at /metrics (see utils.metrics)
+metrics.instrument_dash_callbacks(app)
+metrics.instrument_requests()
+metrics.install_metrics_route(server)
+
+
+@server.after_request
+def enforce_memory_budget(response):
+    # figures and search results cached by the request might exceed the memory budget
+    memory.enforce_budget()
+    return response
+
+
+@server.route('/health/upstream')
+def upstream_health():
+    # latency percentiles and error budgets of the services of RI's, as seen by this worker (see data_access.upstream)
+    return flask.jsonify(data_access.get_upstream_health())
+
+
+# callbacks and requests to RI's are traced, if TRACE_FILE is set (see utils.tracing)
+tracing.instrument_dash_callbacks(app)
+tracing.instrument_requests()
+
+# opt-in profiling of the callbacks, with a report at /profiler (see utils.profiler)
+if os.environ.get('CALLBACK_PROFILE_DIR'):
+    profiler.install(
+        app, os.environ['CALLBACK_PROFILE_DIR'],
+        sample_rate=float(os.environ.get('CALLBACK_PROFILE_SAMPLE_RATE', 0))
+    )
+
 import warnings
 warnings.filterwarnings("ignore", category=FutureWarning)
 
-# Launch the Dash application.
-# app_conf['debug'] = False
-app.run_server(**app_conf)
+
+
+def create_app():
+    """
+    WSGI application factory for a production server with several worker processes, e.g.
+        gunicorn -c gunicorn.conf.py 'app:create_app()'
+    It is meant to be called once before the workers are forked (gunicorn's preload_app), so that the catalogue data
+    (stations, variables, IAGOS catalogue, RI query modules) is loaded only once and shared copy-on-write by the workers.
+    Caches of datasets on disk are shared by the workers with file locking (see data_access); the search results are
+    shared through the directory given by the environment variable SESSION_STORE_DIR, which must be set.
+    :return: flask.Flask
+    """
+    if datasets_store.directory is None:
+        raise RuntimeError('SESSION_STORE_DIR must be set when running with several worker processes')
+    data_access.warm_up()
+    # move objects created so far to a permanent generation, so that garbage collections in workers do not touch
+    # (and so copy) their memory pages
+    gc.collect()
+    gc.freeze()
+    return app.server
+
+
+if __name__ == '__main__':
+    # Import RI query modules etc. in the background, so that they do not delay the startup of the server.
+    data_access.start_warm_up()
+
+    # Launch the Dash application.
+    # app_conf['debug'] = False
+    app.run_server(**app_conf)
@@ -0,0 +1,5 @@
+"""
+Benchmarks of the app. They are run as modules from the src directory, e.g.
+    python -m benchmarks.e2e --output benchmarks/results/e2e.json
+and write their results as JSON, so that results of different commits can be compared (see benchmarks.common.compare).
+"""
@@ -0,0 +1,36 @@
+"""
+Compare two files of results of a benchmark:
+    python -m benchmarks compare benchmarks/results/e2e-abc1234.json benchmarks/results/e2e-def5678.json
+"""
+
+import argparse
+import sys
+
+import pandas as pd
+
+from .common import compare, load_results
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    compare_parser = subparsers.add_parser('compare', help='compare results of a benchmark')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='relative growth of a time/bytes/memory metric flagged as a regression')
+    args = parser.parse_args()
+
+    baseline, current = load_results(args.baseline), load_results(args.current)
+    if baseline['benchmark'] != current['benchmark']:
+        sys.exit(f'results of different benchmarks: {baseline["benchmark"]} and {current["benchmark"]}')
+    df = compare(baseline, current, threshold=args.threshold)
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(df.to_string(index=False))
+    n_regressions = int(df['regression'].sum())
+    print(f'{n_regressions} regression(s) above {args.threshold:.0%}')
+    sys.exit(1 if n_regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Utilities shared by the benchmarks: description of the environment, memory measurements, storage of results as JSON
+and comparison of results (e.g. of two commits).
+
+A file of results is a JSON object:
+    {'benchmark': str, 'environment': {...}, 'params': {...}, 'results': {case: {metric: number or ...}}}
+Metrics named with the suffixes in LOWER_IS_BETTER_SUFFIXES (times, bytes, memory) are compared as regressions if they
+grow.
+"""
+
+import datetime
+import json
+import os
+import pathlib
+import platform
+import resource
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+
+
+LOWER_IS_BETTER_SUFFIXES = ('_s', '_bytes', '_mb')
+RESULTS_DIR = pathlib.Path(__file__).parent / 'results'
+
+
+def get_git_commit():
+    """
+    :return: str; the hash of the current commit (with the suffix '-dirty' if there are uncommitted changes) or None
+    """
+    cwd = pathlib.Path(__file__).parent
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=cwd, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=cwd,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+
+def get_environment():
+    return {
+        'commit': get_git_commit(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+    }
+
+
+def get_rss_mb():
+    """
+    :return: float; current resident set size of the process in MiB, or None if unavailable (not Linux)
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError):
+        return None
+
+
+def get_process_tree_rss_mb(pid):
+    """
+    :param pid: int; e.g. of the master process of a server with worker processes
+    :return: float; sum of resident set sizes of the process and its descendants in MiB (pages shared by forked
+    processes are counted in each of them), or None if unavailable (not Linux, or no such process)
+    """
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError):
+        return None
+    children = []
+    try:
+        for task in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{task}/children') as f:
+                children.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    for child in children:
+        rss += get_process_tree_rss_mb(child) or 0.
+    return rss
+
+
+def get_peak_rss_mb():
+    """
+    :return: float; peak resident set size of the process in MiB
+    """
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxrss / 2**20 if sys.platform == 'darwin' else maxrss / 2**10
+
+
+def hit_rate(hits, misses):
+    return hits / (hits + misses) if hits + misses > 0 else None
+
+
+def write_results(path, benchmark, params, results):
+    """
+    :param path: str, path-like or None; if None, the file is results/<benchmark>-<commit>.json
+    :return: pathlib.Path of the written file
+    """
+    environment = get_environment()
+    if path is None:
+        path = RESULTS_DIR / f'{benchmark}-{environment["commit"] or "unknown"}.json'
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    doc = {'benchmark': benchmark, 'environment': environment, 'params': params, 'results': results}
+    path.write_text(json.dumps(doc, indent=1, default=str))
+    return path
+
+
+def load_results(path):
+    return json.loads(pathlib.Path(path).read_text())
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+    Compare numeric metrics of two files of results of the same benchmark.
+    :param baseline: dict; see load_results
+    :param current: dict
+    :param threshold: float; a relative growth of a lower-is-better metric above it is flagged as a regression
+    :return: pandas.DataFrame with columns 'case', 'metric', 'baseline', 'current', 'ratio', 'regression'
+    """
+    rows = []
+    for case, metrics in current['results'].items():
+        baseline_metrics = baseline['results'].get(case, {})
+        for metric, value in metrics.items():
+            baseline_value = baseline_metrics.get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(baseline_value, (int, float)) \
+                    or isinstance(value, bool):
+                continue
+            ratio = value / baseline_value if baseline_value else None
+            regression = ratio is not None and metric.endswith(LOWER_IS_BETTER_SUFFIXES) and ratio > 1 + threshold
+            rows.append((case, metric, baseline_value, value, ratio, regression))
+    return pd.DataFrame(rows, columns=['case', 'metric', 'baseline', 'current', 'ratio', 'regression'])
@@ -0,0 +1,266 @@
+"""
+End-to-end benchmark of the flows of users: the real Dash callbacks of the app are called through the Flask test
+client, in the order of the user interface:
+    search (change_tab) -> gantt_compact, gantt_detailed (get_gantt_figure) -> table (datasets_as_table)
+    -> select (change_tab) -> timeseries (get_timeseries_figure) -> popup (popup_graphs)
+By default, RI's services are replaced with a stand-in server in the process (see the package offline), so that
+the results do not depend on the network; catalogues come from the caches of the app. Datasets read from the stand-in
+server are cached in a temporary directory (see data_access.DATA_CACHE_DIR), so the first call of a stage reading
+datasets reads them from the stand-in server and the next ones from the cache.
+
+Each stage is repeated; the first call is reported as cold (e.g. the figure cache is empty), the others as warm.
+For each stage, the results contain: wall times, sizes of the response (JSON and gzip-compressed as sent to browsers),
+resident memory after the stage and its growth, peak resident memory of the process, and hits / misses of the figure
+cache, the session store and the caches of datasets during the stage.
+
+    python -m benchmarks.e2e [--repeat 3] [--output results.json] [--recordings recordings/] [--online]
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from .common import get_rss_mb, get_peak_rss_mb, hit_rate, write_results
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VARIABLES = ['Aerosol Physical Properties', 'Aerosol Chemical Properties', 'Carbon Monoxide', 'Ozone',
+                     'Carbon Dioxide', 'Pressure (surface)', 'Temperature (near surface)']
+# RI's whose datasets are plotted; the stand-in server provides synthetic datasets of ACTRIS (see offline.synthetic)
+DEFAULT_PLOTTED_RIS = ['ACTRIS']
+
+
+def get_callback_request(outputs, inputs, state=()):
+    """
+    :param outputs: list of tuples (id, property)
+    :param inputs: list of tuples (id, property, value); the first one is the one which triggers the callback
+    :param state: list of tuples (id, property, value)
+    :return: dict; the body of POST /_dash-update-component calling the callback, as sent by Dash's front-end
+    """
+    output_specs = [{'id': i, 'property': p} for i, p in outputs]
+    return {
+        'output': (f'{outputs[0][0]}.{outputs[0][1]}' if len(outputs) == 1 else
+                   '..' + '...'.join(f'{i}.{p}' for i, p in outputs) + '..'),
+        'outputs': output_specs[0] if len(outputs) == 1 else output_specs,
+        'inputs': [{'id': i, 'property': p, 'value': v} for i, p, v in inputs],
+        'state': [{'id': i, 'property': p, 'value': v} for i, p, v in state],
+        'changedPropIds': [f'{inputs[0][0]}.{inputs[0][1]}'],
+    }
+
+
+class DashClient:
+    """
+    Calls callbacks of a Dash app like its front-end does (POST /_dash-update-component).
+    """
+    def __init__(self, flask_app):
+        self._client = flask_app.test_client()
+
+    def call(self, outputs, inputs, state=()):
+        """
+        :param outputs, inputs, state: see get_callback_request
+        :return: tuple (response: dict {id: {property: value}} or None if the callback did not update,
+        size of the JSON response in bytes, size of the gzip-compressed response in bytes)
+        """
+        body = get_callback_request(outputs, inputs, state)
+        r = self._client.post('/_dash-update-component', json=body, headers={'Accept-Encoding': 'gzip'})
+        if r.status_code == 204:
+            return None, 0, 0
+        if r.status_code != 200:
+            raise RuntimeError(f'callback of {body["output"]} failed with status {r.status_code}')
+        data = r.data
+        wire_bytes = len(data)
+        if r.headers.get('Content-Encoding') == 'gzip':
+            data = gzip.decompress(data)
+        else:
+            wire_bytes = len(gzip.compress(data))
+        return json.loads(data)['response'], len(data), wire_bytes
+
+
+def _get_cache_counters(app_module):
+    import data_access
+    return {
+        'figure_cache': app_module.figure_cache.stats(),
+        'session_store': app_module.datasets_store.stats(),
+        'dataset_cache': data_access.get_dataset_cache_stats(),
+    }
+
+
+def _measure(app_module, run, repeat):
+    """
+    :param run: callable with no arguments returning the output of DashClient.call
+    :return: tuple (the response of the last call, dict of metrics)
+    """
+    counters_before = _get_cache_counters(app_module)
+    rss_before = get_rss_mb()
+    times = []
+    response = payload_bytes = wire_bytes = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        response, payload_bytes, wire_bytes = run()
+        times.append(time.perf_counter() - t0)
+    counters_after = _get_cache_counters(app_module)
+    rss_after = get_rss_mb()
+
+    metrics = {
+        'cold_s': times[0],
+        'warm_median_s': statistics.median(times[1:]) if len(times) > 1 else None,
+        'warm_min_s': min(times[1:]) if len(times) > 1 else None,
+        'payload_bytes': payload_bytes,
+        'wire_bytes': wire_bytes,
+        'rss_mb': rss_after,
+        'rss_growth_mb': rss_after - rss_before if rss_after is not None and rss_before is not None else None,
+        'peak_rss_mb': get_peak_rss_mb(),
+    }
+    for cache, after in counters_after.items():
+        hits = after['hits'] - counters_before[cache]['hits']
+        misses = after['misses'] - counters_before[cache]['misses']
+        metrics.update({f'{cache}_hits': hits, f'{cache}_misses': misses, f'{cache}_hit_rate': hit_rate(hits, misses)})
+    return response, metrics
+
+
+def run(app_module, variables=None, plotted_ris=None, n_selected=3, repeat=3):
+    """
+    Run the stages of the benchmark against the app.
+    :param app_module: the module app (imported after the offline mode is set up)
+    :param variables: list of ECV names searched for
+    :param plotted_ris: list of names of RI's whose datasets are selected for plotting
+    :param n_selected: int; number of datasets selected for plotting
+    :param repeat: int; number of calls of each stage
+    :return: dict {stage: dict of metrics}
+    """
+    A = app_module
+    variables = variables or DEFAULT_VARIABLES
+    plotted_ris = plotted_ris or DEFAULT_PLOTTED_RIS
+    client = DashClient(A.app.server)
+    results = {}
+
+    def stage(name, call):
+        logger.info(f'stage {name}')
+        response, results[name] = _measure(A, call, repeat)
+        return response
+
+    search_state = [
+        (A.VARIABLES_CHECKLIST_ID, 'value', variables),
+        (A.LON_MIN_ID, 'value', -180), (A.LON_MAX_ID, 'value', 180),
+        (A.LAT_MIN_ID, 'value', -90), (A.LAT_MAX_ID, 'value', 90),
+        ('my-date-picker-range', 'start_date', '2000-01-01'), ('my-date-picker-range', 'end_date', '2022-01-01'),
+        (A.SELECTED_STATIONS_DROPDOWN_ID, 'value', list(range(len(A.stations)))),
+        (A.VALUE_MIN_ID, 'value', None), (A.VALUE_MAX_ID, 'value', None),
+        (A.DATASETS_STORE_ID, 'data', None),
+        (A.DATASETS_TABLE_ID, 'selected_row_ids', []),
+    ]
+    change_tab_outputs = [
+        (A.DATASETS_STORE_ID, 'data'), (A.APP_TABS_ID, 'value'), ('loading-output-1', 'children'),
+        (A.SEARCH_DATASETS_BUTTON_ID, 'n_clicks'), (A.SELECT_DATASETS_BUTTON_ID, 'n_clicks'),
+        (A.MODAL_MAX_VARIABLES_ID, 'is_open'),
+    ]
+    response = stage('search', lambda: client.call(
+        change_tab_outputs,
+        [(A.SEARCH_DATASETS_BUTTON_ID, 'n_clicks', 1), (A.SELECT_DATASETS_BUTTON_ID, 'n_clicks', 0)],
+        search_state,
+    ))
+    handle = response[A.DATASETS_STORE_ID]['data']
+    datasets_df = A.datasets_store.get(handle)
+    results['search']['datasets'] = len(datasets_df)
+
+    for view in ('compact', 'detailed'):
+        stage(f'gantt_{view}', lambda: client.call(
+            [(A.GANTT_GRAPH_ID, 'figure'), (A.GANTT_GRAPH_ID, 'selectedData'),
+             (A.SELECT_DATASETS_INFOTAB_ID, 'columns'), (A.SELECT_DATASETS_INFOTAB_ID, 'data')],
+            [(A.GANTT_VIEW_RADIO_ID, 'value', view), (A.DATASETS_STORE_ID, 'data', handle)],
+            [(A.APP_TABS_ID, 'value', A.SELECT_DATASETS_TAB_VALUE)],
+        ))
+
+    stage('table', lambda: client.call(
+        [(A.DATASETS_TABLE_ID, p) for p in ('columns', 'data', 'selected_rows', 'selected_row_ids', 'tooltip_data')],
+        [(A.GANTT_GRAPH_ID, 'selectedData', None), (A.DATASETS_TABLE_CHECKLIST_ALL_NONE_SWITCH_ID, 'value', False)],
+        [(A.DATASETS_STORE_ID, 'data', handle), (A.DATASETS_TABLE_ID, 'selected_row_ids', [])],
+    ))
+
+    # particle number size distributions (2-dimensional) are not plotted as time series
+    plotted_df = datasets_df[
+        datasets_df['RI'].isin(plotted_ris)
+        & ~datasets_df['title'].str.contains('particle.number.size.distribution', regex=False)
+    ]
+    selected_row_ids = [int(i) for i in plotted_df['id'].iloc[:n_selected]]
+    if not selected_row_ids:
+        logger.warning(f'no datasets of {plotted_ris} found; the plotting stages are skipped')
+        return results
+
+    stage('select', lambda: client.call(
+        change_tab_outputs,
+        [(A.SELECT_DATASETS_BUTTON_ID, 'n_clicks', 1), (A.SEARCH_DATASETS_BUTTON_ID, 'n_clicks', 0)],
+        search_state[:-2] + [(A.DATASETS_STORE_ID, 'data', handle),
+                             (A.DATASETS_TABLE_ID, 'selected_row_ids', selected_row_ids)],
+    ))
+
+    stage('timeseries', lambda: client.call(
+        [(A.TIMESERIES_GRAPH_ID, 'figure'), ('loading-output-2', 'children'),
+         (A.TIMESERIES_GRAPH_INFOTAB_ID, 'columns'), (A.TIMESERIES_GRAPH_INFOTAB_ID, 'data')],
+        [(A.DATASETS_STORE_ID, 'data', handle)],
+        [(A.VARIABLES_CHECKLIST_ID, 'value', variables), (A.DATASETS_TABLE_ID, 'selected_row_ids', selected_row_ids),
+         (A.APP_TABS_ID, 'value', A.PLOT_DATASETS_TAB_VALUE)],
+    ))
+    results['timeseries']['datasets'] = len(selected_row_ids)
+
+    active_cell = {'row': 0, 'column': 0, 'row_id': selected_row_ids[0], 'column_id': 'title'}
+    stage('popup', lambda: client.call(
+        [(A.QUICKLOOK_POPUP_ID, 'children')],
+        [(A.DATASETS_TABLE_ID, 'active_cell', active_cell)],
+        [(A.DATASETS_STORE_ID, 'data', handle)],
+    ))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.e2e')
+    parser.add_argument('--output', default=None, help='JSON file of results; by default benchmarks/results/e2e-<commit>.json')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--n-selected', type=int, default=3, help='number of datasets plotted')
+    parser.add_argument('--variables', nargs='+', default=None)
+    parser.add_argument('--plotted-ris', nargs='+', default=None)
+    parser.add_argument('--recordings', default=None, help='directory of a recording for the stand-in server')
+    parser.add_argument('--latency', type=float, default=0., help='latency of the stand-in server (seconds)')
+    parser.add_argument('--online', action='store_true', help="use RI's services instead of the stand-in server")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    server = None
+    data_cache_dir = None
+    if not args.online:
+        # must be set before data_access is imported
+        data_cache_dir = tempfile.mkdtemp(prefix='e2e-data-cache-')
+        os.environ['DATA_CACHE_DIR'] = data_cache_dir
+        import offline
+        server = offline.StandInServer(args.recordings, latency=args.latency).start()
+        offline.enable_replay(server.url)
+    try:
+        t0 = time.perf_counter()
+        import app
+        startup = {'import_s': time.perf_counter() - t0, 'rss_mb': get_rss_mb(), 'peak_rss_mb': get_peak_rss_mb()}
+        results = {'startup': startup}
+        results.update(run(app, variables=args.variables, plotted_ris=args.plotted_ris, n_selected=args.n_selected,
+                           repeat=args.repeat))
+    finally:
+        if server is not None:
+            server.stop()
+        if data_cache_dir is not None:
+            shutil.rmtree(data_cache_dir, ignore_errors=True)
+
+    params = {k: v for k, v in vars(args).items() if k != 'output'}
+    path = write_results(args.output, 'e2e', params, results)
+    for name, metrics in results.items():
+        times = ', '.join(f'{k}={v:.3f}' for k, v in metrics.items() if k.endswith('_s') and v is not None)
+        print(f'{name:16} {times}  payload={metrics.get("payload_bytes")}  rss={metrics.get("rss_mb")}')
+    print(f'Results written to {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+"""
+Micro-benchmarks of the pure kernels of charts (utils.charts) and of the catalogue (data_access.helper), with
+synthetic inputs of growing size:
+- kernels of time series are run on datasets of 1e3 to 1e8 samples (--max-samples, by default 1e7),
+- kernels of catalogues are run on catalogues of 10 to 1e5 rows (--max-rows).
+Sizes grow by the factor --step; a kernel is not run on larger sizes once a call exceeds the time budget (--budget
+seconds) or its input would not fit into the available memory.
+
+For each kernel, the time (the minimum of repeated calls) and the peak memory allocated by a call (tracemalloc) are
+fitted with t = t0 + c * n^k, where t0 is the fixed overhead, estimated by the value at the smallest size: c and k are
+fitted by least squares on the log-log scale to t - t0, over the sizes where t - t0 is at least t0 and
+MIN_FITTED_TIME_S (so that the fit is not dominated by overheads and timer noise). Kernels with the exponent k above
+1 + --tolerance are flagged as super-linear. The size at which a kernel reaches the time budget is extrapolated from
+the fit, which orders the kernels by the size of data at which they fail first.
+
+    python -m benchmarks.kernels [--kernels multi_line get_histogram ...] [--max-samples 1e8] [--output results.json]
+"""
+
+import argparse
+import collections
+import logging
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from .common import write_results
+
+
+logger = logging.getLogger(__name__)
+
+SAMPLES = 'samples'
+ROWS = 'rows'
+MIN_FITTED_TIME_S = 1e-3
+N_VARS = 3
+
+Kernel = collections.namedtuple('Kernel', ['name', 'size_kind', 'setup', 'run', 'bytes_per_item'])
+Kernel.__doc__ = """
+A kernel to benchmark:
+- size_kind: SAMPLES or ROWS,
+- setup: callable (n, rng) -> input (not timed),
+- run: callable (input) -> anything; the timed call,
+- bytes_per_item: rough size of the input and the kernel's working memory per sample / row (for the memory guard).
+"""
+
+
+def _time_series(n, rng, n_vars=N_VARS, labels=None):
+    """
+    :return: xarray.Dataset with n_vars variables of n samples at 1-minute resolution, with gaps of random lengths
+    """
+    time = pd.date_range('2000-01-01', periods=n, freq='1min').values
+    labels = labels or [f'v{i}' for i in range(n_vars)]
+    data_vars = {}
+    for label in labels:
+        values = rng.standard_normal(n).cumsum()
+        # about 1% of samples start a gap of up to 1000 samples
+        gap_starts = rng.integers(0, n, size=max(n // 100, 1))
+        gap_ends = np.minimum(gap_starts + rng.integers(1, 1000, size=len(gap_starts)), n)
+        gaps = np.zeros(n + 1, dtype='i4')
+        np.add.at(gaps, gap_starts, 1)
+        np.add.at(gaps, gap_ends, -1)
+        values[np.cumsum(gaps[:-1]) > 0] = np.nan
+        data_vars[label] = ('time', values, {'units': 'ppb', 'long_name': label})
+    return xr.Dataset(data_vars, coords={'time': time})
+
+
+def _catalogue(n, rng):
+    """
+    :return: pandas.DataFrame with n rows with the columns of datasets used by the Gantt views (see app.py)
+    """
+    n_stations = max(int(np.sqrt(n)), 1)
+    codes = np.array(['AP', 'AT', 'CH4', 'CO', 'CO2', 'O3', 'RH', 'WSD'], dtype=object)
+    station = rng.integers(0, n_stations, size=n)
+    ri = np.array(['ACTRIS', 'IAGOS', 'ICOS', 'SIOS'], dtype=object)[station % 4]
+    start = pd.Timestamp('1990-01-01', tz='UTC') + pd.to_timedelta(rng.integers(0, 30 * 365, size=n), unit='D')
+    end = start + pd.to_timedelta(rng.integers(1, 5 * 365, size=n), unit='D')
+    var_codes = [', '.join(sorted(rng.choice(codes, size=rng.integers(1, 4), replace=False))) for _ in range(n)]
+    platform_id = pd.Series(station).map('S{:05d}'.format)
+    return pd.DataFrame({
+        'time_period_start': start,
+        'time_period_end': end,
+        'var_codes_filtered': pd.Categorical(var_codes),
+        'platform_id': pd.Categorical(platform_id),
+        'RI': pd.Categorical(ri),
+        'platform_id_RI': pd.Categorical(platform_id + ' (' + ri + ')'),
+        'station_fullname': pd.Categorical('Station ' + platform_id),
+        'ecv_variables': [list(c.split(', ')) for c in var_codes],
+    })
+
+
+def _kernels():
+    from data_access import helper
+    from utils import charts
+
+    def contiguous_periods(df):
+        return charts.contiguous_periods(
+            df['time_period_start'], df['time_period_end'], df['var_codes_filtered'],
+            groups=df[['platform_id_RI', 'station_fullname', 'RI']]
+        )
+
+    return [
+        Kernel('multi_line', SAMPLES, lambda n, rng: {v: da.to_series() for v, da in _time_series(n, rng).items()},
+               lambda dfs: charts.multi_line(dfs), 8 * N_VARS * 8),
+        Kernel('get_histogram', SAMPLES, lambda n, rng: _time_series(n, rng, n_vars=1)['v0'],
+               lambda da: charts.get_histogram(da, 'v0'), 8 * 6),
+        Kernel('get_avail_data_by_var_heatmap', SAMPLES, lambda n, rng: _time_series(n, rng),
+               lambda ds: charts.get_avail_data_by_var_heatmap(ds, 'month'), 8 * N_VARS * 4),
+        Kernel('get_avail_data_by_var_gantt', SAMPLES,
+               lambda n, rng: _time_series(n, rng, labels=['O3_ICOS', 'CO_IAGOS', 'AP_ACTRIS']),
+               lambda ds: charts.get_avail_data_by_var_gantt(ds), 8 * N_VARS * 4),
+        # align_range takes a range of a variable (O(1)); it is called for n ranges
+        Kernel('align_range', SAMPLES, lambda n, rng: np.sort(rng.standard_normal((n, 2)) * 1e3, axis=1),
+               lambda ranges: [charts.align_range(tuple(r), nticks=10) for r in ranges], 16),
+        Kernel('contiguous_periods', ROWS, lambda n, rng: _catalogue(n, rng), contiguous_periods, 2000),
+        Kernel('categorical_label', ROWS, lambda n, rng: _catalogue(n, rng),
+               lambda df: helper.categorical_label(df['platform_id'], df['RI']), 2000),
+        Kernel('many2many_to_dictOfList', ROWS,
+               lambda n, rng: list(zip(_catalogue(n, rng)['platform_id'], rng.integers(0, 100, size=n))),
+               lambda pairs: helper.many2many_to_dictOfList(pairs), 2000),
+        Kernel('image_of_dictOfLists', ROWS,
+               lambda n, rng: (list(range(n)), {i: [f'c{i % 97}', f'c{i % 89}'] for i in range(n)}),
+               lambda args: helper.image_of_dictOfLists(*args), 2000),
+    ]
+
+
+def _available_memory_bytes():
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def get_sizes(minimum, maximum, step):
+    """
+    :return: list of int; sizes from minimum to maximum (inclusive) growing geometrically by step
+    """
+    n_sizes = int(np.floor(np.log(maximum / minimum) / np.log(step) + 1e-9)) + 1
+    return [int(round(minimum * step ** i)) for i in range(n_sizes)]
+
+
+def fit_power_law(sizes, values, min_value=0.):
+    """
+    Fit values = v0 + c * sizes^k, where v0 is the value at the smallest size; see the module docstring.
+    :return: tuple (k, c, v0); k and c are None if there are less than 2 points to fit
+    """
+    sizes, values = np.asarray(sizes, dtype='f8'), np.asarray(values, dtype='f8')
+    if len(sizes) == 0 or not np.isfinite(values[0]):
+        return None, None, None
+    v0 = values[0]
+    excess = values - v0
+    mask = np.isfinite(excess) & (excess >= max(v0, min_value)) & (sizes > 0)
+    if mask.sum() < 2:
+        return None, None, float(v0)
+    k, log_c = np.polyfit(np.log(sizes[mask]), np.log(excess[mask]), 1)
+    return float(k), float(np.exp(log_c)), float(v0)
+
+
+def measure(kernel, n, repeat, rng, trace_memory=True):
+    """
+    :return: dict with 'time_s' (the minimum over calls) and 'peak_bytes' (of a call traced with tracemalloc)
+    """
+    data = kernel.setup(n, rng)
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        kernel.run(data)
+        times.append(time.perf_counter() - t0)
+        # long calls are not repeated
+        if sum(times) > 1.:
+            break
+    res = {'time_s': min(times), 'calls': len(times)}
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            kernel.run(data)
+            res['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return res
+
+
+def run(kernel_names=None, max_samples=10**7, max_rows=10**5, step=10**0.5, repeat=3, budget=10., tolerance=0.15,
+        trace_memory=True, seed=0):
+    """
+    Run the micro-benchmarks; see the module docstring.
+    :return: dict {case: dict of metrics}; cases are '<kernel>@<size>' and '<kernel>:fit'
+    """
+    kernels = _kernels()
+    if kernel_names:
+        kernels = [k for k in kernels if k.name in kernel_names]
+    results = {}
+    for kernel in kernels:
+        sizes = get_sizes(10**3, max_samples, step) if kernel.size_kind == SAMPLES else get_sizes(10, max_rows, step)
+        measured_sizes, times, peaks = [], [], []
+        stopped_by = None
+        for n in sizes:
+            available = _available_memory_bytes()
+            if available is not None and n * kernel.bytes_per_item > 0.5 * available:
+                stopped_by = 'memory'
+                break
+            logger.info(f'{kernel.name} n={n}')
+            rng = np.random.default_rng(seed)
+            metrics = measure(kernel, n, repeat, rng, trace_memory=trace_memory)
+            results[f'{kernel.name}@{n}'] = dict(metrics, n=n, size_kind=kernel.size_kind)
+            measured_sizes.append(n)
+            times.append(metrics['time_s'])
+            peaks.append(metrics.get('peak_bytes', np.nan))
+            if metrics['time_s'] > budget:
+                stopped_by = 'budget'
+                break
+
+        time_exponent, time_coeff, time_overhead = fit_power_law(measured_sizes, times, min_value=MIN_FITTED_TIME_S)
+        memory_exponent, _, _ = fit_power_law(measured_sizes, peaks, min_value=2**16)
+        n_at_budget = None
+        if time_exponent is not None and time_exponent > 0 and budget > time_overhead:
+            n_at_budget = ((budget - time_overhead) / time_coeff) ** (1 / time_exponent)
+        results[f'{kernel.name}:fit'] = {
+            'size_kind': kernel.size_kind,
+            'max_n': max(measured_sizes) if measured_sizes else None,
+            'stopped_by': stopped_by,
+            'overhead_s': time_overhead,
+            'time_exponent': time_exponent,
+            'memory_exponent': memory_exponent,
+            'superlinear': time_exponent is not None and time_exponent > 1 + tolerance,
+            'superlinear_memory': memory_exponent is not None and memory_exponent > 1 + tolerance,
+            'n_at_budget': n_at_budget,
+        }
+    return results
+
+
+def summary(results):
+    """
+    :return: pandas.DataFrame with the fits of kernels, ordered by the size at which they reach the time budget
+    """
+    fits = {case.split(':')[0]: metrics for case, metrics in results.items() if case.endswith(':fit')}
+    df = pd.DataFrame.from_dict(fits, orient='index')
+    if df.empty:
+        return df
+    return df.sort_values(['size_kind', 'n_at_budget'], na_position='last')
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.kernels')
+    parser.add_argument('--kernels', nargs='+', default=None, help='names of kernels; by default all')
+    parser.add_argument('--max-samples', type=float, default=1e7)
+    parser.add_argument('--max-rows', type=float, default=1e5)
+    parser.add_argument('--step', type=float, default=10**0.5, help='factor of growth of sizes')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--budget', type=float, default=10., help='seconds per call; larger sizes are not run')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='exponents above 1 + tolerance are flagged as super-linear')
+    parser.add_argument('--no-memory', action='store_true', help='do not trace memory allocations')
+    parser.add_argument('--output', default=None,
+                        help='JSON file of results; by default benchmarks/results/kernels-<commit>.json')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    results = run(
+        kernel_names=args.kernels, max_samples=int(args.max_samples), max_rows=int(args.max_rows), step=args.step,
+        repeat=args.repeat, budget=args.budget, tolerance=args.tolerance, trace_memory=not args.no_memory,
+    )
+    params = {k: v for k, v in vars(args).items() if k != 'output'}
+    path = write_results(args.output, 'kernels', params, results)
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(summary(results).to_string())
+    print(f'Results written to {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,523 @@
+"""
+Load test of the app with concurrent users: each virtual user runs sessions of the user interface over HTTP, one after
+another, with think times between the interactions:
+    page load (layout) -> map_select -> search -> gantt -> table -> select -> timeseries -> popup (quick-look)
+The stations selected on the map, the searched variables, the view of the Gantt figure and the datasets plotted are
+drawn at random for each session, so that the users do not repeat each other's requests (and hit caches) all the time.
+
+The app runs either in this process (by default; RI's services are replaced with a stand-in server, see the package
+offline, and datasets read are cached in a temporary directory, as in the benchmark e2e) or elsewhere, e.g. under
+gunicorn with OFFLINE_MODE=replay (--url); the resident memory of the server (with its worker processes, for --server-pid)
+is sampled during the test. In this process, the virtual users compete with the app for the GIL, so latencies are
+overestimated; for sizing deployments, run the app separately.
+
+The results contain for each interaction the number of calls and errors, and percentiles of latency; for the whole test
+the throughput, the numbers of sessions and the resident memory of the server over time.
+
+    python -m benchmarks.load [--users 8] [--duration 60] [--think-time 1] [--output results.json]
+    python -m benchmarks.load --url http://127.0.0.1:9235 --server-pid <pid of gunicorn's master> --users 32
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+import requests
+
+from .common import get_process_tree_rss_mb, write_results
+from .e2e import DEFAULT_VARIABLES, DEFAULT_PLOTTED_RIS, get_callback_request
+
+
+logger = logging.getLogger(__name__)
+
+INTERACTIONS = ['layout', 'map_select', 'search', 'gantt', 'table', 'select', 'timeseries', 'popup']
+PERCENTILES = (50, 95, 99)
+
+# ids of components of the app (see app.py)
+APP_TABS_ID = 'app-tabs'
+SELECT_DATASETS_TAB_VALUE = 'select-datasets-tab'
+PLOT_DATASETS_TAB_VALUE = 'plot-datasets-tab'
+STATIONS_MAP_ID = 'stations-map'
+VARIABLES_CHECKLIST_ID = 'variables-checklist'
+SELECTED_STATIONS_DROPDOWN_ID = 'selected-stations-dropdown'
+SEARCH_DATASETS_BUTTON_ID = 'search-datasets-button'
+SELECT_DATASETS_BUTTON_ID = 'select-datasets-button'
+LON_MIN_ID, LON_MAX_ID, LAT_MIN_ID, LAT_MAX_ID = 'lon-min', 'lon-max', 'lat-min', 'lat-max'
+VALUE_MIN_ID, VALUE_MAX_ID = 'value-min', 'value-max'
+GANTT_VIEW_RADIO_ID = 'gantt-view-radio'
+GANTT_GRAPH_ID = 'gantt-graph'
+SELECT_DATASETS_INFOTAB_ID = 'select_datasets-infotab'
+TIMESERIES_GRAPH_ID = 'timeseries-graph'
+TIMESERIES_GRAPH_INFOTAB_ID = 'plot_datasets-infotab'
+DATASETS_TABLE_ID = 'datasets-table'
+DATASETS_TABLE_CHECKLIST_ALL_NONE_SWITCH_ID = 'datasets-table-checklist-all-none-switch'
+DATASETS_STORE_ID = 'datasets-store'
+MODAL_MAX_VARIABLES_ID = 'modal-max-variables'
+QUICKLOOK_POPUP_ID = 'quicklook-popup'
+
+
+class HttpDashClient:
+    """
+    Calls callbacks of a Dash app over HTTP like its front-end does; a client is used by one virtual user.
+    """
+    def __init__(self, base_url, timeout=300.):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    def get_layout(self):
+        """
+        :return: tuple (layout: dict, size of the JSON response in bytes, size of the response as sent in bytes)
+        """
+        r = self._session.get(f'{self.base_url}/_dash-layout', timeout=self.timeout)
+        r.raise_for_status()
+        return r.json(), len(r.content), int(r.headers.get('Content-Length', len(r.content)))
+
+    def call(self, outputs, inputs, state=()):
+        """
+        :param outputs, inputs, state: see e2e.get_callback_request
+        :return: see e2e.DashClient.call
+        """
+        body = get_callback_request(outputs, inputs, state)
+        r = self._session.post(f'{self.base_url}/_dash-update-component', json=body, timeout=self.timeout)
+        if r.status_code == 204:
+            return None, 0, 0
+        if r.status_code != 200:
+            raise RuntimeError(f'callback of {body["output"]} failed with status {r.status_code}')
+        # requests decompresses the content; the size as sent is in Content-Length
+        return r.json()['response'], len(r.content), int(r.headers.get('Content-Length', len(r.content)))
+
+    def close(self):
+        self._session.close()
+
+
+def _find_component(node, component_id):
+    if isinstance(node, dict):
+        if isinstance(node.get('props'), dict) and node['props'].get('id') == component_id:
+            return node
+        children = node.values()
+    elif isinstance(node, list):
+        children = node
+    else:
+        return None
+    for child in children:
+        found = _find_component(child, component_id)
+        if found is not None:
+            return found
+    return None
+
+
+def get_stations_points(layout):
+    """
+    :param layout: dict; the layout of the app
+    :return: list of dict's {'idx': int, 'lon': float, 'lat': float} of the stations on the map
+    """
+    stations_map = _find_component(layout, STATIONS_MAP_ID)
+    if stations_map is None:
+        raise ValueError(f'no component {STATIONS_MAP_ID} in the layout')
+    points = []
+    for trace in stations_map['props']['figure']['data']:
+        for customdata, lon, lat in zip(trace['customdata'], trace['lon'], trace['lat']):
+            points.append({'idx': int(customdata[0]), 'lon': float(lon), 'lat': float(lat)})
+    return points
+
+
+class Recorder:
+    """
+    Thread-safe record of calls: (interaction, start time relative to the beginning of the test, latency in seconds,
+    error or None, size of the response in bytes).
+    """
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.calls = []
+        self.sessions = 0
+        self.completed_sessions = 0
+        self._lock = threading.Lock()
+
+    def add(self, interaction, start, latency, error, payload_bytes):
+        with self._lock:
+            self.calls.append((interaction, start - self.t0, latency, error, payload_bytes))
+
+    def add_session(self, completed):
+        with self._lock:
+            self.sessions += 1
+            self.completed_sessions += int(completed)
+
+
+class _SessionAborted(Exception):
+    pass
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, user_id, client, recorder, stop_event, variables, plotted_ris, n_selected, think_time, seed):
+        super().__init__(name=f'virtual-user-{user_id}', daemon=True)
+        self.client = client
+        self.recorder = recorder
+        self.stop_event = stop_event
+        self.variables = variables
+        self.plotted_ris = plotted_ris
+        self.n_selected = n_selected
+        self.think_time = think_time
+        self.rng = random.Random(seed)
+
+    def _think(self):
+        if self.think_time > 0:
+            self.stop_event.wait(self.rng.expovariate(1. / self.think_time))
+        if self.stop_event.is_set():
+            raise _SessionAborted()
+
+    def _timed(self, interaction, request, *args):
+        start = time.perf_counter()
+        try:
+            response, payload_bytes, _ = request(*args)
+        except Exception as e:
+            self.recorder.add(interaction, start, time.perf_counter() - start, f'{type(e).__name__}: {e}', 0)
+            raise _SessionAborted() from e
+        self.recorder.add(interaction, start, time.perf_counter() - start, None, payload_bytes)
+        return response
+
+    def _call(self, interaction, outputs, inputs, state=()):
+        return self._timed(interaction, self.client.call, outputs, inputs, state)
+
+    def _select_on_map(self, points):
+        # a box around a random station, of 5 to 60 degrees in longitude
+        centre = self.rng.choice(points)
+        half_width = self.rng.uniform(2.5, 30.)
+        lon_min, lon_max = centre['lon'] - half_width, centre['lon'] + half_width
+        lat_min, lat_max = centre['lat'] - half_width / 2, centre['lat'] + half_width / 2
+        selected = [
+            {'lon': p['lon'], 'lat': p['lat'], 'customdata': [p['idx']]} for p in points
+            if lon_min <= p['lon'] <= lon_max and lat_min <= p['lat'] <= lat_max
+        ]
+        selected_data = {'points': selected, 'range': {'mapbox': [[lon_min, lat_max], [lon_max, lat_min]]}}
+        return self._call(
+            'map_select',
+            [(LON_MIN_ID, 'value'), (LON_MAX_ID, 'value'), (LAT_MIN_ID, 'value'), (LAT_MAX_ID, 'value'),
+             (SELECTED_STATIONS_DROPDOWN_ID, 'options'), (SELECTED_STATIONS_DROPDOWN_ID, 'value')],
+            [(STATIONS_MAP_ID, 'selectedData', selected_data)],
+        )
+
+    def run_session(self):
+        layout = self._timed('layout', self.client.get_layout)
+        self._think()
+        response = self._select_on_map(get_stations_points(layout))
+        bbox = [response[i]['value'] for i in (LON_MIN_ID, LON_MAX_ID, LAT_MIN_ID, LAT_MAX_ID)]
+        selected_stations = response[SELECTED_STATIONS_DROPDOWN_ID]['value']
+        self._think()
+
+        variables = self.rng.sample(self.variables, self.rng.randint(1, len(self.variables)))
+        search_state = [
+            (VARIABLES_CHECKLIST_ID, 'value', variables),
+            (LON_MIN_ID, 'value', bbox[0]), (LON_MAX_ID, 'value', bbox[1]),
+            (LAT_MIN_ID, 'value', bbox[2]), (LAT_MAX_ID, 'value', bbox[3]),
+            ('my-date-picker-range', 'start_date', '2000-01-01'), ('my-date-picker-range', 'end_date', '2022-01-01'),
+            (SELECTED_STATIONS_DROPDOWN_ID, 'value', selected_stations),
+            (VALUE_MIN_ID, 'value', None), (VALUE_MAX_ID, 'value', None),
+            (DATASETS_STORE_ID, 'data', None),
+            (DATASETS_TABLE_ID, 'selected_row_ids', []),
+        ]
+        change_tab_outputs = [
+            (DATASETS_STORE_ID, 'data'), (APP_TABS_ID, 'value'), ('loading-output-1', 'children'),
+            (SEARCH_DATASETS_BUTTON_ID, 'n_clicks'), (SELECT_DATASETS_BUTTON_ID, 'n_clicks'),
+            (MODAL_MAX_VARIABLES_ID, 'is_open'),
+        ]
+        response = self._call(
+            'search', change_tab_outputs,
+            [(SEARCH_DATASETS_BUTTON_ID, 'n_clicks', 1), (SELECT_DATASETS_BUTTON_ID, 'n_clicks', 0)],
+            search_state,
+        )
+        handle = response[DATASETS_STORE_ID]['data']
+        if handle is None:
+            return
+        self._think()
+
+        self._call(
+            'gantt',
+            [(GANTT_GRAPH_ID, 'figure'), (GANTT_GRAPH_ID, 'selectedData'),
+             (SELECT_DATASETS_INFOTAB_ID, 'columns'), (SELECT_DATASETS_INFOTAB_ID, 'data')],
+            [(GANTT_VIEW_RADIO_ID, 'value', self.rng.choice(['compact', 'detailed'])),
+             (DATASETS_STORE_ID, 'data', handle)],
+            [(APP_TABS_ID, 'value', SELECT_DATASETS_TAB_VALUE)],
+        )
+        response = self._call(
+            'table',
+            [(DATASETS_TABLE_ID, p) for p in ('columns', 'data', 'selected_rows', 'selected_row_ids', 'tooltip_data')],
+            [(GANTT_GRAPH_ID, 'selectedData', None), (DATASETS_TABLE_CHECKLIST_ALL_NONE_SWITCH_ID, 'value', False)],
+            [(DATASETS_STORE_ID, 'data', handle), (DATASETS_TABLE_ID, 'selected_row_ids', [])],
+        )
+        # particle number size distributions (2-dimensional) are not plotted as time series
+        rows = [
+            row for row in response[DATASETS_TABLE_ID]['data']
+            if row['RI'] in self.plotted_ris and 'particle.number.size.distribution' not in row['title']
+        ]
+        if not rows:
+            return
+        selected_row_ids = [row['id'] for row in self.rng.sample(rows, min(len(rows), self.n_selected))]
+        self._think()
+
+        self._call(
+            'select', change_tab_outputs,
+            [(SELECT_DATASETS_BUTTON_ID, 'n_clicks', 1), (SEARCH_DATASETS_BUTTON_ID, 'n_clicks', 0)],
+            search_state[:-2] + [(DATASETS_STORE_ID, 'data', handle),
+                                 (DATASETS_TABLE_ID, 'selected_row_ids', selected_row_ids)],
+        )
+        self._call(
+            'timeseries',
+            [(TIMESERIES_GRAPH_ID, 'figure'), ('loading-output-2', 'children'),
+             (TIMESERIES_GRAPH_INFOTAB_ID, 'columns'), (TIMESERIES_GRAPH_INFOTAB_ID, 'data')],
+            [(DATASETS_STORE_ID, 'data', handle)],
+            [(VARIABLES_CHECKLIST_ID, 'value', variables), (DATASETS_TABLE_ID, 'selected_row_ids', selected_row_ids),
+             (APP_TABS_ID, 'value', PLOT_DATASETS_TAB_VALUE)],
+        )
+        self._think()
+
+        row = self.rng.choice(rows)
+        active_cell = {'row': 0, 'column': 0, 'row_id': row['id'], 'column_id': 'title'}
+        self._call(
+            'popup',
+            [(QUICKLOOK_POPUP_ID, 'children')],
+            [(DATASETS_TABLE_ID, 'active_cell', active_cell)],
+            [(DATASETS_STORE_ID, 'data', handle)],
+        )
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    self.run_session()
+                    completed = True
+                except _SessionAborted:
+                    completed = False
+                self.recorder.add_session(completed)
+                if not self.stop_event.is_set():
+                    self._think_between_sessions()
+        finally:
+            self.client.close()
+
+    def _think_between_sessions(self):
+        try:
+            self._think()
+        except _SessionAborted:
+            pass
+
+
+class MemorySampler(threading.Thread):
+    """
+    Samples the resident memory of the server every interval seconds.
+    """
+    def __init__(self, pid, interval, t0):
+        super().__init__(name='memory-sampler', daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.t0 = t0
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def sample(self):
+        rss = get_process_tree_rss_mb(self.pid)
+        if rss is not None:
+            self.samples.append((round(time.perf_counter() - self.t0, 3), round(rss, 1)))
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.sample()
+
+
+def summarize(recorder, duration, memory_samples):
+    """
+    :return: dict {interaction or 'overall' or 'memory': dict of metrics}
+    """
+    results = {}
+    for interaction in INTERACTIONS:
+        calls = [c for c in recorder.calls if c[0] == interaction]
+        if not calls:
+            continue
+        latencies = np.array([latency for _, _, latency, error, _ in calls if error is None])
+        errors = [error for _, _, _, error, _ in calls if error is not None]
+        metrics = {'calls': len(calls), 'errors': len(errors), 'error_rate': len(errors) / len(calls)}
+        if len(latencies):
+            metrics.update({f'p{q}_s': float(np.percentile(latencies, q)) for q in PERCENTILES})
+            metrics.update({
+                'mean_s': float(latencies.mean()),
+                'max_s': float(latencies.max()),
+                'payload_bytes': float(np.mean([c[4] for c in calls if c[3] is None])),
+            })
+        if errors:
+            # the most frequent error, for a diagnosis
+            metrics['top_error'] = max(set(errors), key=errors.count)
+        results[interaction] = metrics
+
+    n_calls = len(recorder.calls)
+    n_errors = sum(1 for c in recorder.calls if c[3] is not None)
+    results['overall'] = {
+        'duration': duration,
+        'calls': n_calls,
+        'calls_per_second': n_calls / duration if duration > 0 else None,
+        'error_rate': n_errors / n_calls if n_calls else None,
+        'sessions': recorder.sessions,
+        'completed_sessions': recorder.completed_sessions,
+    }
+    if memory_samples:
+        rss = [mb for _, mb in memory_samples]
+        results['memory'] = {
+            'rss_start_mb': rss[0],
+            'rss_end_mb': rss[-1],
+            'rss_max_mb': max(rss),
+            'rss_growth_mb': rss[-1] - rss[0],
+            'timeline': memory_samples,
+        }
+    return results
+
+
+def run(base_url, server_pid, users=8, duration=60., ramp_up=10., think_time=1., variables=None, plotted_ris=None,
+        n_selected=3, sample_interval=1., timeout=300., seed=0):
+    """
+    Run virtual users against a running app.
+    :param base_url: str; URL of the app
+    :param server_pid: int or None; process of the server whose memory is sampled
+    :param users: int; number of concurrent virtual users
+    :param duration: float; seconds of the test (sessions under way at its end are not completed)
+    :param ramp_up: float; seconds over which the users start
+    :param think_time: float; mean of the (exponentially distributed) times between interactions
+    :param variables: list of ECV names searched for (a random subset of them in each session)
+    :param plotted_ris: list of names of RI's whose datasets are plotted
+    :param n_selected: int; maximum number of datasets plotted in a session
+    :return: dict; see summarize
+    """
+    variables = variables or DEFAULT_VARIABLES
+    plotted_ris = plotted_ris or DEFAULT_PLOTTED_RIS
+    recorder = Recorder()
+    stop_event = threading.Event()
+    sampler = MemorySampler(server_pid, sample_interval, recorder.t0) if server_pid is not None else None
+    if sampler is not None:
+        sampler.sample()
+        sampler.start()
+
+    virtual_users = [
+        VirtualUser(i, HttpDashClient(base_url, timeout=timeout), recorder, stop_event, variables, plotted_ris,
+                    n_selected, think_time, seed=f'{seed}:{i}')
+        for i in range(users)
+    ]
+    for i, user in enumerate(virtual_users):
+        if i > 0 and stop_event.wait(ramp_up / users):
+            break
+        user.start()
+        logger.info(f'{i + 1} users started')
+    stop_event.wait(max(0., duration - (time.perf_counter() - recorder.t0)))
+    stop_event.set()
+    # let the calls under way finish
+    for user in virtual_users:
+        if user.ident is not None:
+            user.join(timeout)
+    duration = time.perf_counter() - recorder.t0
+    if sampler is not None:
+        sampler.stop()
+    return summarize(recorder, duration, sampler.samples if sampler is not None else [])
+
+
+def _serve_stand_in(recordings_dir, url_queue):
+    import offline
+    server = offline.StandInServer(recordings_dir)
+    url_queue.put(server.url)
+    server.serve_forever()
+
+
+def _start_app_server(recordings_dir=None):
+    """
+    Start the app in this process, with a stand-in server for RI's services in a child process (it writes synthetic
+    NetCDF files, which must not be done concurrently with reading NetCDF files in the app, see connectors.NETCDF_LOCK).
+    :return: tuple (URL of the app, function stopping the servers)
+    """
+    from werkzeug.serving import make_server
+
+    mp_context = multiprocessing.get_context('spawn')
+    url_queue = mp_context.Queue()
+    stand_in_process = mp_context.Process(target=_serve_stand_in, args=(recordings_dir, url_queue), daemon=True)
+    stand_in_process.start()
+    stand_in_url = url_queue.get(timeout=60)
+
+    # must be set before data_access is imported
+    data_cache_dir = tempfile.mkdtemp(prefix='load-data-cache-')
+    os.environ['DATA_CACHE_DIR'] = data_cache_dir
+    import offline
+    offline.enable_replay(stand_in_url)
+    import app
+
+    server = make_server('127.0.0.1', 0, app.app.server, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, name='app-server', daemon=True)
+    thread.start()
+
+    def stop():
+        server.shutdown()
+        stand_in_process.terminate()
+        stand_in_process.join()
+        shutil.rmtree(data_cache_dir, ignore_errors=True)
+
+    return f'http://127.0.0.1:{server.server_port}', stop
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.load')
+    parser.add_argument('--output', default=None, help='JSON file of results; by default benchmarks/results/load-<commit>.json')
+    parser.add_argument('--url', default=None, help='URL of a running app; by default, the app is run in this process')
+    parser.add_argument('--server-pid', type=int, default=None, help='process of the running app (with its workers)')
+    parser.add_argument('--users', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=60., help='seconds')
+    parser.add_argument('--ramp-up', type=float, default=10., help='seconds over which the users start')
+    parser.add_argument('--think-time', type=float, default=1., help='mean seconds between interactions of a user')
+    parser.add_argument('--n-selected', type=int, default=3, help='maximum number of datasets plotted in a session')
+    parser.add_argument('--variables', nargs='+', default=None)
+    parser.add_argument('--plotted-ris', nargs='+', default=None)
+    parser.add_argument('--sample-interval', type=float, default=1., help='seconds between samples of memory')
+    parser.add_argument('--timeout', type=float, default=300., help='seconds')
+    parser.add_argument('--recordings', default=None, help='directory of a recording for the stand-in server')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    stop_servers = None
+    base_url, server_pid = args.url, args.server_pid
+    if base_url is None:
+        base_url, stop_servers = _start_app_server(args.recordings)
+        server_pid = os.getpid()
+    try:
+        results = run(
+            base_url, server_pid, users=args.users, duration=args.duration, ramp_up=args.ramp_up,
+            think_time=args.think_time, variables=args.variables, plotted_ris=args.plotted_ris,
+            n_selected=args.n_selected, sample_interval=args.sample_interval, timeout=args.timeout, seed=args.seed,
+        )
+    finally:
+        if stop_servers is not None:
+            stop_servers()
+
+    params = {k: v for k, v in vars(args).items() if k != 'output'}
+    path = write_results(args.output, 'load', params, results)
+    for interaction in INTERACTIONS:
+        metrics = results.get(interaction)
+        if metrics is None:
+            continue
+        percentiles = '  '.join(f'p{q}={metrics[f"p{q}_s"]:.3f}' for q in PERCENTILES if f'p{q}_s' in metrics)
+        print(f'{interaction:12} calls={metrics["calls"]:<5} errors={metrics["errors"]:<4} {percentiles}')
+    overall = results['overall']
+    print(f'{overall["calls_per_second"]:.2f} calls/s, {overall["completed_sessions"]}/{overall["sessions"]} sessions '
+          f'completed, error rate {overall["error_rate"]}')
+    if 'memory' in results:
+        memory = results['memory']
+        print(f'server memory: {memory["rss_start_mb"]} -> {memory["rss_end_mb"]} MiB (max {memory["rss_max_mb"]})')
+    print(f'Results written to {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -5,9 +5,18 @@ from .data_access import (
     get_datasets,
     filter_datasets_on_vars,
     filter_datasets_on_stations,
+    filter_datasets_on_value_range,
     read_dataset,
     get_start_date,
     get_end_date,
     get_dataset_from_cache,
+    get_dataset_cache_stats,
+    get_summary_stats,
     generate_id,
+    build_catalogue_snapshot,
+    get_airport_station_pairs,
+    build_airport_station_pairs,
+    warm_up,
+    start_warm_up,
 )
+from .upstream import get_health as get_upstream_health
@@ -0,0 +1,254 @@
+"""
+Packed, memory-mappable representation of catalogues of datasets (tables with a few numeric columns and many columns
+of strings, lists of strings or other JSON-serializable objects).
+
+Each column is stored as NumPy arrays in a single file:
+- 'numeric' columns (numbers, booleans, datetime64) as they are,
+- 'string' columns as int32 codes (-1 for missing values) into a pool of distinct strings,
+- 'list' columns (lists of strings) as int64 offsets into int32 codes of the elements into a pool of distinct strings,
+- 'json' columns (any other objects, e.g. lists of dicts with URL's) as codes into a pool of their JSON serializations.
+A pool of strings is a uint8 array with the concatenated UTF-8 encodings and an int64 array with offsets.
+
+The file is opened with numpy.memmap and all arrays are views of the mapping; nothing is copied and there are
+no Python objects per row, so worker processes of the app (forked or not) share the pages of the file through the page
+cache and their resident memory does not grow with the size of the catalogue. Rows are materialized as a pandas
+DataFrame only on demand (e.g. for the rows matching a search).
+
+File layout: MAGIC, header length (8 bytes, little-endian), header (JSON), arrays aligned to ALIGNMENT bytes.
+"""
+
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+
+MAGIC = b'PACKEDCAT1\n'
+ALIGNMENT = 64
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and np.isnan(value))
+
+
+def _get_column_kind(values):
+    if values.dtype != object:
+        return 'numeric'
+    if all(isinstance(v, str) or _is_missing(v) for v in values):
+        return 'string'
+    if all(isinstance(v, (list, tuple)) and all(isinstance(item, str) for item in v) for v in values):
+        return 'list'
+    return 'json'
+
+
+def _encode_strings(values):
+    """
+    :param values: sequence of str or missing values
+    :return: tuple (codes, pool_data, pool_offsets)
+    """
+    codes = np.full(len(values), -1, dtype='i4')
+    code_by_string = {}
+    for i, v in enumerate(values):
+        if not _is_missing(v):
+            codes[i] = code_by_string.setdefault(v, len(code_by_string))
+    encoded = [s.encode('utf-8') for s in code_by_string]
+    pool_offsets = np.zeros(len(encoded) + 1, dtype='i8')
+    np.cumsum([len(b) for b in encoded], out=pool_offsets[1:])
+    pool_data = np.frombuffer(b''.join(encoded), dtype='u1')
+    return codes, pool_data, pool_offsets
+
+
+def _get_column_arrays(values):
+    kind = _get_column_kind(values)
+    if kind == 'numeric':
+        return kind, {'values': np.ascontiguousarray(values)}
+    if kind == 'string':
+        codes, pool_data, pool_offsets = _encode_strings(values)
+        return kind, {'codes': codes, 'pool_data': pool_data, 'pool_offsets': pool_offsets}
+    if kind == 'list':
+        offsets = np.zeros(len(values) + 1, dtype='i8')
+        np.cumsum([len(v) for v in values], out=offsets[1:])
+        codes, pool_data, pool_offsets = _encode_strings([item for v in values for item in v])
+        return kind, {'offsets': offsets, 'codes': codes, 'pool_data': pool_data, 'pool_offsets': pool_offsets}
+    codes, pool_data, pool_offsets = _encode_strings([
+        None if _is_missing(v) else json.dumps(v, default=str) for v in values
+    ])
+    return kind, {'codes': codes, 'pool_data': pool_data, 'pool_offsets': pool_offsets}
+
+
+def pack_catalogue(df, path):
+    """
+    Write a catalogue in the packed format (atomically, so that readers never see a partially written file).
+    :param df: pandas.DataFrame; its index is not stored
+    :param path: str or path-like
+    """
+    columns = []
+    arrays = []
+    offset = 0
+    for name in df.columns:
+        kind, column_arrays = _get_column_arrays(df[name].to_numpy())
+        array_specs = {}
+        for key, array in column_arrays.items():
+            offset = -(-offset // ALIGNMENT) * ALIGNMENT
+            array_specs[key] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+            arrays.append((offset, array))
+            offset += array.nbytes
+        columns.append({'name': name, 'kind': kind, 'arrays': array_specs})
+    header = json.dumps({'n_rows': len(df), 'columns': columns}).encode('utf-8')
+    data_start = -(-(len(MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+
+    path = os.fspath(path)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC)
+            f.write(len(header).to_bytes(8, 'little'))
+            f.write(header)
+            for array_offset, array in arrays:
+                f.seek(data_start + array_offset)
+                f.write(array.tobytes())
+            f.truncate(data_start + offset)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class _StringPool:
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, code):
+        return bytes(self.data[self.offsets[code]:self.offsets[code + 1]]).decode('utf-8')
+
+    def find(self, strings):
+        """
+        :param strings: iterable of str
+        :return: numpy.ndarray of codes of those of the strings which are in the pool
+        """
+        wanted = {s.encode('utf-8') for s in strings}
+        lengths = np.diff(self.offsets)
+        wanted_lengths = np.array(sorted({len(b) for b in wanted}), dtype='i8')
+        # compare bytes only for pool entries of a matching length
+        candidates = np.flatnonzero(np.isin(lengths, wanted_lengths))
+        return np.array([
+            code for code in candidates
+            if bytes(self.data[self.offsets[code]:self.offsets[code + 1]]) in wanted
+        ], dtype='i4')
+
+
+class PackedCatalogue:
+    """
+    Read-only view of a catalogue written by pack_catalogue; see the module docstring.
+    """
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        self._buffer = np.memmap(self.path, dtype='u1', mode='r')
+        if bytes(self._buffer[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f'{self.path} is not a packed catalogue')
+        header_len = int.from_bytes(bytes(self._buffer[len(MAGIC):len(MAGIC) + 8]), 'little')
+        header_start = len(MAGIC) + 8
+        header = json.loads(bytes(self._buffer[header_start:header_start + header_len]).decode('utf-8'))
+        data_start = -(-(header_start + header_len) // ALIGNMENT) * ALIGNMENT
+        self.n_rows = header['n_rows']
+        self._kind_by_column = {}
+        self._arrays_by_column = {}
+        for column in header['columns']:
+            arrays = {}
+            for key, spec in column['arrays'].items():
+                dtype = np.dtype(spec['dtype'])
+                start = data_start + spec['offset']
+                size = int(np.prod(spec['shape'])) * dtype.itemsize
+                arrays[key] = self._buffer[start:start + size].view(dtype).reshape(spec['shape'])
+            self._kind_by_column[column['name']] = column['kind']
+            self._arrays_by_column[column['name']] = arrays
+
+    def __len__(self):
+        return self.n_rows
+
+    @property
+    def columns(self):
+        return list(self._kind_by_column)
+
+    def _get_pool(self, name):
+        arrays = self._arrays_by_column[name]
+        return _StringPool(arrays['pool_data'], arrays['pool_offsets'])
+
+    def get_column(self, name, rows=None):
+        """
+        Materialize (a subset of) a column.
+        :param name: str
+        :param rows: numpy.ndarray of int or bool, or None for all rows
+        :return: numpy.ndarray; of objects (str, lists, ...) unless the column is numeric
+        """
+        kind = self._kind_by_column[name]
+        arrays = self._arrays_by_column[name]
+        if rows is None:
+            rows = slice(None)
+        if kind == 'numeric':
+            return np.array(arrays['values'][rows])
+        pool = self._get_pool(name)
+        decoded = {}
+
+        def decode(code):
+            if code < 0:
+                return np.nan
+            if code not in decoded:
+                decoded[code] = json.loads(pool[code]) if kind == 'json' else pool[code]
+            return decoded[code]
+
+        if kind in ('string', 'json'):
+            codes = arrays['codes'][rows]
+            res = np.empty(len(codes), dtype=object)
+            res[:] = [decode(code) for code in codes.tolist()]
+            return res
+        offsets = arrays['offsets']
+        row_indices = np.arange(self.n_rows)[rows]
+        res = np.empty(len(row_indices), dtype=object)
+        res[:] = [
+            [decode(code) for code in arrays['codes'][offsets[i]:offsets[i + 1]].tolist()]
+            for i in row_indices.tolist()
+        ]
+        return res
+
+    def isin(self, name, values):
+        """
+        :param name: str; a 'string' column
+        :param values: iterable of str
+        :return: numpy.ndarray of bool; a mask of rows with the value of the column in values
+        """
+        if self._kind_by_column[name] != 'string':
+            raise ValueError(f'column {name} is not a string column')
+        codes = self._get_pool(name).find(values)
+        return np.isin(self._arrays_by_column[name]['codes'], codes)
+
+    def contains_any(self, name, values):
+        """
+        :param name: str; a 'list' column
+        :param values: iterable of str
+        :return: numpy.ndarray of bool; a mask of rows whose list contains any of values
+        """
+        if self._kind_by_column[name] != 'list':
+            raise ValueError(f'column {name} is not a list column')
+        arrays = self._arrays_by_column[name]
+        element_matches = np.isin(arrays['codes'], self._get_pool(name).find(values))
+        # number of matching elements in each row's list
+        cum_matches = np.concatenate(([0], np.cumsum(element_matches)))
+        return np.diff(cum_matches[arrays['offsets']]) > 0
+
+    def to_dataframe(self, rows=None, columns=None):
+        """
+        Materialize (a subset of) the catalogue.
+        :param rows: numpy.ndarray of int or bool, or None for all rows
+        :param columns: list of str or None for all columns
+        :return: pandas.DataFrame with a default index
+        """
+        if columns is None:
+            columns = self.columns
+        return pd.DataFrame({name: self.get_column(name, rows) for name in columns}, columns=columns)
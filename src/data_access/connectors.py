@@ -0,0 +1,413 @@
+"""
+Connectors to research infrastructures (RI's). A connector provides the stations, the variables and the datasets of
+an RI and reads its datasets; it declares capabilities which tell the engine (see data_access.data_access) how to
+schedule and cache its work.
+
+Built-in connectors (ACTRIS, IAGOS, ICOS, SIOS) are registered below; other ones can be registered by installed
+packages through the entry points group ENTRY_POINT_GROUP, e.g. in setup.cfg:
+    [options.entry_points]
+    atmo_access.ri_connectors =
+        myri = my_package.my_module:MyRIConnector
+where the name of an entry point is the lower-case RI code. A connector is loaded (and the modules it uses imported)
+only when its RI is used for the first time.
+"""
+
+import contextlib
+import datetime
+import importlib
+import json
+import logging
+import os
+import pathlib
+import threading
+
+import numpy as np
+import pandas as pd
+import pkg_resources
+import xarray as xr
+
+from utils import memory
+from . import upstream
+
+ENTRY_POINT_GROUP = 'atmo_access.ri_connectors'
+
+LON_LAT_BBOX_EPS = 0.05  # epsilon for bounding box filtering of IAGOS datasets
+
+# Capabilities of connectors
+# search queries a remote service; such searches are run concurrently
+REMOTE_SEARCH = 'remote_search'
+# read gets only the requested variables (subsetting is done by the RI's server), so read datasets are cached by URL and
+# requested variables
+SERVER_SIDE_SUBSETTING = 'server_side_subsetting'
+# datasets are read from local files, so they are not cached
+LOCAL_DATA = 'local_data'
+
+logger = logging.getLogger(__name__)
+
+# the netCDF-C library is not thread-safe, and xarray does not lock the opening of files; connectors hold this lock
+# only while netCDF-C opens and loads NetCDF files (local or remote, by OPeNDAP, where netCDF-C makes the HTTP requests
+# itself), so that concurrent callbacks in a worker do not crash it; files downloaded with requests are downloaded
+# without holding it
+NETCDF_LOCK = threading.Lock()
+
+# function mapping URL's of datasets to the URL's actually opened by libraries which bypass requests (e.g. OPeNDAP
+# access by netCDF4); see set_url_resolver
+_url_resolver = None
+
+
+def set_url_resolver(resolver):
+    """
+    Make connectors open datasets at URL's provided by resolver, e.g. at local stand-in servers (see the package
+    offline); traffic through the requests library is redirected separately.
+    :param resolver: callable str -> str or None; None restores the original URL's
+    """
+    global _url_resolver
+    _url_resolver = resolver
+
+
+def resolve_url(url):
+    return _url_resolver(url) if _url_resolver is not None else url
+
+
+def get_iagos_resource_path(name):
+    """
+    :param name: str; 'catalogue.json' or 'iagos_L3_postprocessed' (the directory of data files)
+    :return: str; path of the resource in the directory IAGOS_RESOURCES_DIR, if the environment variable is set (e.g.
+    to synthetic resources, see offline.generator), otherwise in the package's resources
+    """
+    resources_dir = os.environ.get('IAGOS_RESOURCES_DIR')
+    if resources_dir:
+        return os.path.join(resources_dir, name)
+    return pkg_resources.resource_filename('data_access', f'resources/{name}')
+
+
+class Connector:
+    """
+    Base class of RI connectors. Subclasses set the class attributes and override the methods get_stations,
+    get_variables, search and read (and possibly prepare and normalize_stations).
+    """
+    # lower-case RI code, e.g. 'actris'
+    ri = None
+    # RI name used in the column 'RI' of stations and datasets, e.g. 'ACTRIS'
+    name = None
+    # name of the module (relative to the data_access package or absolute) which implements queries to the RI
+    query_module_name = None
+    capabilities = frozenset()
+    # types of URL's the connector can read (see read_dataset); None means any
+    url_types = None
+
+    @property
+    def query_module(self):
+        return importlib.import_module(self.query_module_name, __package__)
+
+    def has_capability(self, capability):
+        return capability in self.capabilities
+
+    def warm_up(self):
+        """
+        Do the initialization which can be done in advance (e.g. import modules).
+        """
+        self.query_module
+
+    def get_nbytes(self):
+        """
+        :return: int; bytes of the data held by the connector (e.g. a catalogue)
+        """
+        return 0
+
+    def get_stations(self):
+        """
+        :return: list of dict; raw records of stations (see normalize_stations)
+        """
+        return self.query_module.get_list_platforms()
+
+    def normalize_stations(self, stations_df):
+        """
+        Bring the stations data to the common format.
+        :param stations_df: pandas.DataFrame made of the records returned by get_stations
+        :return: pandas.DataFrame with columns 'uri', 'short_name', 'long_name', 'country', 'latitude', 'longitude',
+        'ground_elevation', 'RI', 'theme'
+        """
+        return stations_df
+
+    def get_variables(self):
+        """
+        :return: list of dict with keys 'variable_name', 'ECV_name'
+        """
+        return self.query_module.get_list_variables()
+
+    def search(self, variables, bbox, period):
+        """
+        :param variables: list of str; standard ECV names
+        :param bbox: list [lon_min, lat_min, lon_max, lat_max] or an empty list
+        :param period: list [start, end] or an empty list
+        :return: pandas.DataFrame with columns 'title', 'urls', 'ecv_variables', 'time_period', 'platform_id', 'RI'
+        (and possibly 'selector') or None
+        """
+        raise NotImplementedError
+
+    def read(self, url, ds_metadata):
+        """
+        Read a dataset as provided by the RI; the result is cached by read_dataset, unless the connector has
+        the LOCAL_DATA capability.
+        :param url: str
+        :param ds_metadata: pandas.Series; a row of the dataframe returned by get_datasets
+        :return: xarray.Dataset or None
+        """
+        raise NotImplementedError
+
+    def prepare(self, ds, ds_metadata):
+        """
+        Post-process a dataset returned by read (possibly from cache), e.g. select the requested variables.
+        :return: xarray.Dataset
+        """
+        return ds
+
+
+class ActrisConnector(Connector):
+    ri = 'actris'
+    name = 'ACTRIS'
+    query_module_name = '.query_actris'
+    capabilities = frozenset({REMOTE_SEARCH, SERVER_SIDE_SUBSETTING})
+    url_types = ('opendap', )
+
+    def normalize_stations(self, stations_df):
+        stations_df = stations_df.rename(columns={'URI': 'uri', 'altitude': 'ground_elevation'})
+        stations_df['RI'] = self.name
+        stations_df['country'] = np.nan
+        stations_df['theme'] = np.nan
+        return stations_df
+
+    def search(self, variables, bbox, period):
+        datasets = self.query_module.query_datasets(variables=variables, temporal_extent=period, spatial_extent=bbox)
+        if not datasets:
+            return None
+        datasets_df = pd.DataFrame.from_dict(datasets)
+
+        # fix title for ACTRIS datasets: remove time span
+        datasets_df['title'] = datasets_df['title'].str.slice(stop=-62)
+
+        datasets_df['RI'] = self.name
+        return datasets_df
+
+    def read(self, url, ds_metadata):
+        with NETCDF_LOCK, upstream.measure(url) as read:
+            ds = self.query_module.read_dataset(resolve_url(url), ds_metadata['ecv_variables_filtered'])
+            if ds is None:
+                return None
+            ds = ds.load().copy()
+            read['nbytes'] = ds.nbytes
+            return ds
+
+
+class IagosConnector(Connector):
+    """
+    Temporary solution for IAGOS L3 data access until REST access is provided (using local files access).
+    """
+    ri = 'iagos'
+    name = 'IAGOS'
+    query_module_name = '.query_iagos'
+    capabilities = frozenset({LOCAL_DATA})
+
+    STD_ECV_TO_VCODE = {
+        'Carbon Monoxide': 'CO_mean',
+        'Ozone': 'O3_mean',
+    }
+
+    def __init__(self):
+        self._catalogue_df = None
+
+    def get_catalogue(self):
+        if self._catalogue_df is None:
+            url = get_iagos_resource_path('catalogue.json')
+            with open(url, 'r') as f:
+                md = json.load(f)
+            self._catalogue_df = pd.DataFrame.from_records(md)
+        return self._catalogue_df
+
+    def get_nbytes(self):
+        return memory.get_static_nbytes(self._catalogue_df)
+
+    def warm_up(self):
+        super().warm_up()
+        self.get_catalogue()
+
+    def normalize_stations(self, stations_df):
+        stations_df = stations_df.rename(columns={'altitude': 'ground_elevation'})
+        stations_df['RI'] = self.name
+        stations_df['uri'] = np.nan
+        stations_df['country'] = np.nan
+        stations_df['theme'] = np.nan
+        return stations_df
+
+    def search(self, variables, bbox, period):
+        variables = set(variables)
+        df = self.get_catalogue()
+        variables_filter = df['ecv_variables'].map(lambda vs: bool(variables.intersection(vs)))
+        lon_min, lat_min, lon_max, lat_max = bbox
+        eps = LON_LAT_BBOX_EPS
+        bbox_filter = (df['longitude'] >= lon_min - eps) & (df['longitude'] <= lon_max + eps) & \
+                      (df['latitude'] >= lat_min - eps) & (df['latitude'] <= lat_max + eps)
+        df = df[variables_filter & bbox_filter].explode('layer', ignore_index=True)
+        df['title'] = df['title'] + ' in ' + df['layer']
+        df['selector'] = 'layer:' + df['layer']
+        df = df[['title', 'urls', 'ecv_variables', 'time_period', 'platform_id', 'RI', 'selector']]
+        return df
+
+    def read(self, url, ds_metadata):
+        data_path = pathlib.Path(get_iagos_resource_path('iagos_L3_postprocessed'))
+        with NETCDF_LOCK:
+            ds = xr.open_dataset(data_path / url)
+            if 'selector' in ds_metadata and ds_metadata['selector'] is not np.nan and bool(ds_metadata['selector']):
+                dim, *coord = ds_metadata['selector'].split(':')
+                coord = ':'.join(coord)
+                ds = ds.sel({dim: coord})
+            vs = [self.STD_ECV_TO_VCODE[v] for v in ds_metadata['std_ecv_variables_filtered']]
+            return ds[vs].load()
+
+
+class IcosConnector(Connector):
+    ri = 'icos'
+    name = 'ICOS'
+    query_module_name = '.query_icos'
+    capabilities = frozenset({REMOTE_SEARCH})
+
+    def normalize_stations(self, stations_df):
+        for col in ['latitude', 'longitude', 'ground_elevation']:
+            stations_df[col] = pd.to_numeric(stations_df[col])
+        return stations_df
+
+    def search(self, variables, bbox, period):
+        datasets = self.query_module.query_datasets(variables=variables, temporal=period, spatial=bbox)
+        if not datasets:
+            return None
+        datasets_df = pd.DataFrame.from_dict(datasets)
+        datasets_df['RI'] = self.name
+        return datasets_df
+
+    def read(self, url, ds_metadata):
+        return self.query_module.read_dataset(url)
+
+    def prepare(self, ds, ds_metadata):
+        from .data_access import get_vars_long
+
+        vars_long = get_vars_long()
+        variables_names_filtered = list(vars_long.join(
+            pd.DataFrame(index=ds_metadata['std_ecv_variables_filtered']),
+            on='std_ECV_name',
+            how='inner')['variable_name'].unique())
+        variables_names_filtered = [v for v in ds if v in variables_names_filtered]
+        ds_filtered = ds[['TIMESTAMP'] + variables_names_filtered].compute()
+        return ds_filtered.assign_coords({'index': ds['TIMESTAMP']}).rename({'index': 'time'}).drop_vars('TIMESTAMP')
+
+
+class SiosConnector(Connector):
+    ri = 'sios'
+    name = 'SIOS'
+    query_module_name = '.query_sios'
+    capabilities = frozenset({REMOTE_SEARCH, SERVER_SIDE_SUBSETTING})
+    url_types = ('opendap', )
+
+    def normalize_stations(self, stations_df):
+        stations_df = stations_df.rename(columns={'URI': 'uri'})
+        stations_df['RI'] = self.name
+        stations_df['country'] = np.nan
+        stations_df['theme'] = np.nan
+        return stations_df
+
+    def search(self, variables, bbox, period):
+        bbox2 = bbox
+        if len(bbox) == 0:
+            bbox2 = [None, None, None, None]
+        datasets = self.query_module.query_datasets(variables_list=variables, temporal_extent=period, spatial_extent=bbox2)
+        if not datasets:
+            return None
+        for ds in datasets:
+            ds['time_period'][1] = datetime.datetime.today().strftime('%Y-%m-%dT%H:%M:%S') #'2021-01-31T23:00:00Z'
+        datasets_df = pd.DataFrame.from_dict(datasets)
+        datasets_df['RI'] = self.name
+        return datasets_df
+
+    @staticmethod
+    def _is_opened_by_netcdf_c(url):
+        # datasets of the ERDDAP server of CNR are downloaded with requests as NetCDF-3 files and decoded in memory by
+        # scipy; the other ones are opened by OPeNDAP (see query_sios.read_dataset)
+        return 'iadc.cnr.it' not in url
+
+    def read(self, url, ds_metadata):
+        opened_url = resolve_url(url)
+        lock = NETCDF_LOCK if self._is_opened_by_netcdf_c(opened_url) else contextlib.nullcontext()
+        with lock, upstream.measure(url) as read:
+            ds = self.query_module.read_dataset(
+                opened_url, ds_metadata['ecv_variables_filtered'], [None, None], [None, None, None, None]
+            )
+            if ds is None:
+                return None
+            ds = ds.load()
+            read['nbytes'] = ds.nbytes
+            return ds
+
+    def prepare(self, ds, ds_metadata):
+        if not ds.coords: # some files don't have coordinates
+            ds = ds.set_coords('time')
+            ds = ds.drop_vars(['latitude', "longitude", 'station_id'])
+        return ds
+
+
+_BUILTIN_CONNECTOR_CLASSES = [ActrisConnector, IagosConnector, IcosConnector, SiosConnector]
+
+_lock = threading.Lock()
+_connector_by_ri = {}
+_entry_point_by_ri = None
+
+
+def _get_entry_points():
+    global _entry_point_by_ri
+    if _entry_point_by_ri is None:
+        _entry_point_by_ri = {}
+        for entry_point in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP):
+            ri = entry_point.name.lower()
+            if ri in _entry_point_by_ri or any(ri == cls.ri for cls in _BUILTIN_CONNECTOR_CLASSES):
+                logger.warning(f'RI connector {ri} from {entry_point.dist} ignored: the RI is already registered')
+                continue
+            _entry_point_by_ri[ri] = entry_point
+    return _entry_point_by_ri
+
+
+def get_ris():
+    """
+    List codes of RI's of all registered connectors, without loading them.
+    :return: list of str; built-in RI's first
+    """
+    return [cls.ri for cls in _BUILTIN_CONNECTOR_CLASSES] + sorted(_get_entry_points())
+
+
+def get_loaded_connectors():
+    """
+    :return: list of Connector; the connectors loaded so far
+    """
+    with _lock:
+        return list(_connector_by_ri.values())
+
+
+def get_connector(ri):
+    """
+    Provide the connector of an RI; it is loaded on the first call.
+    :param ri: str; RI code, case-insensitive
+    :return: Connector
+    """
+    ri = ri.lower()
+    with _lock:
+        connector = _connector_by_ri.get(ri)
+        if connector is None:
+            for cls in _BUILTIN_CONNECTOR_CLASSES:
+                if cls.ri == ri:
+                    break
+            else:
+                try:
+                    cls = _get_entry_points()[ri].load()
+                except KeyError:
+                    raise ValueError(f'ri={ri}')
+            connector = cls()
+            _connector_by_ri[ri] = connector
+    return connector
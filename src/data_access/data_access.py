@@ -7,32 +7,72 @@ import numpy as np
 import pandas as pd
 import logging
 import pathlib
-import json
 import datetime
 from datetime import date
+import hashlib
 import itertools
-import xarray as xr
 from mmappickle.dict import mmapdict
 import re
-
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import sketches
+from utils import memory
+from utils import metrics
+from utils import tracing
+from utils.file_lock import file_lock, atomic_write_pickle
 from . import helper
-from . import query_actris
-from . import query_iagos
-from . import query_icos
-from . import query_sios
+from . import connectors
+from . import catalogue_store
 
 
-LON_LAT_BBOX_EPS = 0.05  # epsil
-CACHE_DIR = pathlib.PurePath(pkg_resources.resource_filename('data_access', 'cache'))
+# the catalogues of RI's can be taken from elsewhere, e.g. from synthetic ones (see offline.generator)
+CACHE_DIR = pathlib.PurePath(os.environ.get('CACHE_DIR') or pkg_resources.resource_filename('data_access', 'cache'))
+# datasets read from RI's and their summary statistics can be cached elsewhere than the catalogues, e.g. by benchmarks
+# run against stand-ins of RI's (see the package offline), so that synthetic data does not get into the app's caches
+DATA_CACHE_DIR = pathlib.PurePath(os.environ.get('DATA_CACHE_DIR') or CACHE_DIR)
 logger = logging.getLogger(__name__)
 
+CONNECTOR_SECONDS = metrics.histogram(
+    'connector_call_seconds', 'Duration of calls of RI connectors', ['ri', 'operation', 'outcome'])
+CONNECTOR_BYTES = metrics.counter('connector_read_bytes_total', 'Bytes of datasets read by RI connectors', ['ri'])
+READ_DATASET_SECONDS = metrics.histogram(
+    'read_dataset_step_seconds', 'Duration of the steps of read_dataset', ['ri', 'step'])
+
 
 # for caching purposes
 _stations = None
 _variables = None
 
-_RIS = ['actris', 'iagos', 'icos', 'sios']
-_GET_DATASETS_BY_RI = dict()
+# stations and variables of all RI's, prebuilt from the per-RI caches, so that the app can start without them
+_CATALOGUE_SNAPSHOT_PATH = CACHE_DIR / 'catalogue_snapshot.pkl'
+# version of the format of the snapshot's dataframes; snapshots of another version are rebuilt
+_CATALOGUE_SNAPSHOT_VERSION = 2
+
+# pairs of IAGOS airports and ground stations nearby measuring the same ECV's (see build_airport_station_pairs)
+_AIRPORT_STATION_PAIRS_PATH = CACHE_DIR / 'airport_station_pairs.pkl'
+_airport_station_pairs = None
+_airport_station_pairs_lock = threading.Lock()
+
+# datasets of RI's in the packed, memory-mapped format (see catalogue_store), shared by all worker processes
+_packed_datasets_by_ri = {}
+_packed_datasets_lock = threading.Lock()
+
+# hits and misses of the caches of datasets read from RI's (data_<ri>.pkl), in this process
+_dataset_cache_stats = {'hits': 0, 'misses': 0}
+
+
+def _get_catalogue_nbytes():
+    frames = [_stations, _variables, _airport_station_pairs]
+    return sum(memory.get_static_nbytes(df) for df in frames) + \
+        sum(connector.get_nbytes() for connector in connectors.get_loaded_connectors())
+
+
+# catalogue data is needed all the time, so it is only accounted; decoded datasets are accounted while they are alive
+memory.register('catalogue', _get_catalogue_nbytes)
+DECODED_DATASETS = 'decoded_datasets'
 
 # mapping from standard ECV names to short variable names (used for time-line graphs)
 # must be updated on adding new RI's!
@@ -58,72 +98,26 @@ _var_codes_by_ECV = pd.Series(VARIABLES_MAPPING, name='code')
 _ECV_by_var_codes = pd.Series({v: k for k, v in VARIABLES_MAPPING.items()}, name='ECV')
 
 
-def _get_ri_query_module_by_ri(ris=None):
-    if ris is None:
-        ris = _RIS
-    else:
-        ris = sorted(ri.lower() for ri in ris)
-    ri_query_module_by_ri = {}
-    for ri in ris:
-        if ri == 'actris':
-            ri_query_module_by_ri[ri] = query_actris
-        elif ri == 'iagos':
-            ri_query_module_by_ri[ri] = query_iagos
-        elif ri == 'icos':
-            ri_query_module_by_ri[ri] = query_icos
-        elif ri == 'sios':
-            ri_query_module_by_ri[ri] = query_sios
-        else:
-            raise ValueError(f'ri={ri}')
-    return ri_query_module_by_ri
-
-
-_ri_query_module_by_ri = _get_ri_query_module_by_ri()
-
-
 def _get_stations(ris=None):
-    ri_query_module_by_ri = _get_ri_query_module_by_ri(ris)
+    ris = connectors.get_ris() if ris is None else sorted(ri.lower() for ri in ris)
     stations_dfs = []
-    for ri, ri_query_module in ri_query_module_by_ri.items():
+    for ri in ris:
         cache_path = CACHE_DIR / f'stations_{ri}.pkl'
         try:
+            connector = connectors.get_connector(ri)
             try:
                 stations_df = pd.read_pickle(cache_path)
             except FileNotFoundError:
-                stations = ri_query_module.get_list_platforms()
+                stations = connector.get_stations()
                 stations_df = pd.DataFrame.from_dict(stations)
-                stations_df.to_pickle(cache_path)
-                
-            if ri == 'actris':
-                stations_df = stations_df.rename(columns={'URI': 'uri', 'altitude': 'ground_elevation'})
-                stations_df['RI'] = 'ACTRIS'
-                stations_df['country'] = np.nan
-                stations_df['theme'] = np.nan
-                stations_dfs.append(stations_df)
-            elif ri == 'iagos':
-                stations_df = stations_df.rename(columns={'altitude': 'ground_elevation'})
-                stations_df['RI'] = 'IAGOS'
-                stations_df['uri'] = np.nan
-                stations_df['country'] = np.nan
-                stations_df['theme'] = np.nan
-                stations_dfs.append(stations_df)
-            elif ri == 'icos':
-                for col in ['latitude', 'longitude', 'ground_elevation']:
-                    stations_df[col] = pd.to_numeric(stations_df[col])
-                stations_dfs.append(stations_df)
-            elif ri == 'sios':
-                stations_df = stations_df.rename(columns={'URI': 'uri'})
-                stations_df['RI'] = 'SIOS'
-                stations_df['country'] = np.nan
-                stations_df['theme'] = np.nan
-                stations_dfs.append(stations_df)                
-            else:
-                raise ValueError(f'ri={ri}')
+                atomic_write_pickle(stations_df, cache_path)
+            stations_dfs.append(connector.normalize_stations(stations_df))
         except Exception as e:
             logger.exception(f'getting {ri.upper()} stations failed', exc_info=e)
 
     all_stations_df = pd.concat(stations_dfs, ignore_index=True)
-    all_stations_df['short_name_RI'] = all_stations_df['short_name'] + ' (' + all_stations_df['RI'] + ')'
+    all_stations_df['RI'] = all_stations_df['RI'].astype('category')
+    all_stations_df['short_name_RI'] = helper.categorical_label(all_stations_df['short_name'], all_stations_df['RI'])
     all_stations_df['idx'] = all_stations_df.index
     all_stations_df['marker_size'] = 7
 
@@ -136,6 +130,7 @@ def get_stations():
     :return: pandas Dataframe with stations data; it has the following columns:
     'uri', 'short_name', 'long_name', 'country', 'latitude', 'longitude', 'ground_elevation', 'RI', 'short_name_RI',
     'theme', 'idx'
+    The columns 'RI' and 'short_name_RI' are categorical; 'idx' is an integer key of the station (equal to the index).
     A sample record is:
         'uri': 'http://meta.icos-cp.eu/resources/stations/AS_BIR',
         'short_name': 'BIR',
@@ -151,7 +146,8 @@ def get_stations():
     """
     global _stations
     if _stations is None:
-        _stations = _get_stations()
+        snapshot = _load_catalogue_snapshot()
+        _stations = snapshot['stations'] if snapshot is not None else _get_stations()
     return _stations
 
 def get_start_date():
@@ -160,6 +156,26 @@ def get_start_date():
 def get_end_date():
     return datetime.datetime.today()
 
+def _get_vars_long():
+    variables_dfs = []
+    for ri in connectors.get_ris():
+        cache_path = CACHE_DIR / f'variables_{ri}.pkl'
+        try:
+            try:
+                variables_df = pd.read_pickle(cache_path)
+            except FileNotFoundError:
+                variables = connectors.get_connector(ri).get_variables()
+                variables_df = pd.DataFrame.from_dict(variables)
+                atomic_write_pickle(variables_df, cache_path)
+            variables_dfs.append(variables_df)
+        except Exception as e:
+            logger.exception(f'getting {ri.upper()} variables failed', exc_info=e)
+    df = pd.concat(variables_dfs, ignore_index=True)
+    df['std_ECV_name'] = df['ECV_name'].apply(lambda l: l[0])
+    df = df.join(_var_codes_by_ECV, on='std_ECV_name')
+    return df.explode('ECV_name', ignore_index=True).drop_duplicates(keep='first', ignore_index=True)
+
+
 def get_vars_long():
     """
     Provide a listing of RI's variables. For the same variable code there might be many records with different ECV names
@@ -170,26 +186,59 @@ def get_vars_long():
     """
     global _variables
     if _variables is None:
-        variables_dfs = []
-        for ri, ri_query_module in _ri_query_module_by_ri.items():
-            cache_path = CACHE_DIR / f'variables_{ri}.pkl'
-            try:
-                try:
-                    variables_df = pd.read_pickle(cache_path)
-                except FileNotFoundError:
-                    variables = ri_query_module.get_list_variables()
-                    variables_df = pd.DataFrame.from_dict(variables)
-                    variables_df.to_pickle(cache_path)
-                variables_dfs.append(variables_df)
-            except Exception as e:
-                logger.exception(f'getting {ri.upper()} variables failed', exc_info=e)
-        df = pd.concat(variables_dfs, ignore_index=True)
-        df['std_ECV_name'] = df['ECV_name'].apply(lambda l: l[0])
-        df = df.join(_var_codes_by_ECV, on='std_ECV_name')
-        _variables = df.explode('ECV_name', ignore_index=True).drop_duplicates(keep='first', ignore_index=True)
+        snapshot = _load_catalogue_snapshot()
+        _variables = snapshot['variables'] if snapshot is not None else _get_vars_long()
     return _variables
 
 
+def _get_catalogue_sources_mtime():
+    # modification times of the per-RI caches the snapshot is built from; None if some cache is missing
+    try:
+        return {
+            f'{kind}_{ri}': os.path.getmtime(CACHE_DIR / f'{kind}_{ri}.pkl')
+            for kind in ('stations', 'variables') for ri in connectors.get_ris()
+        }
+    except OSError:
+        return None
+
+
+def _load_catalogue_snapshot():
+    """
+    :return: dict with keys 'stations', 'variables' or None, if there is no snapshot or it is out of date with respect
+    to the per-RI caches
+    """
+    try:
+        snapshot = pd.read_pickle(_CATALOGUE_SNAPSHOT_PATH)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.exception('loading the catalogue snapshot failed', exc_info=e)
+        return None
+    sources_mtime = _get_catalogue_sources_mtime()
+    if snapshot.get('version') != _CATALOGUE_SNAPSHOT_VERSION:
+        return None
+    if sources_mtime is None or snapshot.get('sources_mtime') != sources_mtime:
+        return None
+    return snapshot
+
+
+def build_catalogue_snapshot():
+    """
+    Build stations and variables of all RI's from the per-RI caches (querying RI's for the missing ones) and save
+    them in a single snapshot file, which is loaded by get_stations and get_vars_long at the app startup.
+    """
+    global _stations, _variables
+    _stations, _variables = _get_stations(), _get_vars_long()
+    snapshot = {
+        'stations': _stations,
+        'variables': _variables,
+        'sources_mtime': _get_catalogue_sources_mtime(),
+        'version': _CATALOGUE_SNAPSHOT_VERSION,
+    }
+    atomic_write_pickle(snapshot, _CATALOGUE_SNAPSHOT_PATH)
+    return snapshot
+
+
 def get_vars():
     """
     Provide a listing of RI's variables.
@@ -201,6 +250,20 @@ def get_vars():
     variables_df = get_vars_long().drop(columns=['variable_name'])
     return variables_df.drop_duplicates(subset=['std_ECV_name', 'ECV_name'], keep='first', ignore_index=True)
 
+def _get_std_ECV_names_by_name():
+    # dict {ECV name or RI variable name: set of standard ECV names}
+    vars_long = get_vars_long()
+    std_ECV_names_by_ECV_name = helper.many2many_to_dictOfList(
+        zip(vars_long['ECV_name'].to_list(), vars_long['std_ECV_name'].to_list()), keep_set=True
+    )
+    std_ECV_names_by_variable_name = helper.many2many_to_dictOfList(
+        zip(vars_long['variable_name'].to_list(), vars_long['std_ECV_name'].to_list()), keep_set=True
+    )
+    return helper.many2manyLists_to_dictOfList(
+        itertools.chain(std_ECV_names_by_ECV_name.items(), std_ECV_names_by_variable_name.items()), keep_set=True
+    )
+
+@tracing.traced('get_datasets')
 def get_datasets(variables, lon_min=None, lon_max=None, lat_min=None, lat_max=None, start=None, end=None, selected_RIs=None):
     """
     Provide metadata of datasets selected according to the provided criteria.
@@ -211,7 +274,7 @@ def get_datasets(variables, lon_min=None, lon_max=None, lat_min=None, lat_max=No
     :param lat_max: float or None
     :return: pandas.DataFrame with columns: 'title', 'url', 'ecv_variables', 'platform_id', 'RI', 'var_codes',
      'ecv_variables_filtered', 'std_ecv_variables_filtered', 'var_codes_filtered',
-     'time_period_start', 'time_period_end', 'platform_id_RI';
+     'time_period_start', 'time_period_end', 'platform_id_RI', 'station_idx', 'var_stats';
     e.g. for the call get_datasets(['Pressure (surface)', 'Temperature (near surface)'] one gets a dataframe with an example row like:
          'title': 'ICOS_ATC_L2_L2-2021.1_GAT_2.5_CTS_MTO.zip',
          'url': [{'url': 'https://meta.icos-cp.eu/objects/0HxLXMXolAVqfcuqpysYz8jK', 'type': 'landing_page'}],
@@ -224,7 +287,14 @@ def get_datasets(variables, lon_min=None, lon_max=None, lat_min=None, lat_max=No
          'var_codes_filtered': 'AP, AT',
          'time_period_start': Timestamp('2016-05-10 00:00:00+0000', tz='UTC'),
          'time_period_end': Timestamp('2021-01-31 23:00:00+0000', tz='UTC'),
-         'platform_id_RI': 'GAT (ICOS)'
+         'platform_id_RI': 'GAT (ICOS)',
+         'station_idx': 41,
+         'var_stats': None
+    The columns 'platform_id', 'RI', 'var_codes_filtered' and 'platform_id_RI' are categorical; 'station_idx' is
+    the integer key of the dataset's station (the column 'idx' of the dataframe returned by get_stations), or -1 if
+    the station is unknown.
+    'var_stats' contains summary statistics of the dataset's variables (see get_summary_stats), if the dataset has
+    already been read
     """
     if variables is None:
         variables = []
@@ -239,21 +309,18 @@ def get_datasets(variables, lon_min=None, lon_max=None, lat_min=None, lat_max=No
     else:
         period = [start, end]
 
-    datasets_dfs = []
-    for ri, get_ri_datasets in _GET_DATASETS_BY_RI.items():
-        if ri.upper() in selected_RIs:
-            cache_path = CACHE_DIR / f'datasets_{ri}.pkl'
-            try:
-                try:
-                    df = pd.read_pickle(cache_path)
-                except FileNotFoundError:
-                    df = get_ri_datasets(variables, bbox, period)
-                    df.to_pickle(cache_path)
-            except Exception as e:
-                logger.exception(f'getting datasets for {ri.upper()} failed', exc_info=e)
-            if df is not None:
-                datasets_dfs.append(df)
-    
+    ris = [ri for ri in connectors.get_ris() if ri.upper() in selected_RIs]
+    # searches of connectors querying remote services are run concurrently; the other ones in the current thread
+    remote_ris = [ri for ri in ris if connectors.get_connector(ri).has_capability(connectors.REMOTE_SEARCH)]
+    with ThreadPoolExecutor(max_workers=max(len(remote_ris), 1)) as executor:
+        future_by_ri = {
+            ri: executor.submit(tracing.run_in_context(_get_ri_datasets), ri, variables, bbox, period)
+            for ri in remote_ris
+        }
+        df_by_ri = {ri: _get_ri_datasets(ri, variables, bbox, period) for ri in ris if ri not in future_by_ri}
+        df_by_ri.update((ri, future.result()) for ri, future in future_by_ri.items())
+    datasets_dfs = [df_by_ri[ri] for ri in ris if df_by_ri[ri] is not None]
+
     if not datasets_dfs:
         return None
     datasets_df = pd.concat(datasets_dfs, ignore_index=True)#.reset_index()
@@ -274,15 +341,7 @@ def get_datasets(variables, lon_min=None, lon_max=None, lat_min=None, lat_max=No
         for vs in datasets_df['ecv_variables'].to_list()
     ]
 
-    std_ECV_names_by_ECV_name = helper.many2many_to_dictOfList(
-        zip(vars_long['ECV_name'].to_list(), vars_long['std_ECV_name'].to_list()), keep_set=True
-    )
-    std_ECV_names_by_variable_name = helper.many2many_to_dictOfList(
-        zip(vars_long['variable_name'].to_list(), vars_long['std_ECV_name'].to_list()), keep_set=True
-    )
-    std_ECV_names_by_name = helper.many2manyLists_to_dictOfList(
-        itertools.chain(std_ECV_names_by_ECV_name.items(), std_ECV_names_by_variable_name.items()), keep_set=True
-    )
+    std_ECV_names_by_name = _get_std_ECV_names_by_name()
     datasets_df['ecv_variables_filtered'] = [
         sorted(
             v for v in vs if std_ECV_names_by_name[v].intersection(variables)
@@ -296,81 +355,89 @@ def get_datasets(variables, lon_min=None, lon_max=None, lat_min=None, lat_max=No
         for vs in datasets_df['ecv_variables'].to_list()
     ]
     req_var_codes = helper.image_of_dict(variables, VARIABLES_MAPPING)
-    datasets_df['var_codes_filtered'] = [
+    datasets_df['var_codes_filtered'] = pd.Categorical([
         ', '.join(sorted(vc for vc in var_codes if vc in req_var_codes))
         for var_codes in datasets_df['var_codes'].to_list()
-    ]
+    ])
     datasets_df['time_period_start'] = datasets_df['time_period'].apply(lambda x: pd.Timestamp(x[0]))
     datasets_df['time_period_end'] = datasets_df['time_period'].apply(lambda x: pd.Timestamp(x[1]))
-    datasets_df['platform_id_RI'] = datasets_df['platform_id'] + ' (' + datasets_df['RI'] + ')'
+    datasets_df['platform_id'] = datasets_df['platform_id'].astype('category')
+    datasets_df['RI'] = datasets_df['RI'].astype('category')
+    datasets_df['platform_id_RI'] = helper.categorical_label(datasets_df['platform_id'], datasets_df['RI'])
+    datasets_df['station_idx'] = _get_station_idx(datasets_df['platform_id_RI'])
+    datasets_df = _attach_summary_stats(datasets_df)
 
     return datasets_df.drop(columns=['time_period']).rename(columns={'urls': 'url'})
 
-def _get_actris_datasets(variables, bbox, period):
-    print("Search ACTRIS datasets...")
-    datasets = query_actris.query_datasets(variables=variables, temporal_extent=period, spatial_extent=bbox)
-    print("done")
-    if not datasets:
-        return None
-    datasets_df = pd.DataFrame.from_dict(datasets)
-
-    # fix title for ACTRIS datasets: remove time span
-    datasets_df['title'] = datasets_df['title'].str.slice(stop=-62)
+def _get_station_idx(short_name_RI):
+    """
+    Map labels 'short_name (RI)' of stations to their integer keys; the mapping is done once per distinct label.
+    :param short_name_RI: pandas.Series of category dtype
+    :return: numpy.ndarray of int; -1 for unknown stations
+    """
+    stations = get_stations()
+    # short_name of a station is not always unique within an RI; the first station wins
+    stations = stations.drop_duplicates(subset='short_name_RI', keep='first')
+    idx_by_label = pd.Series(stations['idx'].to_numpy(), index=stations['short_name_RI'].astype(object))
+    category_idx = idx_by_label.reindex(short_name_RI.cat.categories.astype(object)).fillna(-1).to_numpy(dtype='i8')
+    # code -1 (a missing label) picks the trailing -1
+    return np.append(category_idx, -1)[short_name_RI.cat.codes.to_numpy()]
 
-    datasets_df['RI'] = 'ACTRIS'
-    return datasets_df
 
-def _get_icos_datasets(variables, bbox, period):
-    print("Search ICOS datasets...")
-    datasets = query_icos.query_datasets(variables=variables, temporal=period, spatial=bbox)
-    print("done")
-    if not datasets:
-        return None
-    datasets_df = pd.DataFrame.from_dict(datasets)
-    datasets_df['RI'] = 'ICOS'
-    return datasets_df
-
-def _get_sios_datasets(variables, bbox, period):
-    print("Search SIOS datasets...")
-    bbox2 = bbox
-    if len(bbox) == 0:
-        bbox2 = [None,None,None,None]
-    datasets = query_sios.query_datasets(variables_list=variables, temporal_extent=period, spatial_extent=bbox2)
-    print("done")
-    if not datasets:
+def _get_packed_datasets(ri):
+    """
+    Provide the datasets of an RI in the packed format, (re)building the packed file from the per-RI cache if needed.
+    :return: catalogue_store.PackedCatalogue or None, if there is no per-RI cache of datasets
+    """
+    pickle_path = CACHE_DIR / f'datasets_{ri}.pkl'
+    packed_path = CACHE_DIR / f'datasets_{ri}.cat'
+    with _packed_datasets_lock:
+        packed = _packed_datasets_by_ri.get(ri)
+        if packed is not None:
+            return packed
+        try:
+            pickle_mtime = os.path.getmtime(pickle_path)
+        except FileNotFoundError:
+            return None
+        with file_lock(packed_path):
+            if not os.path.exists(packed_path) or os.path.getmtime(packed_path) < pickle_mtime:
+                catalogue_store.pack_catalogue(pd.read_pickle(pickle_path), packed_path)
+        packed = catalogue_store.PackedCatalogue(packed_path)
+        _packed_datasets_by_ri[ri] = packed
+        return packed
+
+
+def _get_variable_names(variables):
+    # all names (ECV names and RI variable names) of the given standard ECV variables
+    vars_long = get_vars_long()
+    vars_long = vars_long[vars_long['std_ECV_name'].isin(variables)]
+    return set(variables) | set(vars_long['ECV_name']) | set(vars_long['variable_name'])
+
+
+@tracing.traced('get_ri_datasets')
+def _get_ri_datasets(ri, variables, bbox, period):
+    cache_path = CACHE_DIR / f'datasets_{ri}.pkl'
+    tracing.annotate(ri=ri)
+    try:
+        packed = _get_packed_datasets(ri)
+        tracing.annotate(cached=packed is not None)
+        if packed is None:
+            logger.info(f'searching {ri.upper()} datasets...')
+            start = time.perf_counter()
+            df = _call_connector(ri, 'search', variables, bbox, period)
+            logger.info(f'searching {ri.upper()} datasets done in {time.perf_counter() - start:.1f}s')
+            if df is None:
+                return None
+            atomic_write_pickle(df, cache_path)
+            packed = _get_packed_datasets(ri)
+        # only the datasets with some of the variables are materialized; without variables, all datasets are
+        if not variables:
+            return packed.to_dataframe()
+        return packed.to_dataframe(rows=packed.contains_any('ecv_variables', _get_variable_names(variables)))
+    except Exception as e:
+        logger.exception(f'getting datasets for {ri.upper()} failed', exc_info=e)
+        tracing.record_error(e)
         return None
-    for ds in datasets:
-        ds['time_period'][1] = datetime.datetime.today().strftime('%Y-%m-%dT%H:%M:%S') #'2021-01-31T23:00:00Z'
-    datasets_df = pd.DataFrame.from_dict(datasets)
-    datasets_df['RI'] = 'SIOS'
-    return datasets_df
-
-# Temporary solution for IAGOS L3 data access until REST access is provided (using local files access).
-_iagos_catalogue_df = None
-
-def _get_iagos_datasets_catalogue():
-    global _iagos_catalogue_df
-    if _iagos_catalogue_df is None:
-        url = pkg_resources.resource_filename('data_access', 'resources/catalogue.json')
-        with open(url, 'r') as f:
-            md = json.load(f)
-        _iagos_catalogue_df = pd.DataFrame.from_records(md)
-    return _iagos_catalogue_df
-
-def _get_iagos_datasets(variables, bbox, period):
-    print("Search IAGOS datasets...")
-    variables = set(variables)
-    df = _get_iagos_datasets_catalogue()
-    print("done")
-    variables_filter = df['ecv_variables'].map(lambda vs: bool(variables.intersection(vs)))
-    lon_min, lat_min, lon_max, lat_max = bbox
-    bbox_filter = (df['longitude'] >= lon_min - LON_LAT_BBOX_EPS) & (df['longitude'] <= lon_max + LON_LAT_BBOX_EPS) & \
-                  (df['latitude'] >= lat_min - LON_LAT_BBOX_EPS) & (df['latitude'] <= lat_max + LON_LAT_BBOX_EPS)
-    df = df[variables_filter & bbox_filter].explode('layer', ignore_index=True)
-    df['title'] = df['title'] + ' in ' + df['layer']
-    df['selector'] = 'layer:' + df['layer']
-    df = df[['title', 'urls', 'ecv_variables', 'time_period', 'platform_id', 'RI', 'selector']]
-    return df
 
 def filter_datasets_on_stations(datasets_df, stations_short_name):
     """
@@ -395,11 +462,213 @@ def filter_datasets_on_vars(datasets_df, var_codes):
 def generate_id(url):
     return re.sub(r"[^a-z0-9]","",url.lower())
 
+def _get_dataset_id(connector, url, ds_metadata):
+    # connectors with server-side subsetting read only the requested variables, so datasets read from the same URL
+    # with different variables are distinct; a digest of the variables keeps keys of mmapdict caches short
+    dataset_id = generate_id(url)
+    if connector.has_capability(connectors.SERVER_SIDE_SUBSETTING):
+        variables = ds_metadata.get('ecv_variables_filtered') if ds_metadata is not None else None
+        if isinstance(variables, (list, tuple, np.ndarray)) and len(variables) > 0:
+            digest = hashlib.sha1(','.join(sorted(variables)).encode()).hexdigest()[:10]
+            dataset_id = f'{dataset_id}_{digest}'
+    return dataset_id
+
+def _get_stats_key(dataset_id, ds_metadata):
+    # the same file might contain many datasets (e.g. IAGOS layers), which are distinguished by the selector
+    selector = ds_metadata.get('selector') if ds_metadata is not None else None
+    if isinstance(selector, str) and selector:
+        return f'{dataset_id}_{generate_id(selector)}'
+    return dataset_id
+
+
+def _get_from_mmapdict(cache_path, key):
+    """
+    Get a value from an mmapdict cache file shared by workers of the app (under a shared lock).
+    :return: the value or None, if the key or the file is missing
+    """
+    cache = cache_path.stem
+    with metrics.timer(metrics.CACHE_SECONDS, cache=cache, operation='get'):
+        with file_lock(cache_path, shared=True):
+            try:
+                m = mmapdict(str(cache_path), readonly=True)
+            except FileNotFoundError:
+                value = None
+            else:
+                value = m[key] if key in m else None
+    metrics.CACHE_LOOKUPS.inc(cache=cache, result='hit' if value is not None else 'miss')
+    if value is not None:
+        metrics.CACHE_BYTES.inc(_get_nbytes(value), cache=cache, operation='get')
+    return value
+
+
+def _put_to_mmapdict(cache_path, key, value):
+    """
+    Put a value to an mmapdict cache file shared by workers of the app (under an exclusive lock), unless the key is
+    already there (e.g. written by another worker in the meantime).
+    """
+    cache = cache_path.stem
+    with metrics.timer(metrics.CACHE_SECONDS, cache=cache, operation='put'):
+        with file_lock(cache_path):
+            m = mmapdict(str(cache_path))
+            if key not in m:
+                m[key] = value
+                metrics.CACHE_BYTES.inc(_get_nbytes(value), cache=cache, operation='put')
+
+
+def _merge_to_mmapdict(cache_path, key, value):
+    """
+    Merge a dict into the dict stored under the key in an mmapdict cache file shared by workers of the app (under an
+    exclusive lock); entries already there (e.g. written by another worker in the meantime) are kept.
+    """
+    cache = cache_path.stem
+    with metrics.timer(metrics.CACHE_SECONDS, cache=cache, operation='put'):
+        with file_lock(cache_path):
+            m = mmapdict(str(cache_path))
+            stored = m[key] if key in m else {}
+            merged = {**value, **stored}
+            if len(merged) > len(stored):
+                m[key] = merged
+
+
+def _get_nbytes(value):
+    # size of the data of datasets and arrays; other values (e.g. summary statistics) are not measured
+    return getattr(value, 'nbytes', 0)
+
+
+def _call_connector(ri, operation, *args):
+    """
+    Call a method of the connector of the RI, measuring its duration and (for read) the size of the dataset read.
+    """
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        with tracing.span(f'connector {operation}', ri=ri):
+            res = getattr(connectors.get_connector(ri), operation)(*args)
+        outcome = 'ok' if res is not None else 'none'
+        if operation == 'read' and res is not None:
+            CONNECTOR_BYTES.inc(_get_nbytes(res), ri=ri)
+        return res
+    finally:
+        CONNECTOR_SECONDS.observe(time.perf_counter() - start, ri=ri, operation=operation, outcome=outcome)
+
+
+_SUMMARY_STATS_CACHE_PATH = DATA_CACHE_DIR / 'stats.pkl'
+
+
+def _compute_summary_stats(ds):
+    stats = {}
+    for v, da in ds.items():
+        # text variables (e.g. station_id of ERDDAP datasets) have no value range
+        if not np.issubdtype(da.dtype, np.number):
+            continue
+        sketch = sketches.sketch_dataarray(da)
+        stats[v] = {
+            'count': sketch.count,
+            'min': sketch.min,
+            'max': sketch.max,
+            'mean': sketch.mean if sketch.count > 0 else np.nan,
+            'coverage': sketch.coverage,
+        }
+    return stats
+
+
+def _record_summary_stats(dataset_id, ds_metadata, ds):
+    # a dataset might be read with different variables (e.g. by searches for different ECV's); statistics of variables
+    # not recorded yet are added to the record of the dataset
+    key = _get_stats_key(dataset_id, ds_metadata)
+    recorded_stats = _get_from_mmapdict(_SUMMARY_STATS_CACHE_PATH, key) or {}
+    stats = _compute_summary_stats({v: da for v, da in ds.items() if v not in recorded_stats})
+    if stats:
+        _merge_to_mmapdict(_SUMMARY_STATS_CACHE_PATH, key, stats)
+
+
+def get_summary_stats(dataset_id, ds_metadata=None):
+    """
+    Provide summary statistics of a dataset, recorded when its variables were read for the first time (see read_dataset).
+    :param dataset_id: str; as returned by read_dataset
+    :param ds_metadata: dict-like or None; dataset metadata as in a row of get_datasets result
+    :return: dict {variable_name: {'count': int, 'min': float, 'max': float, 'mean': float, 'coverage': float}} or None;
+    coverage is the fraction of valid (not null) samples
+    """
+    return _get_from_mmapdict(_SUMMARY_STATS_CACHE_PATH, _get_stats_key(dataset_id, ds_metadata))
+
+
+def _get_url_candidates(url):
+    if isinstance(url, (list, tuple)):
+        return [u for single_url in url for u in _get_url_candidates(single_url)]
+    if isinstance(url, dict):
+        return _get_url_candidates(url['url'])
+    return [url] if isinstance(url, str) else []
+
+
+def _attach_summary_stats(datasets_df):
+    columns = [c for c in ('RI', 'urls', 'selector', 'ecv_variables_filtered') if c in datasets_df]
+    keys_by_row = []
+    for ds_metadata in datasets_df[columns].to_dict(orient='records'):
+        connector = connectors.get_connector(ds_metadata['RI'])
+        keys_by_row.append([
+            _get_stats_key(_get_dataset_id(connector, url, ds_metadata), ds_metadata)
+            for url in _get_url_candidates(ds_metadata['urls'])
+        ])
+    # only the statistics of the candidate datasets are unpickled; the index of keys is read when the file is opened
+    with file_lock(_SUMMARY_STATS_CACHE_PATH, shared=True):
+        try:
+            m = mmapdict(str(_SUMMARY_STATS_CACHE_PATH), readonly=True)
+        except FileNotFoundError:
+            stats_by_key = {}
+        else:
+            keys = set(m.keys()).intersection(k for row_keys in keys_by_row for k in row_keys)
+            stats_by_key = {k: m[k] for k in keys}
+
+    def get_var_stats(row_keys):
+        for k in row_keys:
+            stats = stats_by_key.get(k)
+            if stats is not None:
+                return stats
+        return None
+
+    datasets_df['var_stats'] = [get_var_stats(row_keys) for row_keys in keys_by_row]
+    return datasets_df
+
+
+def filter_datasets_on_value_range(datasets_df, value_min=None, value_max=None):
+    """
+    Filter datasets on summary statistics of their variables. A dataset is dropped only if the statistics are known
+    and none of its variables has values within [value_min, value_max].
+    :param datasets_df: pandas.DataFrame with datasets metadata (in the format returned by get_datasets function)
+    :param value_min: float or None
+    :param value_max: float or None
+    :return: pandas.DataFrame
+    """
+    if value_min is None and value_max is None:
+        return datasets_df
+    value_min = -np.inf if value_min is None else value_min
+    value_max = np.inf if value_max is None else value_max
+
+    def overlaps(var_stats):
+        if not isinstance(var_stats, dict) or not var_stats:
+            return True
+        return any(
+            stats['count'] > 0 and stats['min'] <= value_max and stats['max'] >= value_min
+            for stats in var_stats.values()
+        )
+
+    return datasets_df[datasets_df['var_stats'].map(overlaps)]
+
+
 def get_dataset_from_cache(ri, id):
-    cache_path = CACHE_DIR / f'data_{ri}.pkl'
-    m = mmapdict(str(cache_path))
-    return m[id]
+    cache_path = DATA_CACHE_DIR / f'data_{ri.lower()}.pkl'
+    with file_lock(cache_path, shared=True):
+        m = mmapdict(str(cache_path), readonly=True)
+        return m[id]
 
+def get_dataset_cache_stats():
+    """
+    :return: dict with numbers of hits and misses of the caches of datasets read from RI's, in this process
+    """
+    return dict(_dataset_cache_stats)
+
+@tracing.traced('read_dataset')
 def read_dataset(ri, url, ds_metadata):
     if isinstance(url, (list, tuple)):
         ds = None
@@ -409,84 +678,209 @@ def read_dataset(ri, url, ds_metadata):
                 break
         return ds
 
-    if isinstance(url, dict):      
-        if ri.lower() == "actris": # Only reading 'opendap' urls for ACTRIS.
-            if url['type'] != None and url['type'] != "opendap":
-                print('ACTRIS URL ignored, not opendap')
-                return None          
-        
-        if ri.lower() == "sios": # Only reading 'opendap' urls for SIOS.
-            if url['type'] != None and url['type'] != "opendap":
-                print('SIOS URL ignored, not opendap')
-                return None          
+    connector = connectors.get_connector(ri)
+    if isinstance(url, dict):
+        if connector.url_types is not None and url['type'] is not None and url['type'] not in connector.url_types:
+            logger.info(f'{connector.name} URL ignored, not {" or ".join(connector.url_types)}')
+            return None
         return read_dataset(ri, url['url'], ds_metadata)
 
     if not isinstance(url, str):
         raise ValueError(f'url must be str; got: {url} of type={type(url)}')
 
     ri = ri.lower()
-    
-    # generating unique identifier for the dataset from URL, lower and removing special characters.
-    dataset_id = generate_id(url)
-    cache_path = CACHE_DIR / f'data_{ri}.pkl'
-    m = mmapdict(str(cache_path))
-    if ri == 'actris':
-        if dataset_id not in m:
-            ds = _ri_query_module_by_ri[ri].read_dataset(url, ds_metadata['ecv_variables_filtered'])  
-            ds = ds.load().copy()
-            if ds is None:
-                print("ACTRIS dataset couldn't be loaded")
-                return None        
-            m[dataset_id] = ds
-        else:
-            ds = m[dataset_id]
-    elif ri == 'icos':
-        if dataset_id not in m:
-            ds = _ri_query_module_by_ri[ri].read_dataset(url)
-            m[dataset_id] = ds
-        else:
-            ds = m[dataset_id]
-        vars_long = get_vars_long()
-        variables_names_filtered = list(vars_long.join(
-            pd.DataFrame(index=ds_metadata['std_ecv_variables_filtered']),
-            on='std_ECV_name',
-            how='inner')['variable_name'].unique())
-        variables_names_filtered = [v for v in ds if v in variables_names_filtered]
-        ds_filtered = ds[['TIMESTAMP'] + variables_names_filtered].compute()
-        ds = ds_filtered.assign_coords({'index': ds['TIMESTAMP']}).rename({'index': 'time'}).drop_vars('TIMESTAMP')
-    elif ri == 'sios':
-        if dataset_id not in m:
-            ds = _ri_query_module_by_ri[ri].read_dataset(url, ds_metadata['ecv_variables_filtered'],  [None,None], [None, None, None, None])
-            m[dataset_id] = ds
-        else:
-            ds = m[dataset_id]
-        if not ds.coords: # some files don't have coordinates
-            ds = ds.set_coords('time')
-            ds = ds.drop_vars(['latitude', "longitude", 'station_id'])
-    elif ri == 'iagos':
-        data_path = pathlib.Path(pkg_resources.resource_filename('data_access', 'resources/iagos_L3_postprocessed'))
-        ds = xr.open_dataset(data_path / url)
-        if 'selector' in ds_metadata and ds_metadata['selector'] is not np.nan and bool(ds_metadata['selector']):
-            dim, *coord = ds_metadata['selector'].split(':')
-            coord = ':'.join(coord)
-            ds = ds.sel({dim: coord})
-        std_ecv_to_vcode = {
-            'Carbon Monoxide': 'CO_mean',
-            'Ozone': 'O3_mean',
-        }
-        vs = [std_ecv_to_vcode[v] for v in ds_metadata['std_ecv_variables_filtered']]
-        ds = ds[vs].load()
+
+    # generating unique identifier for the dataset from URL, lower and removing special characters (and from the
+    # requested variables, if the connector reads only them).
+    dataset_id = _get_dataset_id(connector, url, ds_metadata)
+    tracing.annotate(ri=ri, url=url)
+    if connector.has_capability(connectors.LOCAL_DATA):
+        with metrics.timer(READ_DATASET_SECONDS, ri=ri, step='read'):
+            ds = _call_connector(ri, 'read', url, ds_metadata)
     else:
-        raise ValueError(f'unknown RI={ri}')
-        
+        cache_path = DATA_CACHE_DIR / f'data_{ri}.pkl'
+        with metrics.timer(READ_DATASET_SECONDS, ri=ri, step='cache_get'):
+            ds = _get_from_mmapdict(cache_path, dataset_id)
+        _dataset_cache_stats['hits' if ds is not None else 'misses'] += 1
+        tracing.annotate(cache='hit' if ds is not None else 'miss')
+        if ds is None:
+            # the lock is not held while reading from the RI; if another worker reads the same dataset meanwhile,
+            # the first one to finish writes it to the cache
+            with metrics.timer(READ_DATASET_SECONDS, ri=ri, step='read'):
+                ds = _call_connector(ri, 'read', url, ds_metadata)
+            if ds is None:
+                logger.warning(f"{connector.name} dataset couldn't be loaded")
+                return None
+            with metrics.timer(READ_DATASET_SECONDS, ri=ri, step='cache_put'):
+                _put_to_mmapdict(cache_path, dataset_id, ds)
+    with metrics.timer(READ_DATASET_SECONDS, ri=ri, step='prepare'):
+        ds = connector.prepare(ds, ds_metadata)
+
     res = {}
     if ds is not None:
         for v, da in ds.items():
             res[v] = da
+        with metrics.timer(READ_DATASET_SECONDS, ri=ri, step='summary_stats'):
+            _record_summary_stats(dataset_id, ds_metadata, res)
+        memory.track(res.values(), DECODED_DATASETS)
+        # caches give way to the datasets being plotted
+        memory.enforce_budget()
     return res, dataset_id
         
-#! same order as in _RIs
-_GET_DATASETS_BY_RI.update(zip(_RIS, (_get_actris_datasets, _get_iagos_datasets, _get_icos_datasets, _get_sios_datasets)))
+def _get_airport_station_pairs_sources_mtime():
+    # modification times of the files the airport-station pairs are built from (None for missing ones)
+    paths = [CACHE_DIR / f'{kind}_{ri}.pkl' for kind in ('stations', 'variables', 'datasets') for ri in connectors.get_ris()]
+    paths.append(connectors.get_iagos_resource_path('catalogue.json'))
+    return {os.fspath(path): os.path.getmtime(path) if os.path.exists(path) else None for path in paths}
+
+
+def _get_ground_stations_ECVs():
+    """
+    :return: pandas.DataFrame with columns 'station_idx', 'longitude', 'latitude', 'std_ECV_name'; a row per
+    station (other than IAGOS) and standard ECV name of its datasets
+    """
+    std_ECV_names_by_name = _get_std_ECV_names_by_name()
+    dfs = []
+    for ri in connectors.get_ris():
+        if ri == 'iagos':
+            continue
+        packed = _get_packed_datasets(ri)
+        if packed is None:
+            logger.warning(f'no datasets catalogue of {ri.upper()}; its stations are not paired with IAGOS airports')
+            continue
+        dfs.append(packed.to_dataframe(columns=['platform_id', 'RI', 'ecv_variables']))
+    if not dfs:
+        return pd.DataFrame(columns=['station_idx', 'longitude', 'latitude', 'std_ECV_name'])
+    df = pd.concat(dfs, ignore_index=True)
+    df['station_idx'] = _get_station_idx(helper.categorical_label(df['platform_id'], df['RI']))
+    df['std_ECV_name'] = [sorted(helper.image_of_dictOfLists(vs, std_ECV_names_by_name)) for vs in df['ecv_variables']]
+    df = df[df['station_idx'] >= 0].explode('std_ECV_name').dropna(subset=['std_ECV_name'])
+    df = df[['station_idx', 'std_ECV_name']].drop_duplicates(ignore_index=True)
+    return df.join(get_stations().set_index('idx')[['longitude', 'latitude']], on='station_idx')
+
+
+def build_airport_station_pairs():
+    """
+    Precompute pairs of IAGOS airports (with a layer of vertical profiles) and ground stations of other RI's
+    within proximity.MAX_RADIUS_KM which have datasets with the same ECV's, and save them in the cache.
+    :return: pandas.DataFrame; see get_airport_station_pairs
+    """
+    from . import proximity
+
+    global _airport_station_pairs
+    sources_mtime = _get_airport_station_pairs_sources_mtime()
+    std_ECV_names_by_name = _get_std_ECV_names_by_name()
+    airports_df = connectors.get_connector('iagos').get_catalogue()
+    airports_df = pd.DataFrame({
+        'airport': airports_df['platform_id'],
+        'longitude': airports_df['longitude'],
+        'latitude': airports_df['latitude'],
+        'layer': airports_df['layer'],
+        'std_ECV_name': [sorted(helper.image_of_dictOfLists(vs, std_ECV_names_by_name)) for vs in airports_df['ecv_variables']],
+    }).explode('layer').explode('std_ECV_name').dropna(subset=['layer', 'std_ECV_name'])
+
+    pairs_df = proximity.join_airports_with_stations(airports_df, _get_ground_stations_ECVs())
+    pairs_df['airport_idx'] = _get_station_idx(
+        helper.categorical_label(pairs_df['airport'], pd.Series('IAGOS', index=pairs_df.index))
+    )
+    for col in ['airport', 'layer', 'std_ECV_name']:
+        pairs_df[col] = pairs_df[col].astype('category')
+    pairs_df = pairs_df[['airport', 'airport_idx', 'layer', 'std_ECV_name', 'station_idx', 'distance_km']]
+    atomic_write_pickle(
+        {'pairs': pairs_df, 'radius_km': proximity.MAX_RADIUS_KM, 'sources_mtime': sources_mtime},
+        _AIRPORT_STATION_PAIRS_PATH
+    )
+    _airport_station_pairs = pairs_df
+    return pairs_df
+
+
+def _get_airport_station_pairs():
+    global _airport_station_pairs
+    with _airport_station_pairs_lock:
+        if _airport_station_pairs is None:
+            from . import proximity
+
+            try:
+                cached = pd.read_pickle(_AIRPORT_STATION_PAIRS_PATH)
+            except FileNotFoundError:
+                cached = None
+            if cached is not None and cached['radius_km'] == proximity.MAX_RADIUS_KM and \
+                    cached['sources_mtime'] == _get_airport_station_pairs_sources_mtime():
+                _airport_station_pairs = cached['pairs']
+            else:
+                build_airport_station_pairs()
+        return _airport_station_pairs
+
+
+def get_airport_station_pairs(airports=None, layers=None, variables=None, radius_km=None):
+    """
+    Provide pairs of IAGOS airports and ground stations nearby (ACTRIS, ICOS, SIOS) which measure the same ECV's,
+    e.g. for colocation of IAGOS vertical profiles with ground observations. The pairs are precomputed (see
+    build_airport_station_pairs), so the query only filters them.
+    :param airports: list of str or None; IAGOS platform_id's of airports (e.g. 'FRA'); None for all airports
+    :param layers: list of str or None; layers of IAGOS profiles ('500m', 'PBL', 'FT', 'UT'); None for all layers
+    :param variables: list of str or None; standard ECV names; None for all variables
+    :param radius_km: float or None; maximal distance of a station from an airport (at most proximity.MAX_RADIUS_KM);
+    if None, proximity.DEFAULT_RADIUS_KM
+    :return: pandas.DataFrame with columns 'airport', 'airport_idx', 'layer', 'std_ECV_name', 'station_idx',
+    'distance_km'; 'airport_idx' and 'station_idx' are integer keys of stations (the column 'idx' of the dataframe
+    returned by get_stations); a sample record is:
+        'airport': 'FRA', 'airport_idx': 66, 'layer': 'PBL', 'std_ECV_name': 'Carbon Monoxide', 'station_idx': 312,
+        'distance_km': 41.3
+    """
+    from . import proximity
+
+    if radius_km is None:
+        radius_km = proximity.DEFAULT_RADIUS_KM
+    pairs_df = _get_airport_station_pairs()
+    mask = pairs_df['distance_km'].to_numpy() <= radius_km
+    if airports is not None:
+        mask &= pairs_df['airport'].isin(airports).to_numpy()
+    if layers is not None:
+        mask &= pairs_df['layer'].isin(layers).to_numpy()
+    if variables is not None:
+        mask &= pairs_df['std_ECV_name'].isin(variables).to_numpy()
+    return pairs_df[mask]
+
+
+def warm_up():
+    """
+    Do the work deferred at the app startup: load RI connectors and warm them up (import RI query modules, load
+    the IAGOS catalogue, etc.), open the packed datasets catalogues, (re)build the catalogue snapshot, if it is
+    missing or out of date, and load (or build) the pairs of IAGOS airports and ground stations nearby.
+    """
+    for ri in connectors.get_ris():
+        try:
+            connectors.get_connector(ri).warm_up()
+        except Exception as e:
+            logger.exception(f'warming up {ri.upper()} connector failed', exc_info=e)
+        try:
+            _get_packed_datasets(ri)
+        except Exception as e:
+            logger.exception(f'opening {ri.upper()} datasets catalogue failed', exc_info=e)
+    if _load_catalogue_snapshot() is None:
+        build_catalogue_snapshot()
+    try:
+        _get_airport_station_pairs()
+    except Exception as e:
+        logger.exception('building pairs of IAGOS airports and ground stations failed', exc_info=e)
+
+
+def start_warm_up():
+    """
+    Run warm_up in a background (daemon) thread.
+    :return: threading.Thread
+    """
+    def run():
+        try:
+            warm_up()
+        except Exception as e:
+            logger.exception('warm-up failed', exc_info=e)
+
+    thread = threading.Thread(target=run, name='data_access-warm-up', daemon=True)
+    thread.start()
+    return thread
+
 
 if __name__ == "__main__":
     pass
\ No newline at end of file
@@ -1,4 +1,6 @@
 import functools
+import numpy as np
+import pandas as pd
 import toolz
 
 
@@ -29,3 +31,21 @@ def image_of_dict(dom, dic):
 
 def image_of_dictOfLists(dom, dic):
     return functools.reduce(lambda img, x: img.union(dic.get(x, [])), dom, set())
+
+
+def categorical_label(name, qualifier):
+    """
+    Build labels 'name (qualifier)', e.g. 'BIR (ICOS)', as a pandas Categorical with sorted categories; strings are
+    concatenated once per distinct pair (name, qualifier) only. A label is missing if name or qualifier is missing.
+    :param name: pandas.Series
+    :param qualifier: pandas.Series with the same index as name
+    :return: pandas.Series of category dtype
+    """
+    if len(name) == 0:
+        return pd.Series(pd.Categorical([]), index=name.index, dtype='category')
+    codes, uniques = pd.factorize(pd.MultiIndex.from_arrays([name.astype(object), qualifier.astype(object)]))
+    labels = pd.Index(uniques.get_level_values(0) + ' (' + uniques.get_level_values(1) + ')', dtype=object)
+    categories = labels.dropna().unique().sort_values()
+    label_codes = categories.get_indexer(labels)
+    codes = np.where(codes >= 0, label_codes[np.maximum(codes, 0)], -1)
+    return pd.Series(pd.Categorical.from_codes(codes, categories=categories), index=name.index)
@@ -0,0 +1,92 @@
+"""
+Proximity joins of IAGOS airports (where vertical profiles are measured) with ground stations of other RI's.
+
+Points are mapped to unit vectors in 3D and indexed with a KD-tree (scipy.spatial.cKDTree). A great-circle distance d
+on the sphere of radius R corresponds to the chord length 2 * sin(d / (2 * R)), which is monotonic in d, so
+a query of the tree with the chord length of a radius finds exactly the points within the radius (for the haversine
+distance); the distances of the found pairs are then computed with the haversine formula.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+
+EARTH_RADIUS_KM = 6371.0088
+# radius of the precomputed pairs; smaller radii are queried by filtering the pairs on the distance
+MAX_RADIUS_KM = 500.
+DEFAULT_RADIUS_KM = 100.
+
+
+def _to_unit_vectors(lon, lat):
+    lon = np.radians(np.asarray(lon, dtype='f8'))
+    lat = np.radians(np.asarray(lat, dtype='f8'))
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
+def haversine_km(lon1, lat1, lon2, lat2):
+    """
+    :return: numpy.ndarray; great-circle distances in km between points (lon1, lat1) and (lon2, lat2), in degrees
+    """
+    lon1, lat1, lon2, lat2 = (np.radians(np.asarray(a, dtype='f8')) for a in (lon1, lat1, lon2, lat2))
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0, 1)))
+
+
+def find_pairs_within_radius(lon_a, lat_a, lon_b, lat_b, radius_km):
+    """
+    Find all pairs of points (a, b) not farther from each other than radius_km.
+    :param lon_a: array-like of longitudes of points a (degrees); points with missing coordinates are skipped
+    :param lat_a: array-like of latitudes of points a
+    :param lon_b: array-like of longitudes of points b
+    :param lat_b: array-like of latitudes of points b
+    :param radius_km: float
+    :return: tuple of numpy.ndarray (positions of points a, positions of points b, distances in km)
+    """
+    lon_a, lat_a, lon_b, lat_b = (np.asarray(x, dtype='f8') for x in (lon_a, lat_a, lon_b, lat_b))
+    valid_a = np.flatnonzero(np.isfinite(lon_a) & np.isfinite(lat_a))
+    valid_b = np.flatnonzero(np.isfinite(lon_b) & np.isfinite(lat_b))
+    empty = np.empty(0, dtype='i8')
+    if len(valid_a) == 0 or len(valid_b) == 0:
+        return empty, empty, np.empty(0, dtype='f8')
+    tree_a = cKDTree(_to_unit_vectors(lon_a[valid_a], lat_a[valid_a]))
+    tree_b = cKDTree(_to_unit_vectors(lon_b[valid_b], lat_b[valid_b]))
+    chord = 2 * np.sin(min(radius_km / (2 * EARTH_RADIUS_KM), np.pi / 2))
+    pairs = tree_a.query_ball_tree(tree_b, r=chord)
+    i_a = np.repeat(np.arange(len(pairs), dtype='i8'), [len(js) for js in pairs])
+    i_b = np.fromiter((j for js in pairs for j in js), dtype='i8', count=len(i_a))
+    i_a, i_b = valid_a[i_a], valid_b[i_b]
+    distance = haversine_km(lon_a[i_a], lat_a[i_a], lon_b[i_b], lat_b[i_b])
+    # the chord test is exact up to rounding errors; make the result consistent with the haversine distance
+    within = distance <= radius_km
+    return i_a[within], i_b[within], distance[within]
+
+
+def join_airports_with_stations(airports_df, stations_df, radius_km=MAX_RADIUS_KM):
+    """
+    Find ground stations within a radius from airports which measure the same ECV's.
+    :param airports_df: pandas.DataFrame with columns 'airport', 'longitude', 'latitude', 'layer', 'std_ECV_name';
+    a row per airport, layer and standard ECV name
+    :param stations_df: pandas.DataFrame with columns 'station_idx', 'longitude', 'latitude', 'std_ECV_name';
+    a row per station and standard ECV name
+    :param radius_km: float
+    :return: pandas.DataFrame with columns 'airport', 'layer', 'std_ECV_name', 'station_idx', 'distance_km',
+    sorted by airport, layer, ECV and distance
+    """
+    columns = ['airport', 'layer', 'std_ECV_name', 'station_idx', 'distance_km']
+    airports = airports_df[['airport', 'longitude', 'latitude']].drop_duplicates('airport', ignore_index=True)
+    stations = stations_df[['station_idx', 'longitude', 'latitude']].drop_duplicates('station_idx', ignore_index=True)
+    i_airport, i_station, distance = find_pairs_within_radius(
+        airports['longitude'], airports['latitude'], stations['longitude'], stations['latitude'], radius_km
+    )
+    pairs_df = pd.DataFrame({
+        'airport': airports['airport'].to_numpy()[i_airport],
+        'station_idx': stations['station_idx'].to_numpy()[i_station],
+        'distance_km': distance,
+    })
+    # keep the pairs of an airport's layer and a station measuring the same ECV
+    pairs_df = pairs_df \
+        .merge(airports_df[['airport', 'layer', 'std_ECV_name']].drop_duplicates(), on='airport') \
+        .merge(stations_df[['station_idx', 'std_ECV_name']].drop_duplicates(), on=['station_idx', 'std_ECV_name'])
+    return pairs_df[columns].sort_values(['airport', 'layer', 'std_ECV_name', 'distance_km'], ignore_index=True)
@@ -0,0 +1,200 @@
+"""
+Latency, payload sizes and errors of requests to the services of RI's, by endpoint family (e.g. the SPARQL endpoint of
+ICOS, the THREDDS server of ACTRIS), over a rolling window. Requests are observed:
+- for HTTP requests made with requests: through utils.metrics.instrument_requests (see observe_http),
+- for reads by libraries bypassing requests (OPeNDAP access by netCDF4): by the connectors (see measure).
+
+Requests taking longer than SLOW_REQUEST_SECONDS (the environment variable UPSTREAM_SLOW_REQUEST_SECONDS, 10 s by
+default) are logged with their URL and size. get_health summarizes the latency percentiles per endpoint family and, per
+RI, the consumption of error budgets of two objectives: AVAILABILITY_TARGET of requests succeed, and LATENCY_TARGET of
+requests complete within the latency objective of the RI (LATENCY_OBJECTIVE_SECONDS). The statistics are kept per
+worker process.
+"""
+
+import collections
+import contextlib
+import contextvars
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from utils import metrics
+
+
+logger = logging.getLogger(__name__)
+
+SLOW_REQUEST_SECONDS = float(os.environ.get('UPSTREAM_SLOW_REQUEST_SECONDS', 10))
+WINDOW_SECONDS = 3600
+WINDOW_SIZE = 2000
+PERCENTILES = (50, 95, 99)
+
+AVAILABILITY_TARGET = 0.99
+LATENCY_TARGET = 0.95
+LATENCY_OBJECTIVE_SECONDS = {
+    'actris': 10.,
+    'iagos': 5.,
+    'icos': 10.,
+    'sios': 10.,
+}
+DEFAULT_LATENCY_OBJECTIVE_SECONDS = 10.
+
+# (host, path prefix, endpoint family, RI); the first matching entry applies
+ENDPOINT_FAMILIES = [
+    ('prod-actris-md.nilu.no', '', 'actris-metadata', 'actris'),
+    ('thredds.nilu.no', '', 'actris-thredds', 'actris'),
+    ('meta.icos-cp.eu', '/sparql', 'icos-sparql', 'icos'),
+    ('meta.icos-cp.eu', '', 'icos-meta', 'icos'),
+    ('data.icos-cp.eu', '', 'icos-data', 'icos'),
+    ('data.iadc.cnr.it', '/erddap', 'sios-erddap', 'sios'),
+    ('sios-svalbard.org', '/rest', 'sios-rest', 'sios'),
+    ('thredds.met.no', '', 'sios-metno-thredds', 'sios'),
+    ('services.iagos-data.fr', '', 'iagos-services', 'iagos'),
+    ('iagos-data.fr', '', 'iagos-rest', 'iagos'),
+]
+
+_lock = threading.Lock()
+# endpoint family -> deque of (time, duration, nbytes, ok)
+_observations = collections.defaultdict(lambda: collections.deque(maxlen=WINDOW_SIZE))
+_ri_by_family = {}
+# HTTP requests observed while a read is measured (see measure)
+_http_requests_in_read = contextvars.ContextVar('http_requests_in_read', default=None)
+
+
+def get_endpoint_family(url):
+    """
+    :param url: str
+    :return: tuple (endpoint family, RI); for unknown services, the family is the host and the RI is None
+    """
+    parts = urlsplit(url)
+    host = parts.hostname or ''
+    for family_host, path_prefix, family, ri in ENDPOINT_FAMILIES:
+        if host == family_host and parts.path.startswith(path_prefix):
+            return family, ri
+    return host, None
+
+
+def observe(url, duration, nbytes=0, error=None):
+    """
+    Record a request to a service of an RI.
+    :param url: str
+    :param duration: float; in seconds
+    :param nbytes: int; size of the response
+    :param error: str or None; description of the error, if the request failed
+    """
+    family, ri = get_endpoint_family(url)
+    with _lock:
+        _ri_by_family[family] = ri
+        _observations[family].append((time.time(), duration, nbytes, error is None))
+    if duration > SLOW_REQUEST_SECONDS:
+        logger.warning(
+            f'slow request to {family}: {duration:.1f}s, {nbytes} bytes, '
+            f'{"failed: " + error if error else "ok"}, url={url}'
+        )
+
+
+def observe_http(url, duration, nbytes, status, error):
+    """
+    Observer of HTTP requests (see utils.metrics.add_http_observer); server errors (5xx) count as failed requests.
+    """
+    requests_in_read = _http_requests_in_read.get()
+    if requests_in_read is not None:
+        requests_in_read.append(url)
+    if error is not None:
+        error = f'{type(error).__name__}: {error}'
+    elif status >= 500:
+        error = f'HTTP {status}'
+    observe(url, duration, nbytes, error)
+
+
+metrics.add_http_observer(observe_http)
+
+
+@contextlib.contextmanager
+def measure(url):
+    """
+    Measure a read of a dataset by a library bypassing requests (e.g. OPeNDAP access by netCDF4). The size of the read
+    data can be set in the yielded dict under the key 'nbytes'. If the read made HTTP requests with requests, it is not
+    recorded, since they are recorded on their own.
+    """
+    token = _http_requests_in_read.set([])
+    read = {'nbytes': 0}
+    start = time.perf_counter()
+    error = None
+    try:
+        yield read
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        requests_in_read = _http_requests_in_read.get()
+        _http_requests_in_read.reset(token)
+        if not requests_in_read:
+            observe(url, time.perf_counter() - start, read['nbytes'], error)
+
+
+def _get_window(family, now):
+    with _lock:
+        return [o for o in _observations[family] if o[0] >= now - WINDOW_SECONDS]
+
+
+def _get_stats(observations, latency_objective=None):
+    durations = np.array([o[1] for o in observations])
+    stats = {
+        'requests': len(observations),
+        'errors': sum(not o[3] for o in observations),
+        'bytes': int(sum(o[2] for o in observations)),
+    }
+    stats['error_rate'] = stats['errors'] / len(observations)
+    for p, value in zip(PERCENTILES, np.percentile(durations, PERCENTILES)):
+        stats[f'p{p}_s'] = float(value)
+    stats['max_s'] = float(durations.max())
+    if latency_objective is not None:
+        stats['slow_rate'] = float(np.mean(durations > latency_objective))
+    return stats
+
+
+def get_health():
+    """
+    :return: dict {'families': {family: stats}, 'ris': {ri: stats}}, where stats of a family have the numbers of
+    requests, errors and bytes, the error rate and latency percentiles over the window; stats of an RI have in
+    addition the latency objective, the fractions of the error budgets left (negative, if overspent) and the status:
+    'ok', 'at risk' (less than a half of a budget left) or 'budget exhausted'
+    """
+    now = time.time()
+    with _lock:
+        families = list(_observations)
+        ri_by_family = dict(_ri_by_family)
+    health = {'families': {}, 'ris': {}}
+    observations_by_ri = collections.defaultdict(list)
+    for family in sorted(families):
+        observations = _get_window(family, now)
+        if not observations:
+            continue
+        health['families'][family] = dict(_get_stats(observations), ri=ri_by_family.get(family))
+        if ri_by_family.get(family) is not None:
+            observations_by_ri[ri_by_family[family]].extend(observations)
+    for ri, observations in sorted(observations_by_ri.items()):
+        latency_objective = LATENCY_OBJECTIVE_SECONDS.get(ri, DEFAULT_LATENCY_OBJECTIVE_SECONDS)
+        stats = _get_stats(observations, latency_objective)
+        stats['latency_objective_s'] = latency_objective
+        stats['availability_budget_left'] = 1 - stats['error_rate'] / (1 - AVAILABILITY_TARGET)
+        stats['latency_budget_left'] = 1 - stats['slow_rate'] / (1 - LATENCY_TARGET)
+        budget_left = min(stats['availability_budget_left'], stats['latency_budget_left'])
+        if budget_left <= 0:
+            stats['status'] = 'budget exhausted'
+        elif budget_left < 0.5:
+            stats['status'] = 'at risk'
+        else:
+            stats['status'] = 'ok'
+        health['ris'][ri] = stats
+    return health
+
+
+def reset():
+    with _lock:
+        _observations.clear()
+        _ri_by_family.clear()
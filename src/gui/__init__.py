@@ -1,6 +1,8 @@
 from .data import (
     get_station_by_shortnameRI,
+    get_station_by_idx,
     get_std_variables,
+    get_summary_stats_tooltip,
     get_selected_points,
     get_bounding_box,
     get_selected_stations_dropdown,
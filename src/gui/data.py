@@ -1,11 +1,41 @@
 import numpy as np
 import pandas as pd
 
+from data_access.helper import categorical_label
+
 def get_station_by_shortnameRI(stations):
     df = stations.set_index('short_name_RI')[['long_name', 'RI']]
-    df['station_fullname'] = df['long_name'] + ' (' + df['RI'] + ')'
+    df['station_fullname'] = categorical_label(df['long_name'], df['RI'])
+    return df
+
+def get_station_by_idx(stations):
+    """
+    Provide stations' names indexed by the integer key of a station, to be joined to datasets on the column
+    'station_idx' (see data_access.get_datasets).
+    :param stations: pandas.DataFrame returned by data_access.get_stations
+    :return: pandas.DataFrame with index 'idx' and categorical columns 'long_name', 'RI', 'station_fullname'
+    """
+    df = stations.set_index('idx')[['long_name', 'RI']]
+    df['long_name'] = df['long_name'].astype('category')
+    df['station_fullname'] = categorical_label(df['long_name'], df['RI'])
     return df
 
+def get_summary_stats_tooltip(var_stats):
+    """
+    Provide a markdown text with summary statistics of a dataset's variables (see data_access.get_summary_stats).
+    :param var_stats: dict {variable_name: dict} or None
+    :return: str
+    """
+    if not isinstance(var_stats, dict) or not var_stats:
+        return 'Summary statistics will be available once the dataset is downloaded.'
+    lines = ['| variable | count | min | max | mean | coverage |', '|---|---|---|---|---|---|']
+    for v, stats in var_stats.items():
+        lines.append(
+            f"| {v} | {stats['count']} | {stats['min']:.4g} | {stats['max']:.4g} | {stats['mean']:.4g} "
+            f"| {100 * stats['coverage']:.0f}% |"
+        )
+    return '\n'.join(lines)
+
 def get_std_variables(variables):
     std_vars = variables[['std_ECV_name', 'code']].drop_duplicates()
     try:
@@ -52,7 +82,8 @@ def get_bounding_box(selected_points_df, selected_stations):
 def get_selected_stations_dropdown(selected_stations_df, stations):
     idx = selected_stations_df.index
     df = stations.iloc[idx]
-    labels = df['short_name'] + ' (' + df['long_name'] + ', ' + df['RI'] + ')'
+    # the columns are categorical (see data_access.get_stations)
+    labels = df['short_name'].astype(str) + ' (' + df['long_name'].astype(str) + ', ' + df['RI'].astype(str) + ')'
     options = labels.rename('label').reset_index().rename(columns={'index': 'value'})
     return options.to_dict(orient='records'), list(options['value'])
 
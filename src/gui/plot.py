@@ -1,14 +1,14 @@
 import dash
 from dash import dcc
 from dash import html
-import numpy as np
-import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import dash_bootstrap_components as dbc
 
 # Local imports
 import data_access
+from utils.charts import contiguous_periods
+from utils import metrics
 
 # Color codes
 ACTRIS_COLOR_HEX = '#00adb7'
@@ -33,6 +33,7 @@ def get_variables_checklist(list_id, std_variables):
     )
     return variables_checklist
 
+@metrics.timed(metrics.FIGURE_BUILD_SECONDS, figure='get_stations_map')
 def get_stations_map(map_id, stations):
     """
     Provide a Dash component containing a map with stations
@@ -103,11 +104,12 @@ def get_bbox_selection_div(lamax, lamin, lonmax, lonmin):
     ])
     return bbox_selection_div
 
+@metrics.timed(metrics.FIGURE_BUILD_SECONDS, figure='get_timeline_by_station')
 def get_timeline_by_station(datasets_df):
-    df = datasets_df\
-        .groupby(['platform_id_RI', 'station_fullname', 'RI'])\
-        .apply(lambda x: _contiguous_periods(x['time_period_start'], x['time_period_end'], x['var_codes_filtered']))\
-        .reset_index()
+    df = contiguous_periods(
+        datasets_df['time_period_start'], datasets_df['time_period_end'], datasets_df['var_codes_filtered'],
+        groups=datasets_df[['platform_id_RI', 'station_fullname', 'RI']]
+    )
     df = df.sort_values('platform_id_RI')
     no_platforms = len(df['platform_id_RI'].unique())
     height = 100 + max(100, 50 + 30 * no_platforms)
@@ -127,11 +129,12 @@ def get_timeline_by_station(datasets_df):
     )
     return gantt
 
+@metrics.timed(metrics.FIGURE_BUILD_SECONDS, figure='get_timeline_by_station_and_vars')
 def get_timeline_by_station_and_vars(datasets_df):
-    df = datasets_df\
-        .groupby(['platform_id_RI', 'station_fullname', 'var_codes_filtered'])\
-        .apply(lambda x: _contiguous_periods(x['time_period_start'], x['time_period_end']))\
-        .reset_index()
+    df = contiguous_periods(
+        datasets_df['time_period_start'], datasets_df['time_period_end'],
+        groups=datasets_df[['platform_id_RI', 'station_fullname', 'var_codes_filtered']]
+    )
     df = df.sort_values('platform_id_RI')
     facet_col_wrap = 4
     no_platforms = len(df['platform_id_RI'].unique())
@@ -153,47 +156,7 @@ def get_timeline_by_station_and_vars(datasets_df):
     )
     return gantt
 
-def _contiguous_periods(start, end, var_codes=None, dt=pd.Timedelta('1D')):
-    """
-    Merge together periods which overlap, are adjacent or nearly adjacent (up to dt). The merged periods are returned
-    with:
-    - start and end time ('time_period_start', 'time_period_end'),
-    - list of indices of datasets which enters into a given period ('indices'),
-    - number of the datasets (the length of the above list) ('datasets'),
-    - codes of variables available within a given period, if the parameter var_codes is provided.
-    :param start: pandas.Series of Timestamps with periods' start
-    :param end: pandas.Series of Timestamps with periods' end
-    :param var_codes: pandas.Series of strings or None, optional; if given, must contain variable codes separated by comma
-    :param dt: pandas.Timedelta
-    :return: pandas.DataFrame with columns 'time_period_start', 'time_period_end', 'indices', 'datasets' and 'var_codes'
-    """
-    s, e, idx = [], [], []
-    df_dict = {'s': start, 'e': end}
-    if var_codes is not None:
-        dat = []
-        df_dict['var_codes'] = var_codes
-    df = pd.DataFrame(df_dict).sort_values(by='s', ignore_index=False)
-    df['e'] = df['e'].cummax()
-    if len(df) > 0:
-        delims, = np.nonzero((df['e'] + dt).values[:-1] < df['s'].values[1:])
-        delims = np.concatenate(([0], delims + 1, [len(df)]))
-        for i, j in zip(delims[:-1], delims[1:]):
-            s.append(df['s'].iloc[i])
-            e.append(df['e'].iloc[j - 1])
-            idx.append(df.index[i:j])
-            if var_codes is not None:
-                # concatenate all var_codes; [:-1] is to suppress the last comma
-                all_var_codes = (df['var_codes'].iloc[i:j] + ', ').sum()[:-2]
-                # remove duplicates from all_var_codes...
-                all_var_codes = np.sort(np.unique(all_var_codes.split(', ')))
-                # ...and form a single string with codes separated by comma
-                all_var_codes = ', '.join(all_var_codes)
-                dat.append(all_var_codes)
-    res_dict = {'time_period_start': s, 'time_period_end': e, 'indices': idx, 'datasets': [len(i) for i in idx]}
-    if var_codes is not None:
-        res_dict['var_codes'] = dat
-    return pd.DataFrame(res_dict)
-
+@metrics.timed(metrics.FIGURE_BUILD_SECONDS, figure='plot_vars')
 def plot_vars(ds, v1, v2=None):
     vars_long = data_access.get_vars_long()
     vs = [v1, v2] if v2 is not None else [v1]
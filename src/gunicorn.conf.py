@@ -0,0 +1,31 @@
+"""
+gunicorn configuration of the ATMO-ACCESS time series service:
+    gunicorn -c gunicorn.conf.py
+The number of workers and threads, the address and the directory for search results shared by the workers can be
+set with the environment variables WEB_CONCURRENCY, GUNICORN_THREADS, GUNICORN_BIND and SESSION_STORE_DIR; metrics of
+the workers are collected for /metrics in the directory METRICS_DIR (see utils.metrics).
+"""
+
+import glob
+import multiprocessing
+import os
+import tempfile
+
+
+wsgi_app = 'app:create_app()'
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:9235')
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count(), 8)))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+# load the app (and so the catalogue data) once in the master process, before forking the workers
+preload_app = True
+# reading datasets from RI's might take long
+timeout = 300
+
+os.environ.setdefault('SESSION_STORE_DIR', os.path.join(tempfile.gettempdir(), 'atmo-access-sessions'))
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'atmo-access-metrics'))
+
+
+def on_starting(server):
+    # metrics of workers of a previous run of the server
+    for path in glob.glob(os.path.join(os.environ['METRICS_DIR'], '*.json')):
+        os.remove(path)
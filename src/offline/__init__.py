@@ -0,0 +1,57 @@
+"""
+Offline operation of the app: outbound traffic to RI's services is recorded, and replayed from a local stand-in
+server, so that the app (e.g. its searches, plots and benchmarks) runs without network access and with repeatable
+responses.
+
+Recording (with network access):
+    OFFLINE_MODE=record OFFLINE_RECORDINGS=recordings/ python app.py
+Replay:
+    python -m offline serve --recordings recordings/ --port 8765 [--latency 0.05] [--bandwidth 1e6]
+    OFFLINE_MODE=replay OFFLINE_STAND_IN_URL=http://127.0.0.1:8765 python app.py
+or, with OFFLINE_MODE=replay and OFFLINE_RECORDINGS set but no OFFLINE_STAND_IN_URL, a stand-in server is started
+in the background of the app's process.
+
+The stand-in server answers with recorded exchanges, files put into the recording (real NetCDF files) and, for
+datasets of ACTRIS (EBAS) and SIOS (MET Norway, CNR), with synthetic NetCDF files (see synthetic). Catalogues of RI's
+(stations, variables, datasets) and datasets of ICOS are available only from recordings or the app's caches;
+IAGOS datasets are read from local files (see data_access.connectors) and are not affected. In the replay mode, set
+DATA_CACHE_DIR (see data_access.data_access) to a separate directory, so that the datasets read from the stand-in
+server are not cached together with the real ones.
+
+Synthetic catalogues of RI's and matching datasets, at chosen sizes and sampling rates, are made by generator:
+    python -m offline generate out/ --scale 100
+"""
+
+import os
+
+from .recording import Recording, get_key
+from .server import StandInServer, stand_in_url, original_url
+from .interceptor import enable_replay, enable_record, disable, get_mode, REPLAY, RECORD
+
+
+_stand_in_server = None
+
+
+def configure_from_env():
+    """
+    Configure the offline mode from the environment variables OFFLINE_MODE ('record' or 'replay'), OFFLINE_RECORDINGS
+    (directory of a recording) and OFFLINE_STAND_IN_URL (URL of a running stand-in server, for replay).
+    """
+    global _stand_in_server
+    mode = os.environ.get('OFFLINE_MODE', '').lower()
+    recordings_dir = os.environ.get('OFFLINE_RECORDINGS')
+    if not mode:
+        return
+    if mode == RECORD:
+        if not recordings_dir:
+            raise ValueError('OFFLINE_MODE=record requires OFFLINE_RECORDINGS')
+        enable_record(recordings_dir)
+    elif mode == REPLAY:
+        base_url = os.environ.get('OFFLINE_STAND_IN_URL')
+        if not base_url:
+            if _stand_in_server is None:
+                _stand_in_server = StandInServer(recordings_dir).start()
+            base_url = _stand_in_server.url
+        enable_replay(base_url)
+    else:
+        raise ValueError(f'unknown OFFLINE_MODE={mode}; must be {RECORD} or {REPLAY}')
@@ -0,0 +1,54 @@
+"""
+Run a stand-in server for RI's services, or generate synthetic catalogues and datasets of RI's; see the package offline.
+    python -m offline serve --recordings recordings/ --port 8765
+    python -m offline generate out/ --scale 100 --resolution 1h
+"""
+
+import argparse
+import logging
+
+from .server import StandInServer
+from . import generator
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m offline')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    serve = subparsers.add_parser('serve', help='run a stand-in server')
+    serve.add_argument('--recordings', default=None, help='directory of a recording')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765)
+    serve.add_argument('--latency', type=float, default=0., help='seconds added to each request')
+    serve.add_argument('--bandwidth', type=float, default=None, help='bytes per second of responses')
+    generate = subparsers.add_parser('generate', help='generate synthetic catalogues and datasets of RI\'s')
+    generate.add_argument('output_dir')
+    generate.add_argument('--scale', type=float, default=1., help='sizes of catalogues relative to the bundled ones')
+    generate.add_argument('--ris', default=','.join(generator.RIS), help='comma-separated lower-case RI codes')
+    generate.add_argument('--resolution', default='1h', help='EBAS resolution code of ACTRIS and SIOS time series')
+    generate.add_argument('--files', default='20', help='number of datasets per RI with a file, or "all"')
+    generate.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'generate':
+        summary = generator.generate(
+            args.output_dir, scale=args.scale, ris=args.ris.split(','), resolution=args.resolution,
+            n_files=None if args.files == 'all' else int(args.files), seed=args.seed,
+        )
+        for ri, sizes in summary.items():
+            print(f'{ri}: {sizes}')
+        return
+
+    server = StandInServer(args.recordings, host=args.host, port=args.port,
+                           latency=args.latency, bandwidth=args.bandwidth)
+    print(f'Serving at {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,430 @@
+"""
+Generator of synthetic catalogues of RI's (stations, variables, datasets) and of matching NetCDF files of datasets,
+for load and scale testing without network access. The output directory has the layout:
+    <output_dir>/cache/{stations,variables,datasets}_<ri>.pkl   catalogues in the shapes of data_access' per-RI caches
+    <output_dir>/recordings/files/<host>/<path>                 NetCDF files of ACTRIS and SIOS datasets, served by the
+                                                                stand-in server (see offline.server)
+    <output_dir>/iagos/catalogue.json, iagos_L3_postprocessed/  IAGOS resources (see connectors.get_iagos_resource_path)
+Sizes are given relative to the bundled caches (BASE_SIZES): scale=100 generates 100 times as many stations and datasets
+per RI. Stations are clustered in the RI's region, they have a skewed number of datasets each, with mixes of ECV's and
+overlapping periods of measurements.
+
+Only the first n_files datasets of each RI get a file, so that large catalogues do not take large disk space; the
+stand-in server provides synthetic payloads of the same shape for the other ACTRIS (with the period and the resolution
+from the EBAS file name) and SIOS datasets, whereas the other IAGOS datasets cannot be read. Datasets of ICOS are read by
+icoscp from the ICOS Carbon Portal, so only their catalogue is generated.
+
+Usage:
+    python -m offline generate out/ --scale 100 --resolution 1h
+    CACHE_DIR=out/cache IAGOS_RESOURCES_DIR=out/iagos DATA_CACHE_DIR=out/data_cache \\
+        OFFLINE_MODE=replay OFFLINE_RECORDINGS=out/recordings python app.py
+"""
+
+import json
+import logging
+import os
+import pathlib
+import string
+from urllib.parse import urlsplit
+
+import numpy as np
+import pandas as pd
+
+from . import synthetic
+
+
+logger = logging.getLogger(__name__)
+
+
+RIS = ('actris', 'iagos', 'icos', 'sios')
+# (number of stations, number of datasets) per RI in the bundled caches; SIOS datasets are those of the last search
+BASE_SIZES = {
+    'actris': (55, 265),
+    # airports of the IAGOS catalogue (the bundled stations of IAGOS are a subset of them)
+    'iagos': (61, 592),
+    'icos': (59, 421),
+    'sios': (17, 17),
+}
+# periods of measurements are drawn from this range
+FIRST_YEAR, LAST_YEAR = 1995, 2023
+
+_ACTRIS_COMPONENTS = {
+    # EBAS component: (ACTRIS variable name, ECV name, EBAS instrument type, frequency of the component)
+    'particle_number_size_distribution':
+        ('particle.number.size.distribution', 'Aerosol Physical Properties', 'dmps', 4),
+    'particle_number_concentration': ('particle.number.concentration', 'Aerosol Physical Properties', 'cpc', 3),
+    'pm10_mass': ('pm10.concentration', 'Aerosol Physical Properties', 'filter_gravimetric', 2),
+    'pm25_mass': ('pm2.5.concentration', 'Aerosol Physical Properties', 'filter_gravimetric', 2),
+    'aerosol_absorption_coefficient':
+        ('aerosol.absorption.coefficient', 'Aerosol Optical Properties', 'filter_absorption_photometer', 3),
+    'aerosol_light_scattering_coefficient':
+        ('aerosol.scattering.coefficient', 'Aerosol Optical Properties', 'nephelometer', 3),
+    'elemental_carbon': ('elemental.carbon', 'Aerosol Chemical Properties', 'filter_absorption_photometer', 2),
+    'organic_carbon': ('organic.carbon.concentration', 'Aerosol Chemical Properties', 'thermal_optical', 2),
+}
+
+_IAGOS_PRODUCTS = ('daily', 'monthly')
+
+_IAGOS_SPECIES = {
+    # species: (variable name, ECV name, name in titles)
+    'CO': ('mole_fraction_of_carbon_monoxide_in_air', 'Carbon Monoxide', 'carbon monoxide'),
+    'O3': ('mole_fraction_of_ozone_in_air', 'Ozone', 'ozone'),
+}
+
+_ICOS_VARIABLES = {
+    # variable name: (ECV names, product name in titles, frequency of the product)
+    'co2': (['Carbon Dioxide', 'Carbon Dioxide, Methane and other Greenhouse gases', 'Tropospheric CO2'], 'CO2', 4),
+    'ch4': (['Methane', 'Carbon Dioxide, Methane and other Greenhouse gases', 'Tropospheric CH4'], 'CH4', 3),
+    'co': (['Carbon Monoxide', 'Carbon Dioxide, Methane and other Greenhouse gases'], 'CO', 2),
+    'n2o': (['Nitrous Oxide', 'Carbon Dioxide, Methane and other Greenhouse gases'], 'N2O', 1),
+    'AT': (['Temperature (near surface)'], 'Meteo', 2),
+    'RH': (['Water Vapour (surface)'], 'Meteo', 2),
+    'AP': (['Pressure (surface)'], 'Meteo', 2),
+    'WS': (['Surface Wind Speed and direction'], 'Meteo', 2),
+    'WD': (['Surface Wind Speed and direction'], 'Meteo', 2),
+}
+
+_SIOS_VARIABLES = {
+    # CF standard name: ECV name; as in query_sios.MAPPING_ECV_VARIABLES_METNO
+    'surface_air_pressure': 'Pressure (surface)',
+    'wind_speed': 'Surface Wind Speed and direction',
+    'wind_from_direction': 'Surface Wind Speed and direction',
+    'air_temperature': 'Temperature (near surface)',
+    'relative_humidity': 'Water Vapour (surface)',
+}
+
+# regions of stations: (longitude min, latitude min, longitude max, latitude max), fraction of stations in the region;
+# the remaining stations are spread over the globe
+_REGIONS = {
+    'actris': ((-10., 35., 30., 70.), 0.85),
+    'iagos': ((-125., 25., 140., 60.), 0.7),
+    'icos': ((-10., 40., 30., 70.), 0.95),
+    'sios': ((10., 74., 30., 81.), 1.),
+}
+
+
+def _get_codes(rng, n):
+    # distinct upper-case codes of 3 letters (or more, if there are too many)
+    length = 3
+    while len(string.ascii_uppercase) ** length < 2 * n:
+        length += 1
+    letters = np.array(list(string.ascii_uppercase))
+    codes = set()
+    while len(codes) < n:
+        for code in rng.choice(letters, size=(n, length)):
+            codes.add(''.join(code))
+            if len(codes) == n:
+                break
+    return sorted(codes, key=lambda code: rng.random())
+
+
+def _get_positions(rng, ri, n):
+    (lon_min, lat_min, lon_max, lat_max), fraction = _REGIONS[ri]
+    in_region = rng.random(n) < fraction
+    # stations cluster around a few centres, e.g. around cities or in mountains
+    n_centres = max(1, n // 20)
+    centres = np.column_stack([rng.uniform(lon_min, lon_max, n_centres), rng.uniform(lat_min, lat_max, n_centres)])
+    positions = centres[rng.integers(n_centres, size=n)] + rng.normal(scale=1.5, size=(n, 2))
+    positions[:, 0] = np.clip(positions[:, 0], lon_min, lon_max)
+    positions[:, 1] = np.clip(positions[:, 1], lat_min, lat_max)
+    n_global = int((~in_region).sum())
+    positions[~in_region] = np.column_stack([
+        rng.uniform(-180., 180., n_global),
+        np.degrees(np.arcsin(rng.uniform(-1., 1., n_global))),
+    ])
+    return positions[:, 0].round(5), positions[:, 1].round(5)
+
+
+def _get_station_of_datasets(rng, n_stations, n_datasets):
+    # a skewed number of datasets per station: a few stations have many datasets, every station has at least one
+    weights = 1. / np.arange(1, n_stations + 1) ** 0.8
+    idx = rng.choice(n_stations, size=n_datasets, p=weights / weights.sum())
+    idx[:min(n_stations, n_datasets)] = np.arange(min(n_stations, n_datasets))
+    return rng.permutation(idx)
+
+
+def _get_periods(rng, n, monthly=False):
+    """
+    :param monthly: bool; if True, periods begin on the first day of any month, otherwise on the first day of a year
+    :return: (start, end) pandas.DatetimeIndex and numpy.ndarray of their lengths in years; periods are of 1 to 15
+    years (shorter ones are more frequent) and overlap with each other
+    """
+    n_years = np.minimum(rng.geometric(0.2, size=n), 15)
+    first = np.minimum(rng.integers(FIRST_YEAR, LAST_YEAR, size=n), LAST_YEAR - n_years)
+    month = rng.integers(1, 13, size=n) if monthly else 1
+    start = pd.DatetimeIndex(pd.to_datetime({'year': first, 'month': month, 'day': 1}))
+    end = pd.DatetimeIndex(pd.to_datetime({'year': first + n_years, 'month': month, 'day': 1}))
+    return start, end, n_years
+
+
+def _choose(rng, table, size):
+    keys = list(table)
+    weights = np.array([table[k][-1] for k in keys], dtype='f8')
+    return [keys[i] for i in rng.choice(len(keys), size=size, p=weights / weights.sum())]
+
+
+def _format_time(t, fraction=False):
+    return t.strftime('%Y-%m-%dT%H:%M:%S') + ('.0000000Z' if fraction else 'Z')
+
+
+def actris_catalogue(rng, n_stations, n_datasets, resolution='1h'):
+    """
+    :param resolution: str; EBAS resolution code, e.g. '1h', '1d', '1mn'
+    :return: (stations, variables, datasets) pandas.DataFrame's
+    """
+    codes = _get_codes(rng, n_stations)
+    lon, lat = _get_positions(rng, 'actris', n_stations)
+    stations = pd.DataFrame({
+        'short_name': codes,
+        'latitude': lat,
+        'longitude': lon,
+        'long_name': [f'station_{code.lower()}' for code in codes],
+        'URI': [f'https://prod-actris-md.nilu.no/Stations/{code}' for code in codes],
+        'altitude': np.where(rng.random(n_stations) < 0.3, np.nan, rng.uniform(0., 3500., n_stations).round()),
+    })
+    variables = pd.DataFrame({
+        'variable_name': [var for var, *_ in _ACTRIS_COMPONENTS.values()],
+        'ECV_name': [[ecv] for _, ecv, *_ in _ACTRIS_COMPONENTS.values()],
+    })
+
+    station_idx = _get_station_of_datasets(rng, n_stations, n_datasets)
+    components = _choose(rng, _ACTRIS_COMPONENTS, n_datasets)
+    start, end, n_years = _get_periods(rng, n_datasets)
+    step = synthetic._parse_ebas_duration(resolution)
+    records = []
+    for i, (s, component) in enumerate(zip(station_idx, components)):
+        var, ecv, instrument, _ = _ACTRIS_COMPONENTS[component]
+        ebas_code = f'XX{s:04d}G'
+        lab = f'XX{s % 100:02d}L'
+        file_name = f'{ebas_code}.{start[i]:%Y%m%d%H%M%S}.20220101000000.{instrument}.{component}.aerosol.' \
+                    f'{n_years[i]}y.{resolution}.{lab}_{instrument}_{i}.{lab}_{instrument}.lev2.nc'
+        url = f'http://thredds.nilu.no/thredds/dodsC/ebas/{file_name}'
+        records.append({
+            'title': f'Ground based observations of {var} (matrix: Particle) using {instrument} at '
+                     f'{stations["long_name"].iat[s]}',
+            'urls': [{'url': url, 'type': 'opendap'}, {'url': url, 'type': 'data_file'}],
+            'ecv_variables': [ecv],
+            'time_period': [_format_time(start[i] + step / 2, fraction=True),
+                            _format_time(end[i] - step / 2, fraction=True)],
+            'platform_id': codes[s],
+            'RI': 'ACTRIS',
+        })
+    return stations, variables, pd.DataFrame.from_records(records)
+
+
+def iagos_catalogue(rng, n_stations, n_datasets):
+    """
+    :return: (stations, variables, datasets) pandas.DataFrame's and the catalogue of IAGOS files (list of dict's, as
+    in the file catalogue.json)
+    """
+    codes = _get_codes(rng, n_stations)
+    lon, lat = _get_positions(rng, 'iagos', n_stations)
+    stations = pd.DataFrame({
+        'short_name': codes,
+        'long_name': [f'Airport {code}' for code in codes],
+        'longitude': lon,
+        'latitude': lat,
+        'altitude': rng.uniform(0., 2000., n_stations),
+    })
+    variables = pd.DataFrame({
+        'variable_name': [var for var, _, _ in _IAGOS_SPECIES.values()],
+        'ECV_name': [[ecv] for _, ecv, _ in _IAGOS_SPECIES.values()],
+    })
+
+    # a file per airport, species and product (daily or monthly means), with a dataset per layer
+    files = [(s, species, product)
+             for s in range(n_stations) for species in _IAGOS_SPECIES for product in _IAGOS_PRODUCTS]
+    n_files = min(-(-n_datasets // len(synthetic.IAGOS_LAYERS)), len(files))
+    start, end, _ = _get_periods(rng, n_files)
+    catalogue = []
+    for i, file_idx in enumerate(rng.permutation(len(files))[:n_files]):
+        s, species, product = files[file_idx]
+        _, ecv, name = _IAGOS_SPECIES[species]
+        catalogue.append({
+            'title': f'{product.title()} aggregated profile data of {name} mixing ratio',
+            'urls': f'vp_{product}_means/{species}_vp_{product}_{codes[s]}.nc',
+            'ecv_variables': [ecv],
+            'time_period': [_format_time(start[i] + pd.Timedelta(hours=11)),
+                            _format_time(end[i] - pd.Timedelta(hours=13))],
+            'RI': 'IAGOS',
+            'vars': [f'{species}_mean', f'{species}_std', f'{species}_max'],
+            'layer': list(synthetic.IAGOS_LAYERS),
+            'platform_id': codes[s],
+            'longitude': float(lon[s]),
+            'latitude': float(lat[s]),
+        })
+    # as in connectors.IagosConnector.search
+    datasets = pd.DataFrame.from_records(catalogue).explode('layer', ignore_index=True)
+    datasets['title'] = datasets['title'] + ' in ' + datasets['layer']
+    datasets['selector'] = 'layer:' + datasets['layer']
+    datasets = datasets[['title', 'urls', 'ecv_variables', 'time_period', 'platform_id', 'RI', 'selector']]
+    return stations, variables, datasets.iloc[:n_datasets], catalogue
+
+
+def icos_catalogue(rng, n_stations, n_datasets):
+    """
+    :return: (stations, variables, datasets) pandas.DataFrame's
+    """
+    codes = _get_codes(rng, n_stations)
+    lon, lat = _get_positions(rng, 'icos', n_stations)
+    stations = pd.DataFrame({
+        'uri': [f'http://meta.icos-cp.eu/resources/stations/AS_{code}' for code in codes],
+        'short_name': codes,
+        'long_name': [f'Station {code.title()}' for code in codes],
+        'icosClass': rng.choice(['1', '2', None], size=n_stations),
+        'country': rng.choice(['CH', 'DE', 'FI', 'FR', 'IT', 'NL', 'NO', 'SE'], size=n_stations),
+        # ICOS provides coordinates and elevations as strings
+        'latitude': [str(x) for x in lat],
+        'longitude': [str(x) for x in lon],
+        'ground_elevation': [str(x) for x in rng.uniform(0., 2500., n_stations).round()],
+        'stationTheme': 'http://meta.icos-cp.eu/ontologies/cpmeta/AS',
+        'firstName': None,
+        'lastName': None,
+        'email': None,
+        'siteType': None,
+        'RI': 'ICOS',
+        'theme': 'AS',
+    })
+    variables = pd.DataFrame({
+        'variable_name': list(_ICOS_VARIABLES),
+        'ECV_name': [ecvs + [var] for var, (ecvs, _, _) in _ICOS_VARIABLES.items()],
+    })
+
+    station_idx = _get_station_of_datasets(rng, n_stations, n_datasets)
+    variables_of_datasets = _choose(rng, _ICOS_VARIABLES, n_datasets)
+    start, end, _ = _get_periods(rng, n_datasets, monthly=True)
+    heights = rng.choice([10., 50., 100., 150.], size=n_datasets)
+    ids = rng.choice(np.array(list(string.ascii_letters + string.digits)), size=(n_datasets, 24))
+    records = []
+    for i, (s, var) in enumerate(zip(station_idx, variables_of_datasets)):
+        ecvs, product, _ = _ICOS_VARIABLES[var]
+        records.append({
+            'title': f'ICOS ATC {product} Release, {stations["long_name"].iat[s]} ({heights[i]} m), '
+                     f'{start[i]:%Y-%m-%d}–{end[i] - pd.Timedelta(days=1):%Y-%m-%d}',
+            'file_name': f'ICOS_ATC_L2_L2-2022.1_{codes[s]}_{heights[i]}_CTS_{product.upper()}.zip',
+            'urls': [{'url': f'https://meta.icos-cp.eu/objects/{"".join(ids[i])}', 'type': 'landing_page'}],
+            'ecv_variables': ecvs[:1],
+            'time_period': [_format_time(start[i]), _format_time(end[i] - pd.Timedelta(hours=1))],
+            'platform_id': codes[s],
+            'RI': 'ICOS',
+        })
+    return stations, variables, pd.DataFrame.from_records(records)
+
+
+def sios_catalogue(rng, n_stations, n_datasets):
+    """
+    :return: (stations, variables, datasets) pandas.DataFrame's; datasets are those of MET Norway's weather stations
+    """
+    codes = _get_codes(rng, n_stations)
+    lon, lat = _get_positions(rng, 'sios', n_stations)
+    stations = pd.DataFrame({
+        'short_name': codes,
+        # SIOS provides coordinates as strings
+        'latitude': [str(x) for x in lat.round(2)],
+        'longitude': [str(x) for x in lon.round(2)],
+        'long_name': [f'{code.title()} Svalbard Station' for code in codes],
+        'URI': [f'https://sios-svalbard.org/node/{i}' for i in range(n_stations)],
+        'ground_elevation': np.nan,
+    })
+    variables = pd.DataFrame({
+        'variable_name': list(_SIOS_VARIABLES),
+        'ECV_name': [[ecv] for ecv in _SIOS_VARIABLES.values()],
+    })
+
+    station_idx = _get_station_of_datasets(rng, n_stations, n_datasets)
+    start, end, _ = _get_periods(rng, n_datasets)
+    ecvs = sorted(set(_SIOS_VARIABLES.values()))
+    records = []
+    for i, s in enumerate(station_idx):
+        station_number = 90000 + i
+        path = f'met.no/observations/stations/SN{station_number}.nc'
+        records.append({
+            'title': f'Observations from {stations["long_name"].iat[s]}',
+            'urls': [
+                {'url': f'https://sios-svalbard.org/metsis/metadata/sn{station_number}', 'type': 'landing_page'},
+                {'url': f'https://thredds.met.no/thredds/dodsC/{path}', 'type': 'opendap'},
+                {'url': f'https://thredds.met.no/thredds/fileServer/{path}', 'type': 'data_file'},
+            ],
+            'ecv_variables': ecvs,
+            'time_period': [_format_time(start[i]), _format_time(end[i] - pd.Timedelta(hours=1))],
+            'platform_id': codes[s],
+            'RI': 'SIOS',
+        })
+    return stations, variables, pd.DataFrame.from_records(records)
+
+
+def _write_netcdf(ds, path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + '.tmp')
+    ds.to_netcdf(tmp_path, format='NETCDF4', engine='netcdf4')
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+def _get_opendap_url(urls):
+    return next(url['url'] for url in urls if url['type'] == 'opendap')
+
+
+def generate(output_dir, scale=1., ris=RIS, resolution='1h', n_files=20, seed=0):
+    """
+    Generate catalogues of RI's and files of their datasets.
+    :param output_dir: str or path-like
+    :param scale: float; number of stations and datasets per RI relative to BASE_SIZES
+    :param ris: iterable of lower-case RI codes
+    :param resolution: str; EBAS resolution code of ACTRIS and SIOS datasets, e.g. '1h', '1d', '1mn'
+    :param n_files: int or None; number of datasets per RI with a file; None for all datasets
+    :param seed: int
+    :return: dict: RI -> dict with the numbers of 'stations', 'datasets', 'files' and 'file_bytes'
+    """
+    output_dir = pathlib.Path(output_dir)
+    cache_dir = output_dir / 'cache'
+    files_dir = output_dir / 'recordings' / 'files'
+    iagos_dir = output_dir / 'iagos'
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    step = synthetic._parse_ebas_duration(resolution)
+    if step is None:
+        raise ValueError(f'invalid EBAS resolution code: {resolution}')
+
+    summary = {}
+    for ri in ris:
+        rng = np.random.default_rng([seed, RIS.index(ri)])
+        n_stations, n_datasets = (max(1, round(n * scale)) for n in BASE_SIZES[ri])
+        if ri == 'actris':
+            stations, variables, datasets = actris_catalogue(rng, n_stations, n_datasets, resolution=resolution)
+        elif ri == 'iagos':
+            stations, variables, datasets, catalogue = iagos_catalogue(rng, n_stations, n_datasets)
+            iagos_dir.mkdir(parents=True, exist_ok=True)
+            (iagos_dir / 'catalogue.json').write_text(json.dumps(catalogue, indent=1))
+        elif ri == 'icos':
+            stations, variables, datasets = icos_catalogue(rng, n_stations, n_datasets)
+        elif ri == 'sios':
+            stations, variables, datasets = sios_catalogue(rng, n_stations, n_datasets)
+        else:
+            raise ValueError(f'unknown RI: {ri}')
+        for kind, df in (('stations', stations), ('variables', variables), ('datasets', datasets)):
+            df.to_pickle(cache_dir / f'{kind}_{ri}.pkl')
+        # remove packed catalogues of previous runs (see data_access.catalogue_store)
+        (cache_dir / f'datasets_{ri}.cat').unlink(missing_ok=True)
+
+        files, file_bytes = 0, 0
+        if ri in ('actris', 'sios'):
+            for urls, time_period in datasets[['urls', 'time_period']].itertuples(index=False):
+                if n_files is not None and files >= n_files:
+                    break
+                url = _get_opendap_url(urls)
+                if ri == 'actris':
+                    ds = synthetic.actris_dataset(url)
+                else:
+                    ds = synthetic.metno_dataset(url, period=[t[:19] for t in time_period], step=step)
+                parts = urlsplit(url)
+                file_bytes += _write_netcdf(ds, files_dir / parts.netloc / parts.path.lstrip('/'))
+                files += 1
+        elif ri == 'iagos':
+            for record in catalogue[:n_files]:
+                start, end = record['time_period']
+                ds = synthetic.iagos_dataset(record['urls'], period=(start[:10], end[:10]))
+                file_bytes += _write_netcdf(ds, iagos_dir / 'iagos_L3_postprocessed' / record['urls'])
+                files += 1
+        summary[ri] = {'stations': n_stations, 'datasets': len(datasets), 'files': files, 'file_bytes': file_bytes}
+        logger.info(f'{ri}: {summary[ri]}')
+    return summary
@@ -0,0 +1,113 @@
+"""
+Interception of outbound HTTP traffic of the app:
+- requests: requests.adapters.HTTPAdapter.send is patched, so that in the replay mode requests are sent to a stand-in
+  server instead of RI's services, and in the record mode the exchanges with RI's services are stored in a recording,
+- remote NetCDF files opened by xarray / netCDF4 (which bypass requests; OPeNDAP at THREDDS servers): in the replay mode,
+  connectors open them at the stand-in server by byte ranges (see data_access.connectors.set_url_resolver); they are
+  not recorded, but real files can be put into the files directory of a recording (see recording.Recording).
+"""
+
+import logging
+import threading
+from urllib.parse import urlsplit
+
+import requests.adapters
+
+from data_access import connectors
+from .recording import Recording
+from .server import stand_in_url
+
+
+logger = logging.getLogger(__name__)
+
+REPLAY = 'replay'
+RECORD = 'record'
+
+_LOCAL_HOSTS = {'localhost', '127.0.0.1', '::1'}
+
+_lock = threading.Lock()
+_original_send = None
+_mode = None
+_stand_in_url = None
+_recording = None
+
+
+def _get_body(request):
+    return request.body if isinstance(request.body, (bytes, str)) else None
+
+
+def _send(adapter, request, **kwargs):
+    host = urlsplit(request.url).hostname
+    if _mode == REPLAY and host not in _LOCAL_HOSTS and host != urlsplit(_stand_in_url).hostname:
+        request = request.copy()
+        request.url = stand_in_url(_stand_in_url, request.url)
+        return _original_send(adapter, request, **kwargs)
+    response = _original_send(adapter, request, **kwargs)
+    if _mode == RECORD and host not in _LOCAL_HOSTS:
+        try:
+            _recording.save(request.method, request.url, _get_body(request),
+                            response.status_code, response.headers, response.content)
+        except OSError as e:
+            logger.warning(f'failed to record {request.method} {request.url}: {e}')
+    return response
+
+
+def _resolve_url(url):
+    # OPeNDAP URL's of THREDDS servers are opened as remote files by byte ranges
+    if '/thredds/' in urlsplit(url).path:
+        return stand_in_url(_stand_in_url, url) + '#mode=bytes'
+    return url
+
+
+def _patch(mode):
+    global _original_send, _mode
+    if _original_send is None:
+        _original_send = requests.adapters.HTTPAdapter.send
+        requests.adapters.HTTPAdapter.send = _send
+    _mode = mode
+
+
+def enable_replay(base_url):
+    """
+    Send requests of the app to a stand-in server (see server.StandInServer) instead of RI's services.
+    :param base_url: str; URL of the stand-in server, e.g. 'http://127.0.0.1:8765'
+    """
+    global _stand_in_url
+    with _lock:
+        _stand_in_url = base_url.rstrip('/')
+        _patch(REPLAY)
+        connectors.set_url_resolver(_resolve_url)
+    logger.info(f'offline replay from {_stand_in_url}')
+
+
+def enable_record(recordings_dir):
+    """
+    Store exchanges of the app with RI's services made by requests in a recording.
+    :param recordings_dir: str or path-like; directory of the recording
+    """
+    global _recording
+    with _lock:
+        _recording = Recording(recordings_dir)
+        _patch(RECORD)
+        connectors.set_url_resolver(None)
+    logger.info(f'recording HTTP exchanges to {recordings_dir}')
+
+
+def disable():
+    """
+    Restore the original behaviour of requests and connectors.
+    """
+    global _original_send, _mode, _stand_in_url, _recording
+    with _lock:
+        if _original_send is not None:
+            requests.adapters.HTTPAdapter.send = _original_send
+        _original_send = None
+        _mode = _stand_in_url = _recording = None
+        connectors.set_url_resolver(None)
+
+
+def get_mode():
+    """
+    :return: REPLAY, RECORD or None
+    """
+    return _mode
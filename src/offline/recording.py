@@ -0,0 +1,98 @@
+"""
+Recordings of HTTP exchanges with RI's services. An exchange is keyed by the method, the URL and the body of
+the request and stored in the directory of the recording as two files: <host>/<key>.json with the request and
+the response's status and headers, and <host>/<key>.bin with the response's content (as decoded by requests).
+
+Files under <directory>/files/<host>/<path> are served as they are for GET requests of https://<host>/<path> (or
+http://...), e.g. real NetCDF files of datasets.
+"""
+
+import hashlib
+import json
+import os
+import pathlib
+from urllib.parse import urlsplit
+
+from utils.file_lock import file_lock
+
+
+# headers which do not apply to the stored (decoded) content
+_DROPPED_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding', 'connection', 'keep-alive'}
+
+
+def get_key(method, url, body=None):
+    """
+    :param method: str
+    :param url: str
+    :param body: bytes, str or None
+    :return: str; a hex digest identifying the request
+    """
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    h = hashlib.sha1()
+    h.update(method.upper().encode('ascii'))
+    h.update(b'\n')
+    h.update(url.encode('utf-8'))
+    h.update(b'\n')
+    h.update(body or b'')
+    return h.hexdigest()
+
+
+class Recording:
+    def __init__(self, directory):
+        self.directory = pathlib.Path(directory)
+
+    def _get_paths(self, host, key):
+        host_dir = self.directory / host.replace(':', '_')
+        return host_dir / f'{key}.json', host_dir / f'{key}.bin'
+
+    def save(self, method, url, body, status, headers, content):
+        """
+        Store an exchange; a previously stored exchange with the same request is replaced.
+        :param method: str
+        :param url: str
+        :param body: bytes, str or None; body of the request
+        :param status: int
+        :param headers: dict-like; headers of the response
+        :param content: bytes
+        """
+        key = get_key(method, url, body)
+        meta_path, content_path = self._get_paths(urlsplit(url).netloc, key)
+        meta_path.parent.mkdir(parents=True, exist_ok=True)
+        meta = {
+            'method': method.upper(),
+            'url': url,
+            'status': status,
+            'headers': {k: v for k, v in headers.items() if k.lower() not in _DROPPED_HEADERS},
+        }
+        # exchanges might be recorded by many workers of the app
+        with file_lock(meta_path):
+            tmp_path = content_path.with_suffix('.bin.tmp')
+            tmp_path.write_bytes(content)
+            os.replace(tmp_path, content_path)
+            meta_path.write_text(json.dumps(meta, indent=1))
+
+    def load(self, method, url, body=None):
+        """
+        :return: tuple (status, headers, content) or None, if the exchange is not recorded
+        """
+        meta_path, content_path = self._get_paths(urlsplit(url).netloc, get_key(method, url, body))
+        if not meta_path.exists():
+            return None
+        with file_lock(meta_path, shared=True):
+            try:
+                meta = json.loads(meta_path.read_text())
+                content = content_path.read_bytes()
+            except FileNotFoundError:
+                return None
+        return meta['status'], meta['headers'], content
+
+    def get_file_path(self, host, path):
+        """
+        :return: pathlib.Path of a file to be served for the host and the path of a URL, or None if there is no such file
+        """
+        file_path = (self.directory / 'files' / host.replace(':', '_') / path.lstrip('/')).resolve()
+        files_dir = (self.directory / 'files').resolve()
+        if files_dir not in file_path.parents or not file_path.is_file():
+            return None
+        return file_path
@@ -0,0 +1,192 @@
+"""
+Local HTTP server standing in for the services of RI's. A request for the original URL
+<scheme>://<host>/<path>?<query> is made to <stand-in URL>/<scheme>/<host>/<path>?<query> (see stand_in_url)
+and is answered with, in this order:
+- a recorded exchange (see recording.Recording),
+- a file from the files directory of the recording,
+- a synthetic NetCDF payload (see synthetic.get_payload),
+- 404 with a JSON body.
+Files and synthetic payloads support HTTP Range requests, so that libraries reading NetCDF files remotely by byte
+ranges (netCDF4 with '#mode=bytes') work as with a real server. Latency (per request) and bandwidth can be emulated.
+"""
+
+import http.server
+import json
+import logging
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+from . import synthetic
+from .recording import Recording
+
+
+logger = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 64 * 1024
+
+
+def stand_in_url(base_url, url):
+    """
+    :param base_url: str; URL of a stand-in server, e.g. 'http://127.0.0.1:8765'
+    :param url: str; an original URL
+    :return: str; the URL of the stand-in server for the original URL
+    """
+    parts = urlsplit(url)
+    query = f'?{parts.query}' if parts.query else ''
+    return f'{base_url.rstrip("/")}/{parts.scheme}/{parts.netloc}{parts.path or "/"}{query}'
+
+
+def original_url(path):
+    """
+    :param path: str; path (with the query) of a request to a stand-in server
+    :return: str or None; the original URL, or None if the path does not encode one
+    """
+    m = re.fullmatch(r'/(https?)/([^/?]+)(.*)', path, flags=re.DOTALL)
+    if m is None:
+        return None
+    scheme, netloc, rest = m.groups()
+    if not rest.startswith('/'):
+        rest = '/' + rest
+    return f'{scheme}://{netloc}{rest}'
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'OfflineStandIn/1.0'
+
+    def log_message(self, format, *args):
+        logger.debug('%s - %s', self.address_string(), format % args)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve()
+
+    def do_POST(self):
+        self._serve()
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else None
+
+    def _serve(self, send_body=True):
+        stand_in = self.server.stand_in
+        body = self._read_body()
+        if stand_in.latency:
+            time.sleep(stand_in.latency)
+        url = original_url(self.path)
+        if url is None:
+            return self._send(404, {'Content-Type': 'application/json'},
+                              json.dumps({'error': f'not a stand-in path: {self.path}'}).encode(), send_body)
+
+        method = 'GET' if self.command == 'HEAD' else self.command
+        if stand_in.recording is not None:
+            exchange = stand_in.recording.load(method, url, body)
+            if exchange is not None:
+                status, headers, content = exchange
+                return self._send_ranged(status, headers, content, send_body)
+            parts = urlsplit(url)
+            file_path = stand_in.recording.get_file_path(parts.netloc, parts.path)
+            if method == 'GET' and file_path is not None:
+                return self._send_ranged(200, {'Content-Type': 'application/x-netcdf'}, file_path.read_bytes(),
+                                         send_body)
+        if method == 'GET':
+            payload = synthetic.get_payload(url)
+            if payload is not None:
+                return self._send_ranged(200, {'Content-Type': 'application/x-netcdf'}, payload, send_body)
+        logger.info(f'no stand-in response for {method} {url}')
+        self._send(404, {'Content-Type': 'application/json'},
+                   json.dumps({'error': f'no stand-in response for {method} {url}'}).encode(), send_body)
+
+    def _send_ranged(self, status, headers, content, send_body):
+        m = re.fullmatch(r'bytes=(\d*)-(\d*)', self.headers.get('Range') or '')
+        if status != 200 or m is None or m.group(0) == 'bytes=-':
+            return self._send(status, headers, content, send_body, accept_ranges=status == 200)
+        size = len(content)
+        if m[1]:
+            first = int(m[1])
+            last = min(int(m[2]), size - 1) if m[2] else size - 1
+        else:
+            # suffix range: the last n bytes
+            first, last = max(size - int(m[2]), 0), size - 1
+        if first >= size or first > last:
+            return self._send(416, {'Content-Range': f'bytes */{size}'}, b'', send_body)
+        headers = dict(headers, **{'Content-Range': f'bytes {first}-{last}/{size}'})
+        self._send(206, headers, content[first:last + 1], send_body, accept_ranges=True)
+
+    def _send(self, status, headers, content, send_body, accept_ranges=False):
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        if accept_ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if not send_body:
+            return
+        bandwidth = self.server.stand_in.bandwidth
+        if not bandwidth:
+            self.wfile.write(content)
+            return
+        for i in range(0, len(content), _CHUNK_SIZE):
+            chunk = content[i:i + _CHUNK_SIZE]
+            self.wfile.write(chunk)
+            time.sleep(len(chunk) / bandwidth)
+
+
+class StandInServer:
+    """
+    A stand-in server running in a background thread; see the module docstring.
+
+    Usage:
+        with StandInServer('recordings/') as server:
+            offline.enable_replay(server.url)
+            ...
+    """
+    def __init__(self, recordings_dir=None, host='127.0.0.1', port=0, latency=0., bandwidth=None):
+        """
+        :param recordings_dir: str, path-like or None; directory of a recording (see recording.Recording)
+        :param host: str
+        :param port: int; 0 for any free port
+        :param latency: float; seconds added to each request
+        :param bandwidth: float or None; bytes per second of responses, None for unlimited
+        """
+        self.recording = Recording(recordings_dir) if recordings_dir is not None else None
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self._httpd = http.server.ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.stand_in = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._httpd.serve_forever, name='offline-stand-in', daemon=True)
+            self._thread.start()
+            logger.info(f'stand-in server listening at {self.url}')
+        return self
+
+    def serve_forever(self):
+        logger.info(f'stand-in server listening at {self.url}')
+        self._httpd.serve_forever()
+
+    def stop(self):
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -0,0 +1,224 @@
+"""
+Synthetic NetCDF payloads standing in for datasets of RI's, in the shapes the query modules expect:
+- ACTRIS (EBAS files at thredds.nilu.no): the period and the resolution are taken from the EBAS file name
+  (e.g. NO0042G.20000301000000.20170523103005.dmps.particle_number_size_distribution.aerosol.6y.1h....nc),
+  the variable is named after the component; particle number size distributions have a diameter dimension 'D',
+- SIOS / MET Norway (thredds.met.no): hourly meteorological variables with CF standard names,
+- SIOS / CNR (ERDDAP tabledap at data.iadc.cnr.it): a NetCDF3 table along the dimension 'row' with the requested
+  variables and time constraints of the query,
+- IAGOS (local L3 files of vertical profiles): daily or monthly means, standard deviations and maxima of CO or O3
+  along the dimensions 'time' and 'layer'.
+Values are smooth seasonal and diurnal cycles with noise, seeded by the URL, so a payload is the same on every
+request and in every process.
+"""
+
+import functools
+import hashlib
+import os
+import re
+import tempfile
+from urllib.parse import unquote, urlsplit
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+
+DEFAULT_PERIOD = ('2015-01-01', '2021-01-01')
+# payloads are capped to this number of time steps
+MAX_SAMPLES = 5_000_000
+
+_EBAS_OFFSET_BY_UNIT = {
+    'y': lambda n: pd.DateOffset(years=n),
+    'mo': lambda n: pd.DateOffset(months=n),
+    'w': lambda n: pd.Timedelta(weeks=n),
+    'd': lambda n: pd.Timedelta(days=n),
+    'h': lambda n: pd.Timedelta(hours=n),
+    'mn': lambda n: pd.Timedelta(minutes=n),
+    's': lambda n: pd.Timedelta(seconds=n),
+}
+
+IAGOS_LAYERS = ('500m', 'PBL', 'FT', 'UT')
+
+_METNO_VARIABLES = {
+    # standard_name: (units, mean, seasonal amplitude, diurnal amplitude, noise)
+    'air_temperature': ('K', 268., 10., 2., 1.),
+    'relative_humidity': ('%', 75., 10., 5., 5.),
+    'surface_air_pressure': ('hPa', 1005., 5., 0.5, 3.),
+    'wind_speed': ('m/s', 5., 2., 1., 2.),
+    'wind_from_direction': ('degree', 180., 40., 20., 60.),
+}
+
+
+def _get_rng(url):
+    return np.random.default_rng(int.from_bytes(hashlib.sha1(url.encode('utf-8')).digest()[:8], 'little'))
+
+
+def _get_time(start, end, step):
+    time = pd.date_range(start, end, freq=step, inclusive='left')
+    return time[:MAX_SAMPLES]
+
+
+def _cycles(rng, time, mean, seasonal, diurnal, noise):
+    t = (time.asi8 - time.asi8[0]) / 86400e9 if len(time) else np.empty(0)
+    phase = rng.uniform(0, 2 * np.pi)
+    values = mean + seasonal * np.sin(2 * np.pi * t / 365.25 + phase) + diurnal * np.sin(2 * np.pi * t)
+    return values + noise * rng.standard_normal(len(time))
+
+
+def _to_netcdf_bytes(ds, netcdf_format='NETCDF4'):
+    fd, path = tempfile.mkstemp(suffix='.nc')
+    os.close(fd)
+    try:
+        ds.to_netcdf(path, format=netcdf_format, engine='netcdf4')
+        with open(path, 'rb') as f:
+            return f.read()
+    finally:
+        os.unlink(path)
+
+
+def _parse_ebas_duration(code):
+    m = re.fullmatch(r'(\d+)(y|mo|w|d|h|mn|s)', code)
+    if m is None:
+        return None
+    return _EBAS_OFFSET_BY_UNIT[m[2]](int(m[1]))
+
+
+def actris_dataset(url):
+    """
+    :param url: str; URL of an EBAS file
+    :return: xarray.Dataset
+    """
+    rng = _get_rng(url)
+    fields = urlsplit(url).path.split('/')[-1].split('.')
+    try:
+        start = pd.Timestamp(pd.to_datetime(fields[1], format='%Y%m%d%H%M%S'))
+        component = fields[4]
+        period = _parse_ebas_duration(fields[6])
+        step = _parse_ebas_duration(fields[7])
+        if period is None or step is None:
+            raise ValueError(fields)
+        end = start + period
+    except (IndexError, ValueError):
+        start, end = map(pd.Timestamp, DEFAULT_PERIOD)
+        component, step = 'aerosol_absorption_coefficient', pd.Timedelta(hours=1)
+    time = _get_time(start, end, step)
+    values = np.exp(_cycles(rng, time, 1., 0.5, 0.3, 0.4))
+    attrs = {'units': '1/Mm', 'ebas_component': component}
+    if component == 'particle_number_size_distribution':
+        diameter = np.logspace(1, 3, 24)
+        spectrum = np.exp(-0.5 * ((np.log10(diameter) - 1.9) / 0.35) ** 2)
+        data = np.outer(values * 1000., spectrum)
+        ds = xr.Dataset(
+            {f'{component}_amean': (('time', 'D'), data, {'units': '1/cm3'})},
+            coords={'time': time, 'D': ('D', diameter, {'units': 'nm'})},
+        )
+    else:
+        ds = xr.Dataset(
+            {
+                f'{component}_amean': ('time', values, attrs),
+                f'{component}_amean_qc': ('time', np.zeros(len(time), dtype='i1')),
+            },
+            coords={'time': time},
+        )
+    ds.attrs.update({'title': f'Synthetic {component}', 'ebas_station_code': fields[0] if fields else ''})
+    return ds
+
+
+def metno_dataset(url, period=DEFAULT_PERIOD, step=pd.Timedelta(hours=1)):
+    """
+    :param url: str; URL of a MET Norway station file (e.g. .../stations/SN99754.nc)
+    :param period: tuple (start, end) of pandas.Timestamp-convertible
+    :param step: pandas.Timedelta; sampling interval
+    :return: xarray.Dataset
+    """
+    rng = _get_rng(url)
+    time = _get_time(*period, step)
+    data_vars = {
+        name: ('time', _cycles(rng, time, mean, seasonal, diurnal, noise), {'standard_name': name, 'units': units})
+        for name, (units, mean, seasonal, diurnal, noise) in _METNO_VARIABLES.items()
+    }
+    data_vars['latitude'] = ((), rng.uniform(74., 81.), {'standard_name': 'latitude', 'units': 'degree_north'})
+    data_vars['longitude'] = ((), rng.uniform(10., 30.), {'standard_name': 'longitude', 'units': 'degree_east'})
+    return xr.Dataset(data_vars, coords={'time': time})
+
+
+def erddap_table(url):
+    """
+    :param url: str; URL of an ERDDAP tabledap request, e.g.
+    .../tabledap/ozone-barentsburg.nc?station_id,latitude,longitude,time,ozone&time>=2019-01-01T00:00:00Z
+    :return: xarray.Dataset along the dimension 'row'
+    """
+    rng = _get_rng(urlsplit(url).path)
+    query = unquote(urlsplit(url).query)
+    variables, *constraints = query.split('&') if query else ['']
+    variables = [v for v in variables.split(',') if v]
+    start, end = map(pd.Timestamp, DEFAULT_PERIOD)
+    for constraint in constraints:
+        m = re.fullmatch(r'time(>=|<=|>|<)(.+)', constraint)
+        if m is not None:
+            t = pd.Timestamp(m[2])
+            if t.tz is not None:
+                t = t.tz_convert(None)
+            if m[1].startswith('>'):
+                start = max(start, t)
+            else:
+                end = min(end, t)
+    time = _get_time(start, end, pd.Timedelta(hours=1))
+    n = len(time)
+    station_id = urlsplit(url).path.split('/')[-1].rsplit('.', 1)[0]
+    data_vars = {
+        'station_id': ('row', np.full(n, station_id)),
+        'latitude': ('row', np.full(n, 78.06, dtype='f4'), {'units': 'degrees_north'}),
+        'longitude': ('row', np.full(n, 14.21, dtype='f4'), {'units': 'degrees_east'}),
+        'time': ('row', (time.asi8 // 10**9).astype('f8'), {'units': 'seconds since 1970-01-01T00:00:00Z'}),
+    }
+    for v in variables:
+        if v not in data_vars:
+            data_vars[v] = ('row', _cycles(rng, time, 300., 30., 5., 5.).astype('f4'))
+    return xr.Dataset({v: data_vars[v] for v in (variables or data_vars) if v in data_vars})
+
+
+def iagos_dataset(path, period=DEFAULT_PERIOD):
+    """
+    :param path: str; path of an IAGOS file relative to the IAGOS data directory, e.g. vp_daily_means/CO_vp_daily_ATL.nc;
+    the file has the variables of the species its name begins with (CO or O3), with daily or monthly (if the name
+    contains 'monthly') time steps
+    :param period: tuple (start, end) of pandas.Timestamp-convertible
+    :return: xarray.Dataset
+    """
+    rng = _get_rng(path)
+    species_in_file = path.split('/')[-1].split('_')[0]
+    time = _get_time(*period, 'MS' if 'monthly' in path else pd.Timedelta(days=1))
+    # days (months) without flights
+    no_flights = rng.random(len(time)) < 0.3
+    data_vars = {}
+    for species, mean, decrease in (('CO', 120., 0.2), ('O3', 40., -0.3)):
+        if species != species_in_file:
+            continue
+        # mixing ratios of CO decrease with altitude, those of O3 increase
+        profile = mean * (1. - decrease * np.arange(len(IAGOS_LAYERS)) / len(IAGOS_LAYERS))
+        values = np.stack([_cycles(rng, time, m, 0.2 * m, 0., 0.1 * m) for m in profile], axis=1)
+        values[no_flights] = np.nan
+        for stat, data in (('mean', values), ('std', 0.1 * np.abs(values)), ('max', 1.2 * values)):
+            data_vars[f'{species}_{stat}'] = (('time', 'layer'), data, {'units': 'ppb'})
+    return xr.Dataset(data_vars, coords={'time': time, 'layer': list(IAGOS_LAYERS)})
+
+
+@functools.lru_cache(maxsize=16)
+def get_payload(url):
+    """
+    Provide a synthetic NetCDF file for a URL of a dataset of an RI.
+    :param url: str; the original URL (with the query, if any)
+    :return: bytes or None, if there is no synthetic payload for the URL
+    """
+    parts = urlsplit(url)
+    if not parts.path.endswith('.nc'):
+        return None
+    if parts.netloc == 'thredds.nilu.no':
+        return _to_netcdf_bytes(actris_dataset(url))
+    if parts.netloc == 'thredds.met.no':
+        return _to_netcdf_bytes(metno_dataset(url))
+    if parts.netloc == 'data.iadc.cnr.it' and '/erddap/tabledap/' in parts.path:
+        return _to_netcdf_bytes(erddap_table(url), netcdf_format='NETCDF3_64BIT')
+    return None
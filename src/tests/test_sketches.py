@@ -0,0 +1,47 @@
+import numpy as np
+import xarray as xr
+
+from utils import sketches
+
+
+def test_histogram_of_negative_values():
+    hist = sketches.FixedWidthHistogram().update([-3.])
+    assert len(hist.counts) == 1
+    assert hist.counts.sum() == 1
+    assert hist.edges[0] <= -3. < hist.edges[-1]
+
+
+def test_histogram_of_values_below_1():
+    hist = sketches.FixedWidthHistogram().update([0.5])
+    assert len(hist.counts) == 1
+    assert hist.edges[0] <= 0.5 < hist.edges[-1]
+
+    sketch = sketches.sketch_dataarray(xr.DataArray([0.5]))
+    assert sketch.count == 1
+    assert len(sketch.log_histogram.counts) == 1
+
+
+def test_histogram_respects_max_bins():
+    for values in ([-20.3, -19.8], [1e6, 1e6 + 1.], np.linspace(-1e3, -1e-3, 10000)):
+        hist = sketches.FixedWidthHistogram(max_bins=4096).update(values)
+        assert len(hist.counts) <= 4096
+        assert hist.counts.sum() == len(values)
+
+    hist = sketches.FixedWidthHistogram(max_bins=64)
+    for lo in (-1e3, 0., 1e3, -1e5):
+        hist.update(np.linspace(lo, lo + 10., 100))
+    assert len(hist.counts) <= 64
+    assert hist.counts.sum() == 400
+
+
+def test_histogram_sums_to_count():
+    rng = np.random.default_rng(0)
+    for values in (rng.integers(0, 10, 100000).astype('f8'), rng.normal(size=100000), rng.lognormal(size=50000),
+                   np.full(10, 3.), np.array([-20.3, -19.8])):
+        sketch = sketches.VariableSketch().update(values)
+        counts, edges = sketch.get_histogram()
+        assert counts.sum() == sketch.count
+        # as in numpy.histogram, the last bin includes the maximum
+        assert counts[-1] == np.histogram(values, bins=edges)[0][-1]
+        counts, _ = sketch.get_histogram(log_x=True)
+        assert counts.sum() == (values > 0).sum()
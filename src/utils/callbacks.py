@@ -0,0 +1,43 @@
+"""
+Wrapping of Dash callbacks, so that their invocations can be observed (measured, traced or profiled; see utils.metrics,
+utils.tracing and utils.profiler).
+"""
+
+import functools
+
+
+def wrap_callbacks(dash_app, observe, flag):
+    """
+    Wrap all callbacks registered so far in a Dash app, so that each invocation runs in the context manager
+    observe(name, args), where name is the name of the callback function and args are its positional arguments. The
+    context manager yields a dict, to which the wrapper sets 'outcome' ('ok', 'prevented' or 'error') and, if the
+    callback returns, 'result' (the JSON string returned to the browser). PreventUpdate is not an error: it is raised
+    once the context manager exits. Callbacks already wrapped with the same flag are skipped.
+    :param dash_app: dash.Dash
+    :param observe: callable (str, tuple) -> context manager yielding a dict
+    :param flag: str; name of the attribute marking the wrappers
+    """
+    from dash.exceptions import PreventUpdate
+
+    for callback_spec in dash_app.callback_map.values():
+        func = callback_spec['callback']
+        if getattr(func, flag, False):
+            continue
+
+        @functools.wraps(func)
+        def wrapper(*args, _func=func, _name=func.__name__, **kwargs):
+            prevented = None
+            with observe(_name, args) as invocation:
+                invocation['outcome'] = 'error'
+                try:
+                    invocation['result'] = _func(*args, **kwargs)
+                    invocation['outcome'] = 'ok'
+                except PreventUpdate as e:
+                    invocation['outcome'] = 'prevented'
+                    prevented = e
+            if prevented is not None:
+                raise prevented
+            return invocation['result']
+
+        setattr(wrapper, flag, True)
+        callback_spec['callback'] = wrapper
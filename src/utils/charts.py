@@ -4,6 +4,10 @@ import pandas as pd
 import xarray as xr
 from plotly import express as px, graph_objects as go
 
+from . import sketches
+from . import metrics
+from . import memory
+
 
 # Color codes
 ACTRIS_COLOR_HEX = '#00adb7'
@@ -29,7 +33,34 @@ def plotly_scatter(x, y, *args, **kwargs):
     )
 
 
-def _contiguous_periods(start, end, var_codes=None, dt=pd.Timedelta('1D')):
+def _var_codes_to_bitmasks(var_codes):
+    """
+    Encode strings of variable codes separated by comma as integer bitmasks.
+    :param var_codes: pandas.Series of strings
+    :return: tuple (numpy.ndarray of int64 with a bitmask for each item of var_codes, numpy.ndarray with codes;
+    the i-th code corresponds to the i-th bit); missing values are encoded as 0
+    """
+    factor_codes, uniques = pd.factorize(var_codes, sort=False)
+    codes_by_unique = [[c for c in u.split(', ') if c] for u in uniques]
+    all_codes = np.array(sorted(set().union(*codes_by_unique)), dtype=object)
+    if len(all_codes) > 63:
+        raise ValueError(f'too many variable codes to encode as bitmasks: {len(all_codes)}')
+    bit_by_code = {c: np.int64(1) << np.int64(i) for i, c in enumerate(all_codes)}
+    mask_by_unique = np.array([sum(bit_by_code[c] for c in set(cs)) for cs in codes_by_unique] + [0], dtype='i8')
+    return mask_by_unique[factor_codes], all_codes
+
+
+def _bitmasks_to_var_codes(masks, all_codes):
+    """
+    Decode integer bitmasks to strings with sorted variable codes separated by comma (see _var_codes_to_bitmasks).
+    """
+    unique_masks, inverse = np.unique(masks, return_inverse=True)
+    bits = np.int64(1) << np.arange(len(all_codes), dtype='i8')
+    decoded = np.array([', '.join(all_codes[(m & bits) != 0]) for m in unique_masks], dtype=object)
+    return decoded[inverse]
+
+
+def contiguous_periods(start, end, var_codes=None, dt=pd.Timedelta('1D'), groups=None):
     """
     Merge together periods which overlap, are adjacent or nearly adjacent (up to dt). The merged periods are returned
     with:
@@ -37,45 +68,71 @@ def _contiguous_periods(start, end, var_codes=None, dt=pd.Timedelta('1D')):
     - list of indices of datasets which enters into a given period ('indices'),
     - number of the datasets (the length of the above list) ('datasets'),
     - codes of variables available within a given period, if the parameter var_codes is provided.
+    If groups are provided, the periods are merged within each group separately, but all groups are processed at once:
+    the periods are sorted by group and start, the end of periods is accumulated with a segmented cumulative maximum
+    and new periods are detected where the group changes or there is a gap longer than dt.
     :param start: pandas.Series of Timestamps with periods' start
     :param end: pandas.Series of Timestamps with periods' end
     :param var_codes: pandas.Series of strings or None, optional; if given, must contain variable codes separated by comma
     :param dt: pandas.Timedelta
-    :return: pandas.DataFrame with columns 'time_period_start', 'time_period_end', 'indices', 'datasets' and 'var_codes'
+    :param groups: pandas.DataFrame or None, optional; if given, must have the same index as start; periods are merged
+    within groups of rows having the same values in all columns of groups (rows with a missing value are ignored)
+    :return: pandas.DataFrame with columns of groups (if provided), 'time_period_start', 'time_period_end', 'indices',
+    'datasets' and 'var_codes'
     """
-    s, e, idx = [], [], []
-    df_dict = {'s': start, 'e': end}
-    if var_codes is not None:
-        dat = []
-        df_dict['var_codes'] = var_codes
-    df = pd.DataFrame(df_dict).sort_values(by='s', ignore_index=False)
-    df['e'] = df['e'].cummax()
-    if len(df) > 0:
-        delims, = np.nonzero((df['e'] + dt).values[:-1] < df['s'].values[1:])
-        delims = np.concatenate(([0], delims + 1, [len(df)]))
-        for i, j in zip(delims[:-1], delims[1:]):
-            s.append(df['s'].iloc[i])
-            e.append(df['e'].iloc[j - 1])
-            idx.append(df.index[i:j])
-            if var_codes is not None:
-                # concatenate all var_codes; [:-1] is to suppress the last comma
-                all_var_codes = (df['var_codes'].iloc[i:j] + ', ').sum()[:-2]
-                # remove duplicates from all_var_codes...
-                all_var_codes = np.sort(np.unique(all_var_codes.split(', ')))
-                # ...and form a single string with codes separated by comma
-                all_var_codes = ', '.join(all_var_codes)
-                dat.append(all_var_codes)
-    res_dict = {'time_period_start': s, 'time_period_end': e, 'indices': idx, 'datasets': [len(i) for i in idx]}
+    start = pd.Series(start)
+    end = pd.Series(end, index=start.index) if not isinstance(end, pd.Series) else end
+    if groups is not None:
+        group_codes = groups.groupby(list(groups.columns), sort=True).ngroup().values
+        in_group = group_codes >= 0
+    else:
+        group_codes = np.zeros(len(start), dtype='i8')
+        in_group = np.ones(len(start), dtype=bool)
+    rows = np.flatnonzero(in_group)
+    group_codes = group_codes[rows]
+    n = len(rows)
+
+    s = pd.DatetimeIndex(start.iloc[rows]).asi8
+    e = pd.DatetimeIndex(end.iloc[rows]).asi8
+    order = np.lexsort((s, group_codes))
+    s, e, group_codes = s[order], e[order], group_codes[order]
+
+    # segmented cumulative maximum of period ends: within a group, the key group_code * n + rank of end is increasing
+    # with end and always greater than keys of previous groups
+    e_argsort = np.argsort(e, kind='stable')
+    e_rank = np.empty(n, dtype='i8')
+    e_rank[e_argsort] = np.arange(n)
+    e_cummax_rank = np.maximum.accumulate(group_codes * n + e_rank) - group_codes * n if n > 0 else e_rank
+    e_cummax = e[e_argsort][e_cummax_rank]
+
+    new_period = np.ones(n, dtype=bool)
+    new_period[1:] = (group_codes[1:] != group_codes[:-1]) | (e_cummax[:-1] + pd.Timedelta(dt).value < s[1:])
+    period_starts = np.flatnonzero(new_period)
+    period_ends = np.append(period_starts[1:], n)[:len(period_starts)] - 1
+
+    start_rows = rows[order[period_starts]]
+    end_rows = rows[order[e_argsort[e_cummax_rank[period_ends]]]]
+    res_dict = {
+        'time_period_start': start.iloc[start_rows].reset_index(drop=True),
+        'time_period_end': end.iloc[end_rows].reset_index(drop=True),
+        'indices': [idx.tolist() for idx in np.split(start.index.values[rows[order]], period_starts[1:])] if n > 0 else [],
+        'datasets': period_ends - period_starts + 1,
+    }
     if var_codes is not None:
-        res_dict['var_codes'] = dat
-    return pd.DataFrame(res_dict)
+        masks, all_codes = _var_codes_to_bitmasks(pd.Series(var_codes, index=start.index).iloc[rows[order]])
+        period_masks = np.bitwise_or.reduceat(masks, period_starts) if n > 0 else masks
+        res_dict['var_codes'] = _bitmasks_to_var_codes(period_masks, all_codes)
+    df = pd.DataFrame(res_dict)
+    if groups is not None:
+        df = pd.concat([groups.iloc[start_rows].reset_index(drop=True), df], axis=1)
+    return df
 
 
 def _get_timeline_by_station(datasets_df):
-    df = datasets_df\
-        .groupby(['platform_id_RI', 'station_fullname', 'RI'])\
-        .apply(lambda x: _contiguous_periods(x['time_period_start'], x['time_period_end'], x['var_codes_filtered']))\
-        .reset_index()
+    df = contiguous_periods(
+        datasets_df['time_period_start'], datasets_df['time_period_end'], datasets_df['var_codes_filtered'],
+        groups=datasets_df[['platform_id_RI', 'station_fullname', 'RI']]
+    )
     df = df.sort_values('platform_id_RI')
     no_platforms = len(df['platform_id_RI'].unique())
     height = 100 + max(100, 50 + 30 * no_platforms)
@@ -97,10 +154,10 @@ def _get_timeline_by_station(datasets_df):
 
 
 def _get_timeline_by_station_and_vars(datasets_df):
-    df = datasets_df\
-        .groupby(['platform_id_RI', 'station_fullname', 'var_codes_filtered'])\
-        .apply(lambda x: _contiguous_periods(x['time_period_start'], x['time_period_end']))\
-        .reset_index()
+    df = contiguous_periods(
+        datasets_df['time_period_start'], datasets_df['time_period_end'],
+        groups=datasets_df[['platform_id_RI', 'station_fullname', 'var_codes_filtered']]
+    )
     df = df.sort_values('platform_id_RI')
     facet_col_wrap = 4
     no_platforms = len(df['platform_id_RI'].unique())
@@ -122,27 +179,87 @@ def _get_timeline_by_station_and_vars(datasets_df):
     return gantt
 
 
-def get_avail_data_by_var_gantt(ds):
-    dfs = []
-    for v, da in ds.data_vars.items():
-        *v_label, ri = v.split('_')
-        v_label = '_'.join(v_label)
-        notnull_diff = da.notnull().astype('i2').diff('time')
+_GANTT_CACHE_MAXSIZE = 32
+_avail_periods_by_ds_id = memory.LruCache('gantt_periods', maxsize=_GANTT_CACHE_MAXSIZE)
 
-        s = da['time'].where(notnull_diff == 1, drop=True).values
-        if da.isel({'time': 0}).notnull():
-            s = np.concatenate((da['time'].values[:1], s))
-        e = da['time'].where(notnull_diff == -1, drop=True).values
-        if da.isel({'time': -1}).notnull():
-            e = np.concatenate((e, da['time'].values[-1:]))
 
-        df = _contiguous_periods(s, e)[['time_period_start', 'time_period_end']]
-        df['var_label'] = v_label
-        df['RI'] = ri
-        df['variable (RI)'] = f'{v_label} ({ri})'
-        dfs.append(df)
+def _valid_runs(time, valid, min_gap=None):
+    """
+    Find runs of valid samples of many variables sharing the same time axis, in a single vectorized pass.
+    :param time: numpy.ndarray of datetime64 of shape (n,), sorted
+    :param valid: numpy.ndarray of bool of shape (n_vars, n); validity mask of each variable
+    :param min_gap: pandas.Timedelta or None, optional; runs of a variable separated by a gap not longer than min_gap
+    are merged into one run
+    :return: tuple of numpy.ndarray (var_idx, start, end); var_idx is an index of a variable in valid,
+    start is a time of the first valid sample of a run, end is a time of the first invalid sample after the run
+    (or of the last sample, if the run lasts until the end)
+    """
+    valid = np.asarray(valid, dtype='i1')
+    n_vars = valid.shape[0]
+    padding = np.zeros((n_vars, 1), dtype='i1')
+    edges = np.diff(np.concatenate((padding, valid, padding), axis=1), axis=1)
+    # np.nonzero returns indices in the row-major order, hence starts and ends of runs are paired
+    var_idx, start_idx = np.nonzero(edges == 1)
+    _, end_idx = np.nonzero(edges == -1)
+    end_idx = np.minimum(end_idx, len(time) - 1)
+
+    if min_gap is not None and len(var_idx) > 1:
+        gap = time[start_idx[1:]] - time[end_idx[:-1]]
+        merge = (var_idx[1:] == var_idx[:-1]) & (gap <= np.timedelta64(pd.Timedelta(min_gap)))
+        start_idx = start_idx[np.concatenate(([True], ~merge))]
+        end_idx = end_idx[np.concatenate((~merge, [True]))]
+        var_idx = var_idx[np.concatenate(([True], ~merge))]
+    return var_idx, time[start_idx], time[end_idx]
+
+
+def get_avail_periods_by_var(ds, min_gap=pd.Timedelta('1D'), ds_id=None):
+    """
+    Provide periods of data availability of each variable of a dataset.
+    :param ds: xarray.Dataset with variables labeled '<var_label>_<RI>' and indexed by 'time'
+    :param min_gap: pandas.Timedelta or None, optional, default 1 day; periods separated by a gap not longer than
+    min_gap are merged
+    :param ds_id: hashable, optional; if given, the result is cached under this id (together with min_gap)
+    :return: pandas.DataFrame with columns 'time_period_start', 'time_period_end', 'var_label', 'RI', 'variable (RI)'
+    """
+    key = (ds_id, min_gap)
+    if ds_id is not None:
+        df = _avail_periods_by_ds_id.get(key)
+        if df is not None:
+            return df
+
+    vs = list(ds.data_vars)
+    time = ds['time'].values
+    if vs:
+        valid = ds[vs].to_array(dim='variable').notnull()
+        valid = np.asarray(valid.transpose('variable', 'time', ...)).reshape(len(vs), len(time), -1).any(axis=2)
+    else:
+        valid = np.zeros((0, len(time)), dtype=bool)
+    var_idx, start, end = _valid_runs(time, valid, min_gap=min_gap)
+
+    v_labels, ris = zip(*(v.rsplit('_', 1) for v in vs)) if vs else ((), ())
+    v_labels, ris = np.array(v_labels, dtype=object), np.array(ris, dtype=object)
+    df = pd.DataFrame({
+        'time_period_start': start,
+        'time_period_end': end,
+        'var_label': v_labels[var_idx],
+        'RI': ris[var_idx],
+    })
+    df['variable (RI)'] = df['var_label'] + ' (' + df['RI'] + ')'
+
+    if ds_id is not None:
+        _avail_periods_by_ds_id.put(key, df)
+    return df
+
 
-    df = pd.concat(dfs, ignore_index=True)
+@metrics.timed(metrics.FIGURE_BUILD_SECONDS, figure='get_avail_data_by_var_gantt')
+def get_avail_data_by_var_gantt(ds, min_gap=pd.Timedelta('1D'), ds_id=None):
+    """
+    :param ds: xarray.Dataset with variables labeled '<var_label>_<RI>' and indexed by 'time'
+    :param min_gap: pandas.Timedelta or None, optional, default 1 day; see get_avail_periods_by_var
+    :param ds_id: hashable, optional; if given, periods of data availability are cached under this id
+    :return: plotly Figure
+    """
+    df = get_avail_periods_by_var(ds, min_gap=min_gap, ds_id=ds_id)
     # df = df.sort_values('platform_id_RI')
     height = 200 + max(80, 30 + 10 * len(ds.data_vars))
     gantt = px.timeline(
@@ -172,53 +289,134 @@ def get_color_mapping(variables):
     return dict(zip(variables, colors()))
 
 
-def get_avail_data_by_var_heatmap(ds, granularity, adjust_color_intensity_to_max=True, color_mapping=None):
+_SEASON_LABELS = np.array(['DJF', 'MAM', 'JJA', 'SON'])
+_AVAIL_CACHE_MAXSIZE = 32
+_avail_counts_by_ds_id = memory.LruCache('monthly_counts', maxsize=_AVAIL_CACHE_MAXSIZE)
+
+
+def _month_codes(time):
+    """
+    Convert times to integer month codes (number of months since 1970-01).
+    :param time: array-like of datetime64
+    :return: numpy.ndarray of int64
+    """
+    return np.asarray(time, dtype='M8[ns]').astype('M8[M]').astype('i8')
+
+
+def _period_codes(month_codes, granularity):
+    """
+    Roll up month codes to codes of periods of a given granularity. Seasons start in December (DJF, MAM, JJA, SON),
+    which is consistent with pandas' 'QS-DEC' frequency.
+    """
+    if granularity == 'month':
+        return month_codes
+    elif granularity == 'season':
+        return (month_codes + 1) // 3
+    elif granularity == 'year':
+        return month_codes // 12
+    else:
+        raise ValueError(f'unknown granularity={granularity}')
+
+
+def _period_start_and_label(period_codes, granularity):
+    if granularity == 'month':
+        start = period_codes.astype('M8[M]')
+        label = np.datetime_as_string(start, unit='M')
+    elif granularity == 'season':
+        start = (3 * period_codes - 1).astype('M8[M]')
+        year = start.astype('M8[Y]').astype('i8') + 1970
+        label = np.char.add(np.char.add(year.astype(str), '-'), _SEASON_LABELS[period_codes % 4])
+    elif granularity == 'year':
+        start = period_codes.astype('M8[Y]')
+        label = period_codes + 1970
+    else:
+        raise ValueError(f'unknown granularity={granularity}')
+    return start.astype('M8[ns]'), label
+
+
+def _get_monthly_counts(ds):
+    """
+    Count valid (not null) and all samples of each variable by month, using np.bincount over integer month codes.
+    :param ds: xarray.Dataset or dictionary {var_label: xarray.DataArray}
+    :return: tuple (first month code, list of var_labels, valid counts, all counts); counts are numpy arrays
+    of shape (number of variables, number of months)
+    """
+    var_labels = list(ds)
+    codes_and_validity = []
+    for v in var_labels:
+        da = ds[v]
+        month_codes = _month_codes(da['time'].values)
+        valid = np.asarray(da.notnull()).reshape(len(month_codes), -1).any(axis=1)
+        has_time = ~np.isnat(da['time'].values.astype('M8[ns]'))
+        codes_and_validity.append((month_codes[has_time], valid[has_time]))
+
+    non_empty_codes = [codes for codes, _ in codes_and_validity if len(codes) > 0]
+    if non_empty_codes:
+        m0 = min(codes.min() for codes in non_empty_codes)
+        n_months = max(codes.max() for codes in non_empty_codes) - m0 + 1
+    else:
+        m0, n_months = 0, 0
+
+    valid_counts = np.zeros((len(var_labels), n_months), dtype='i8')
+    all_counts = np.zeros((len(var_labels), n_months), dtype='i8')
+    for i, (codes, valid) in enumerate(codes_and_validity):
+        all_counts[i] = np.bincount(codes - m0, minlength=n_months)
+        valid_counts[i] = np.bincount(codes[valid] - m0, minlength=n_months)
+    return m0, var_labels, valid_counts, all_counts
+
+
+def _get_monthly_counts_cached(ds, ds_id):
+    if ds_id is None:
+        return _get_monthly_counts(ds)
+    counts = _avail_counts_by_ds_id.get(ds_id)
+    if counts is None:
+        counts = _get_monthly_counts(ds)
+        _avail_counts_by_ds_id.put(ds_id, counts)
+    return counts
+
+
+def get_avail_data_by_var(ds, granularity, ds_id=None):
+    """
+    Compute the fraction of valid samples of each variable by periods of a given granularity. The counts of samples
+    are computed once by month and rolled up to seasons or years, so that changing granularity needs no pass over data.
+    :param ds: xarray.Dataset or dictionary {var_label: xarray.DataArray}
+    :param granularity: str; one of ['year', 'season', 'month']
+    :param ds_id: hashable, optional; if given, monthly counts are cached under this id
+    :return: xarray.Dataset with a variable for each var_label, indexed by 'time' (start of a period) and
+    with a coordinate 'time_period' (a label of a period)
+    """
+    m0, var_labels, valid_counts, all_counts = _get_monthly_counts_cached(ds, ds_id)
+
+    period_codes = _period_codes(np.arange(m0, m0 + all_counts.shape[1]), granularity)
+    if len(period_codes) > 0:
+        period_delims = np.concatenate(([0], np.flatnonzero(np.diff(period_codes)) + 1))
+        valid_counts = np.add.reduceat(valid_counts, period_delims, axis=1)
+        all_counts = np.add.reduceat(all_counts, period_delims, axis=1)
+        period_codes = period_codes[period_delims]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avail = np.where(all_counts > 0, valid_counts / all_counts, np.nan)
+
+    time, time_period = _period_start_and_label(period_codes, granularity)
+    return xr.Dataset(
+        {v: ('time', avail[i]) for i, v in enumerate(var_labels)},
+        coords={'time': time, 'time_period': ('time', time_period)},
+    )
+
+
+@metrics.timed(metrics.FIGURE_BUILD_SECONDS, figure='get_avail_data_by_var_heatmap')
+def get_avail_data_by_var_heatmap(ds, granularity, adjust_color_intensity_to_max=True, color_mapping=None, ds_id=None):
     """
 
     :param ds: xarray.Dataset or dictionary {var_label: xarray.DataArray};
     :param granularity: str; one of ['year', 'season', 'month']
     :param adjust_color_intensity_to_max: bool, optional, default=True
     :param color_mapping: dict, optional; {var_label: tuple(r, g, b)}, where r, b, g are int's
+    :param ds_id: hashable, optional; if given, monthly counts of valid samples are cached under this id
     :return:
     """
     if color_mapping is None:
         color_mapping = get_color_mapping(ds)
 
-    def get_data_avail_with_freq(ds, granularity):
-        if granularity == 'year':
-            freq = 'YS'
-        elif granularity == 'season':
-            freq = 'QS-DEC'
-        elif granularity == 'month':
-            freq = 'MS'
-        else:
-            raise ValueError(f'unknown granularity={granularity}')
-        if isinstance(ds, xr.Dataset):
-            ds_avail = ds.notnull().resample({'time': freq}).mean()
-        else:
-            # ds is a dictionary {var_label: xr.DataArray}
-            ds_avail = xr.merge(
-                [
-                    da.reset_coords(drop=True).notnull().resample({'time': freq}).mean().rename(v)
-                    for v, da in ds.items()
-                ],
-                join='outer',
-                # compat='override',
-            )
-        t = ds_avail['time']
-        if granularity == 'year':
-            t2 = t.dt.year
-        elif granularity == 'season':
-            season = t.dt.month.to_series().map({12: 'DJF', 3: 'MAM', 6: 'JJA', 9: 'SON'})
-            t2 = t.dt.year.astype(str).str.cat('-', xr.DataArray(season))
-        elif granularity == 'month':
-            month = t.dt.month.to_series().map({m: str(m).zfill(2) for m in range(1, 13)})
-            t2 = t.dt.year.astype(str).str.cat('-', xr.DataArray(month))
-        else:
-            raise ValueError(f'unknown granularity={granularity}')
-        ds_avail['time_period'] = t2
-        return ds_avail.set_coords('time_period')
-
     def get_heatmap(ds_avail, adjust_color_intensity_to_max, color_mapping):
         vs = list(reversed(list(ds_avail.data_vars)))
         n_vars = len(vs)
@@ -269,7 +467,7 @@ def get_avail_data_by_var_heatmap(ds, granularity, adjust_color_intensity_to_max
         )
         return heatmap
 
-    ds_avail = get_data_avail_with_freq(ds, granularity)
+    ds_avail = get_avail_data_by_var(ds, granularity, ds_id=ds_id)
 
     n_vars = max(len(ds_avail.data_vars), 1)
     layout_dict = {
@@ -295,20 +493,33 @@ def get_avail_data_by_var_heatmap(ds, granularity, adjust_color_intensity_to_max
     return fig
 
 
-def get_histogram(da, x_label, bins=50, color=None, x_min=None, x_max=None, log_x=False, log_y=False):
+@metrics.timed(metrics.FIGURE_BUILD_SECONDS, figure='get_histogram')
+def get_histogram(da, x_label, bins=50, color=None, x_min=None, x_max=None, log_x=False, log_y=False, sketch=None):
+    """
+    Provide a histogram together with a box plot of a variable. Both are served from a sketch of the variable
+    (see utils.sketches), so the variable is never loaded at once.
+    :param da: xarray.DataArray or None; if None, sketch must be provided
+    :param x_label: str
+    :param bins: int, optional, default=50
+    :param color: str or tuple(r, g, b), optional
+    :param x_min: float, optional
+    :param x_max: float, optional
+    :param log_x: bool, optional, default=False
+    :param log_y: bool, optional, default=False
+    :param sketch: utils.sketches.VariableSketch, optional; if not provided, it is computed from da
+    :return: plotly Figure
+    """
     color = f'rgb{color}' if isinstance(color, tuple) and len(color) == 3 else color
 
-    ar = da.where(da.notnull(), drop=True).values
+    if sketch is None:
+        sketch = sketches.sketch_dataarray(da)
+    attrs = da.attrs if da is not None else sketch.attrs
 
-    if len(ar) == 0:
-        ar_ = np.array([np.nan])
-    else:
-        ar_ = ar
-    qs = np.quantile(ar_, q=[0.25, 0.5, 0.75])
+    qs = sketch.quantile([0.25, 0.5, 0.75])
     boxplot_data = {
         'q1': qs[0], 'median': qs[1], 'q3': qs[2],
-        'lowerfence': np.amin(ar_), 'upperfence': np.amax(ar_),
-        'mean': np.mean(ar_), 'sd': np.std(ar_),
+        'lowerfence': sketch.min, 'upperfence': sketch.max,
+        'mean': sketch.mean if sketch.count > 0 else np.nan, 'sd': sketch.std,
     }
     boxplot_data = {k: [v] for k, v in boxplot_data.items()}
     boxplot_trace = go.Box(
@@ -320,16 +531,7 @@ def get_histogram(da, x_label, bins=50, color=None, x_min=None, x_max=None, log_
         **boxplot_data
     )
 
-    if log_x:
-        ar = np.log(ar[ar > 0])
-        x_min = np.log(x_min) if x_min is not None and x_min > 0 else None
-        x_max = np.log(x_max) if x_max is not None and x_max > 0 else None
-
-    rng = [x_min, x_max] if x_min is not None and x_max is not None else None
-    h, edges = np.histogram(ar, bins=bins, range=rng)
-
-    if log_x:
-        edges = np.exp(edges)
+    h, edges = sketch.get_histogram(bins=bins, x_min=x_min, x_max=x_max, log_x=log_x)
 
     rng = edges[-1] - edges[0]
     precision = int(np.ceil(np.log10(50 * bins / rng)))
@@ -350,8 +552,8 @@ def get_histogram(da, x_label, bins=50, color=None, x_min=None, x_max=None, log_
         marker={'color': color}
     )
 
-    xaxis_title = da.attrs.get('long_name', da.attrs.get('label', '???'))
-    xaxis_units = da.attrs.get('units', '???')
+    xaxis_title = attrs.get('long_name', attrs.get('label', '???'))
+    xaxis_units = attrs.get('units', '???')
     fig_layout = {
         'xaxis': {
             'title': f'{xaxis_title} ({xaxis_units})',
@@ -408,7 +610,9 @@ def align_range(rng, nticks, log_coeffs=(2, 2.5, 5)):
     return (low_aligned, high_aligned), low_aligned, dtick
 
 
-def multi_line(df, width=1800, height=500, scatter_mode='lines', nticks=None, color_mapping=None, range_tick0_dtick_by_var=None):
+@metrics.timed(metrics.FIGURE_BUILD_SECONDS, figure='multi_line')
+def multi_line(df, width=1800, height=500, scatter_mode='lines', nticks=None, color_mapping=None, range_tick0_dtick_by_var=None,
+               range_by_var=None):
     """
     :param df: pandas DataFrame or dict of pandas Series (in that case each series might have a different index)
     :param width:
@@ -417,6 +621,9 @@ def multi_line(df, width=1800, height=500, scatter_mode='lines', nticks=None, co
     :param nticks:
     :param color_mapping:
     :param range_tick0_dtick_by_var:
+    :param range_by_var: dict {variable_label: (min, max)}, optional; known ranges of variables (e.g. from summary
+    statistics of datasets), used unless range_tick0_dtick_by_var is given; ranges of other variables are computed
+    from df
     :return:
     """
     nvars = len(list(df))
@@ -427,7 +634,9 @@ def multi_line(df, width=1800, height=500, scatter_mode='lines', nticks=None, co
     if color_mapping is None:
         color_mapping = get_color_mapping(list(df))
     if range_tick0_dtick_by_var is None:
-        range_by_var = {v: (df[v].min(), df[v].max()) for v in df}
+        if range_by_var is None:
+            range_by_var = {}
+        range_by_var = {v: range_by_var[v] if v in range_by_var else (df[v].min(), df[v].max()) for v in df}
         range_tick0_dtick_by_var = toolz.valmap(lambda rng: align_range(rng, nticks=nticks), range_by_var)
 
     fig = go.Figure()
@@ -525,6 +734,32 @@ def empty_figure():
     return go.Figure()
 
 
+@metrics.timed(metrics.FIGURE_BUILD_SECONDS, figure='colocation_scatter')
+def colocation_scatter(colocation, height=600):
+    """
+    Plot colocated values of series against each other: a scatter plot for two series, a scatter plot matrix for more.
+    :param colocation: utils.colocation.Colocation
+    :return: plotly.graph_objects.Figure or None, if there are less than two series
+    """
+    if len(colocation.labels) < 2:
+        return None
+    hover_time = np.datetime_as_string(colocation.time, unit='m')
+    if len(colocation.labels) == 2:
+        x_label, y_label = colocation.labels
+        fig = go.Figure(go.Scattergl(
+            x=colocation.values[:, 0], y=colocation.values[:, 1], mode='markers', marker={'size': 3},
+            text=hover_time, hovertemplate='%{text}<br>x=%{x}<br>y=%{y}<extra></extra>',
+        ))
+        fig.update_layout(xaxis_title=x_label, yaxis_title=y_label)
+    else:
+        fig = go.Figure(go.Splom(
+            dimensions=[{'label': label, 'values': colocation.values[:, i]} for i, label in enumerate(colocation.labels)],
+            marker={'size': 3}, text=hover_time, diagonal_visible=False, showupperhalf=False,
+        ))
+    fig.update_layout(height=height)
+    return fig
+
+
 def _get_watermark_size(fig):
     if not isinstance(fig, dict):
         fig = fig.to_dict()
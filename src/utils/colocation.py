@@ -0,0 +1,210 @@
+"""
+Colocation of time series of different datasets (e.g. of different RI's) onto a common time base, with one of methods:
+- 'nearest': the time base is the time coordinate of a reference series (by default, the one with the coarsest
+  sampling); each other series contributes its sample nearest in time, if it is not farther than a tolerance,
+- 'bins': the time base consists of regular bins (aligned to the epoch, like in pandas' resample); each series
+  contributes the mean of its samples falling into a bin.
+
+Each series is matched against the time base separately, with binary search (numpy.searchsorted) over its sorted
+time coordinate or with integer bin codes and numpy.bincount, so the cost is O(n log n) in the length of the series
+and the memory is O(n) plus the size of the time base. In particular, there is no union of the time coordinates of
+the series (years of 1-minute data against hourly data give a matrix with the hourly rows only).
+"""
+
+import collections
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+
+NEAREST = 'nearest'
+BINS = 'bins'
+
+_NAT = np.iinfo('i8').min
+
+Colocation = collections.namedtuple('Colocation', ['time', 'values', 'labels', 'stats'])
+Colocation.__doc__ = """
+Result of colocation:
+- time: numpy.ndarray of datetime64[ns] of shape (n, ); the common time base (for bins, their left edges),
+- values: numpy.ndarray of float64 of shape (n, len(labels)); the aligned values,
+- labels: list of labels of the series,
+- stats: dict {label: dict} with the statistics of matching (see colocate).
+"""
+
+
+def _get_time_and_values(series):
+    """
+    :param series: pandas.Series with DatetimeIndex or 1-dimensional xarray.DataArray with a datetime coordinate
+    :return: tuple of numpy.ndarray (time as int64 nanoseconds, float64 values); missing values are dropped and
+    the result is sorted by time
+    """
+    if isinstance(series, xr.DataArray):
+        series = series.squeeze()
+        if series.ndim != 1:
+            raise ValueError(f'a 1-dimensional DataArray expected; got dims={series.dims}')
+        time = series[series.dims[0]].values
+        values = series.values
+    else:
+        time = series.index.values
+        values = series.to_numpy()
+    time = np.asarray(time, dtype='M8[ns]').astype('i8')
+    values = np.asarray(values, dtype='f8')
+    valid = ~np.isnan(values) & (time != _NAT)
+    time, values = time[valid], values[valid]
+    if len(time) > 1 and np.any(time[1:] < time[:-1]):
+        order = np.argsort(time, kind='stable')
+        time, values = time[order], values[order]
+    return time, values
+
+
+def _median_step(time):
+    # median sampling interval in nanoseconds, 0 if there are less than 2 samples
+    return int(np.median(np.diff(time))) if len(time) > 1 else 0
+
+
+def _to_nanoseconds(td):
+    return pd.Timedelta(td).value
+
+
+def match_nearest(time, ref_time, tolerance):
+    """
+    Find samples nearest in time to the reference times.
+    :param time: numpy.ndarray of int64, sorted; times (ns) of samples
+    :param ref_time: numpy.ndarray of int64; reference times (ns)
+    :param tolerance: int; maximal time offset (ns) of a matched sample
+    :return: tuple of numpy.ndarray (indices of the nearest samples in time, bool mask of matched reference times,
+    absolute time offsets of the nearest samples); if time is empty, nothing is matched
+    """
+    n = len(time)
+    if n == 0:
+        return (np.zeros(len(ref_time), dtype='i8'), np.zeros(len(ref_time), dtype=bool),
+                np.full(len(ref_time), np.iinfo('i8').max, dtype='i8'))
+    pos = np.searchsorted(time, ref_time)
+    left = np.maximum(pos - 1, 0)
+    right = np.minimum(pos, n - 1)
+    offset_left = np.abs(ref_time - time[left])
+    offset_right = np.abs(time[right] - ref_time)
+    # ties go to the earlier sample
+    take_right = offset_right < offset_left
+    idx = np.where(take_right, right, left)
+    offset = np.where(take_right, offset_right, offset_left)
+    return idx, offset <= tolerance, offset
+
+
+def aggregate_bins(time, values, start, step, n_bins):
+    """
+    Average samples in regular bins [start + i * step, start + (i + 1) * step), i = 0, ..., n_bins - 1.
+    :param time: numpy.ndarray of int64, sorted; times (ns) of samples
+    :param values: numpy.ndarray of float64
+    :param start: int; the left edge of the first bin (ns)
+    :param step: int; the width of bins (ns)
+    :param n_bins: int
+    :return: tuple of numpy.ndarray (means of bins, NaN for empty bins; counts of samples in bins)
+    """
+    lo, hi = np.searchsorted(time, [start, start + n_bins * step])
+    bin_idx = (time[lo:hi] - start) // step
+    counts = np.bincount(bin_idx, minlength=n_bins)
+    sums = np.bincount(bin_idx, weights=values[lo:hi], minlength=n_bins)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts > 0, sums / counts, np.nan)
+    return means, counts
+
+
+def colocate(series_by_label, method=NEAREST, tolerance=None, freq=None, reference=None, how='all'):
+    """
+    Align time series onto a common time base; see the module docstring. The time base is limited to the period
+    common to all series.
+    :param series_by_label: dict {label: pandas.Series or xarray.DataArray}; see _get_time_and_values
+    :param method: NEAREST or BINS
+    :param tolerance: pandas.Timedelta, str or None; for NEAREST, the maximal time offset of a matched sample; if None,
+    half of the median sampling interval of the reference series
+    :param freq: pandas.Timedelta, str or None; for BINS, the width of bins; if None, the coarsest median sampling
+    interval of the series
+    :param reference: label or None; for NEAREST, the label of the reference series; if None, the series with
+    the coarsest median sampling interval
+    :param how: 'all' or 'any'; keep the rows of the time base where all series, or at least one series, have a value
+    :return: Colocation; stats of a series are:
+    'samples' - number of its samples within the common period,
+    'matched' - number of rows of the time base (before dropping rows according to how) the series has a value for,
+    'match_ratio' - matched divided by the number of rows of the time base,
+    'median_offset' (NEAREST) - median time offset of the matched samples, as pandas.Timedelta,
+    'median_count' (BINS) - median number of samples in non-empty bins
+    """
+    if method not in (NEAREST, BINS):
+        raise ValueError(f'unknown method={method}')
+    if how not in ('all', 'any'):
+        raise ValueError(f'unknown how={how}')
+    labels = list(series_by_label)
+    if not labels:
+        return Colocation(time=np.empty(0, dtype='M8[ns]'), values=np.empty((0, 0)), labels=[], stats={})
+    arrays = [_get_time_and_values(series_by_label[label]) for label in labels]
+
+    if all(len(time) > 0 for time, _ in arrays):
+        start = max(time[0] for time, _ in arrays)
+        end = min(time[-1] for time, _ in arrays)
+    else:
+        start, end = 0, -1
+    steps = [_median_step(time) for time, _ in arrays]
+    samples = [
+        int(np.searchsorted(time, end, side='right') - np.searchsorted(time, start)) if start <= end else 0
+        for time, _ in arrays
+    ]
+
+    values = []
+    stats = {}
+    if method == NEAREST:
+        ref = int(np.argmax(steps)) if reference is None else labels.index(reference)
+        ref_time, ref_values = arrays[ref]
+        if start <= end:
+            lo, hi = np.searchsorted(ref_time, start), np.searchsorted(ref_time, end, side='right')
+        else:
+            lo, hi = 0, 0
+        ref_time, ref_values = ref_time[lo:hi], ref_values[lo:hi]
+        tolerance = steps[ref] // 2 if tolerance is None else _to_nanoseconds(tolerance)
+        for i, (time, series_values) in enumerate(arrays):
+            if i == ref:
+                column = ref_values
+                matched = np.ones(len(ref_time), dtype=bool)
+                offset = np.zeros(len(ref_time), dtype='i8')
+            else:
+                idx, matched, offset = match_nearest(time, ref_time, tolerance)
+                column = np.where(matched, series_values[idx] if len(time) else np.nan, np.nan)
+            values.append(column)
+            stats[labels[i]] = {
+                'median_offset': pd.Timedelta(int(np.median(offset[matched]))) if matched.any() else pd.NaT,
+            }
+        base_time = ref_time
+    else:
+        step = _to_nanoseconds(freq) if freq is not None else max(steps)
+        if step <= 0:
+            step = _to_nanoseconds('1H')
+        if start <= end:
+            first_bin = start // step * step
+            n_bins = int((end - first_bin) // step + 1)
+        else:
+            first_bin, n_bins = 0, 0
+        for label, (time, series_values) in zip(labels, arrays):
+            means, counts = aggregate_bins(time, series_values, first_bin, step, n_bins)
+            values.append(means)
+            stats[label] = {
+                'median_count': float(np.median(counts[counts > 0])) if (counts > 0).any() else 0.,
+            }
+        base_time = first_bin + step * np.arange(n_bins, dtype='i8')
+
+    values = np.column_stack(values)
+    has_value = ~np.isnan(values)
+    for i, label in enumerate(labels):
+        matched = int(has_value[:, i].sum())
+        stats[label].update({
+            'samples': samples[i],
+            'matched': matched,
+            'match_ratio': matched / len(base_time) if len(base_time) else 0.,
+        })
+    keep = has_value.all(axis=1) if how == 'all' else has_value.any(axis=1)
+    return Colocation(
+        time=base_time[keep].astype('M8[ns]'),
+        values=np.ascontiguousarray(values[keep]),
+        labels=labels,
+        stats=stats,
+    )
@@ -0,0 +1,103 @@
+"""
+Memoization of figure builders. Figures (or any outputs of a callback containing figures) are cached as serialized JSON,
+keyed by a fingerprint of the data they are built from and by the parameters of the view (e.g. view type, ids of
+datasets), so that switching between views or reopening a view skips the Plotly construction cost. The cache is
+bounded by the number of entries and by their total size, and evicts least recently used entries. Serialization uses
+the default JSON engine of Plotly (see utils.serialization.use_fast_json_engine).
+"""
+
+import collections
+import hashlib
+import threading
+
+import pandas as pd
+from plotly.io.json import from_json_plotly, to_json_plotly
+
+from . import metrics
+
+
+def fingerprint(df):
+    """
+    Compute a content hash of a pandas.DataFrame; columns with unhashable values (e.g. lists) are hashed by their repr.
+    :return: str
+    """
+    h = hashlib.sha1()
+    h.update(repr(list(df.columns)).encode())
+    h.update(pd.util.hash_pandas_object(df.index).values.tobytes())
+    for col in df.columns:
+        try:
+            col_hash = pd.util.hash_pandas_object(df[col], index=False)
+        except TypeError:
+            col_hash = pd.util.hash_pandas_object(df[col].map(repr), index=False)
+        h.update(col_hash.values.tobytes())
+    return h.hexdigest()
+
+
+class FigureCache:
+    def __init__(self, maxsize=256, max_bytes=256 * 2**20, name='figures'):
+        self.name = name
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._cache = collections.OrderedDict()
+        self._nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, key, build):
+        """
+        Provide a cached output for the key or build it, cache and return it.
+        :param key: hashable; if None, the output is built and not cached
+        :param build: callable with no arguments returning a plotly Figure or a JSON-serializable structure which may
+        contain plotly Figures; exceptions raised by build are propagated and nothing is cached
+        :return: the output deserialized from JSON (plotly Figures become dictionaries, which Dash accepts as figures)
+        """
+        if key is not None:
+            with self._lock:
+                output_json = self._cache.get(key)
+                if output_json is not None:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            metrics.CACHE_LOOKUPS.inc(cache=self.name, result='hit' if output_json is not None else 'miss')
+            if output_json is not None:
+                metrics.CACHE_BYTES.inc(len(output_json), cache=self.name, operation='get')
+                return from_json_plotly(output_json)
+        output_json = to_json_plotly(build())
+        if key is not None:
+            with self._lock:
+                if key not in self._cache:
+                    self._cache[key] = output_json
+                    self._nbytes += len(output_json)
+                    metrics.CACHE_BYTES.inc(len(output_json), cache=self.name, operation='put')
+                while self._cache and (len(self._cache) > self.maxsize or self._nbytes > self.max_bytes):
+                    _, evicted_json = self._cache.popitem(last=False)
+                    self._nbytes -= len(evicted_json)
+        return from_json_plotly(output_json)
+
+    def evict(self, nbytes):
+        """
+        Evict least recently used entries holding at least nbytes (or all of them), e.g. to fit in a memory budget.
+        :return: int; number of bytes freed
+        """
+        freed = 0
+        with self._lock:
+            while self._cache and freed < nbytes:
+                _, evicted_json = self._cache.popitem(last=False)
+                self._nbytes -= len(evicted_json)
+                freed += len(evicted_json)
+        return freed
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._nbytes = 0
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._cache), 'nbytes': self._nbytes, 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,48 @@
+"""
+Inter-process locking of files shared by several workers of the app (e.g. mmapdict caches), with fcntl.flock on
+an accompanying '.lock' file. On platforms without fcntl (Windows) the locks are no-ops, which is fine for
+a single-process deployment.
+"""
+
+import contextlib
+import os
+import pickle
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+@contextlib.contextmanager
+def file_lock(path, shared=False):
+    """
+    Context manager holding a lock associated with the file path (the file itself needs not exist).
+    :param path: str or path-like
+    :param shared: bool; if True, a shared (reader) lock is acquired, otherwise an exclusive (writer) one
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(f'{os.fspath(path)}.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def atomic_write_pickle(obj, path):
+    """
+    Pickle an object to a temporary file and move it to path, so that readers never see a partially written file.
+    """
+    path = os.fspath(path)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.tmp-', suffix='.pkl')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
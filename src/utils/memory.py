@@ -0,0 +1,256 @@
+"""
+Accounting of memory held by the app: caches (figures, availability periods, sketches), session data, catalogue data
+and datasets decoded by read_dataset. Consumers of memory register a function measuring the bytes they hold and, if
+the memory can be freed on demand, a function evicting some of their entries (see register); LruCache is a thread-safe
+LRU cache registering itself. The bytes held by each consumer are exported as metrics (see utils.metrics).
+
+If a global budget is set (the environment variable MEMORY_BUDGET_MB), enforce_budget evicts entries, from the largest
+evictable consumers first, until the total accounted bytes fit in the budget. Decoded datasets are tracked while they
+are alive (see track), so a burst of large reads makes the caches shrink instead of the worker running out of memory.
+"""
+
+import collections
+import logging
+import os
+import sys
+import threading
+import weakref
+
+from . import metrics
+
+
+logger = logging.getLogger(__name__)
+
+MEMORY_BUDGET_BYTES = int(float(os.environ.get('MEMORY_BUDGET_MB') or 0) * 2**20) or None
+
+MEMORY_BYTES = metrics.gauge('memory_bytes', 'Bytes held by consumers of memory (estimated)', ['consumer'])
+MEMORY_BUDGET = metrics.gauge('memory_budget_bytes', 'Global budget of the bytes held by consumers of memory')
+EVICTED_BYTES = metrics.counter(
+    'memory_evicted_bytes_total', 'Bytes evicted from consumers of memory to fit in the budget', ['consumer'])
+PROCESS_RSS = metrics.gauge('process_resident_memory_bytes', 'Resident memory of the process')
+
+Consumer = collections.namedtuple('Consumer', ['get_nbytes', 'evict'])
+
+# reentrant, since _untrack is called by the garbage collector, possibly while this thread holds the lock
+_lock = threading.RLock()
+_consumers = {}
+# consumer -> bytes of tracked objects alive (see track)
+_tracked_nbytes = collections.Counter()
+# id of an object -> its bytes (see get_static_nbytes); pandas objects are unhashable, so they cannot be keys of a
+# weakref.WeakKeyDictionary; entries are removed when the objects are garbage-collected
+_static_nbytes = {}
+
+
+def get_nbytes(obj, _seen=None):
+    """
+    Estimate the memory used by an object: pandas objects with the contents of object columns, numpy arrays and xarray
+    objects by their data, and containers and plain objects by their contents.
+    :return: int
+    """
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    if hasattr(obj, 'memory_usage'):
+        nbytes = obj.memory_usage(deep=True)
+        return int(nbytes.sum()) if hasattr(nbytes, 'sum') else int(nbytes)
+    if hasattr(obj, 'nbytes'):
+        return int(obj.nbytes)
+    if isinstance(obj, (str, bytes)):
+        return len(obj)
+    if isinstance(obj, dict):
+        return sum(get_nbytes(k, _seen) + get_nbytes(v, _seen) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sum(get_nbytes(v, _seen) for v in obj)
+    if hasattr(obj, '__dict__'):
+        return get_nbytes(vars(obj), _seen)
+    return sys.getsizeof(obj)
+
+
+def get_static_nbytes(obj):
+    """
+    Like get_nbytes, but memoized, for objects which are not modified (e.g. catalogue data).
+    """
+    if obj is None:
+        return 0
+    nbytes = _static_nbytes.get(id(obj))
+    if nbytes is not None:
+        return nbytes
+    nbytes = get_nbytes(obj)
+    try:
+        weakref.finalize(obj, _forget_static_nbytes, id(obj))
+    except TypeError:
+        # the object does not support weak references, so it is not memoized
+        return nbytes
+    _static_nbytes[id(obj)] = nbytes
+    return nbytes
+
+
+def _forget_static_nbytes(obj_id):
+    # called when the object is garbage-collected; a single dict operation needs no lock
+    _static_nbytes.pop(obj_id, None)
+
+
+def register(name, get_nbytes, evict=None):
+    """
+    Register a consumer of memory.
+    :param name: str
+    :param get_nbytes: callable with no arguments returning the number of bytes held by the consumer
+    :param evict: callable or None; evict(nbytes) frees about nbytes (or as much as possible) and returns the number of
+    bytes freed; None, if the memory cannot be freed on demand
+    """
+    with _lock:
+        _consumers[name] = Consumer(get_nbytes, evict)
+
+
+def track(objs, consumer):
+    """
+    Account the bytes of objects (e.g. decoded datasets) to a consumer while they are alive.
+    :param objs: iterable of objects supporting weak references
+    :param consumer: str
+    """
+    for obj in objs:
+        nbytes = get_nbytes(obj)
+        with _lock:
+            _tracked_nbytes[consumer] += nbytes
+        weakref.finalize(obj, _untrack, consumer, nbytes)
+
+
+def _untrack(consumer, nbytes):
+    with _lock:
+        _tracked_nbytes[consumer] -= nbytes
+
+
+def get_rss_bytes():
+    """
+    :return: int or None; resident memory of the process (only on Linux)
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def get_usage():
+    """
+    Measure the consumers of memory and update the metrics.
+    :return: dict {consumer: bytes}
+    """
+    with _lock:
+        consumers = dict(_consumers)
+        usage = dict(_tracked_nbytes)
+    for name, consumer in consumers.items():
+        try:
+            usage[name] = consumer.get_nbytes()
+        except Exception as e:
+            logger.exception(f'measuring memory of {name} failed', exc_info=e)
+    for name, nbytes in usage.items():
+        MEMORY_BYTES.set(nbytes, consumer=name)
+    if MEMORY_BUDGET_BYTES is not None:
+        MEMORY_BUDGET.set(MEMORY_BUDGET_BYTES)
+    rss = get_rss_bytes()
+    if rss is not None:
+        PROCESS_RSS.set(rss)
+    return usage
+
+
+metrics.add_collector(get_usage)
+
+
+def enforce_budget(budget=None):
+    """
+    Evict entries of consumers of memory, from the largest ones first, until the total bytes fit in the budget.
+    :param budget: int or None; in bytes; by default MEMORY_BUDGET_BYTES (if it is not set, nothing is evicted)
+    :return: int; number of bytes freed
+    """
+    budget = budget if budget is not None else MEMORY_BUDGET_BYTES
+    if budget is None:
+        return 0
+    usage = get_usage()
+    excess = sum(usage.values()) - budget
+    freed = 0
+    with _lock:
+        evict_by_name = {name: c.evict for name, c in _consumers.items() if c.evict is not None}
+    for name in sorted(evict_by_name, key=lambda name: usage.get(name, 0), reverse=True):
+        if excess <= 0:
+            break
+        if usage.get(name, 0) <= 0:
+            continue
+        try:
+            n = evict_by_name[name](excess)
+        except Exception as e:
+            logger.exception(f'evicting memory of {name} failed', exc_info=e)
+            continue
+        if n:
+            EVICTED_BYTES.inc(n, consumer=name)
+        excess -= n
+        freed += n
+    if freed:
+        logger.info(f'evicted {freed} bytes to fit in the memory budget of {budget} bytes')
+    if excess > 0:
+        logger.info(f'memory held exceeds the budget of {budget} bytes by {excess} bytes after eviction')
+    return freed
+
+
+class LruCache:
+    """
+    Thread-safe LRU cache bounded by the number of entries, registered as a consumer of memory under the given name.
+    """
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        # key -> (value, nbytes)
+        self._cache = collections.OrderedDict()
+        self._nbytes = 0
+        register(name, lambda: self._nbytes, self.evict)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._cache.get(key)
+            if item is None:
+                return default
+            self._cache.move_to_end(key)
+            return item[0]
+
+    def put(self, key, value):
+        nbytes = get_nbytes(value)
+        with self._lock:
+            old = self._cache.pop(key, None)
+            if old is not None:
+                self._nbytes -= old[1]
+            self._cache[key] = (value, nbytes)
+            self._nbytes += nbytes
+            while len(self._cache) > self.maxsize:
+                _, (_, evicted_nbytes) = self._cache.popitem(last=False)
+                self._nbytes -= evicted_nbytes
+
+    def __contains__(self, key):
+        return key in self._cache
+
+    def __len__(self):
+        return len(self._cache)
+
+    def evict(self, nbytes):
+        """
+        Evict least recently used entries holding at least nbytes (or all of them).
+        :return: int; number of bytes freed
+        """
+        freed = 0
+        with self._lock:
+            while self._cache and freed < nbytes:
+                _, (_, evicted_nbytes) = self._cache.popitem(last=False)
+                self._nbytes -= evicted_nbytes
+                freed += evicted_nbytes
+        return freed
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._nbytes = 0
+
+    @property
+    def nbytes(self):
+        return self._nbytes
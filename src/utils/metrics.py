@@ -0,0 +1,436 @@
+"""
+Instrumentation of the app: counters, gauges and histograms of timings, exposed in the Prometheus text format
+(see render and install_metrics_route, which adds the route /metrics to the Flask server).
+
+Metrics are created (or got, if they exist) by counter, gauge and histogram; observations are made with their methods
+and with the context manager / decorator timer:
+    DOWNLOADS = metrics.counter('downloads_total', 'Number of downloads', ['ri'])
+    DOWNLOADS.inc(ri='actris')
+    with metrics.timer(READ_SECONDS, ri='actris'):
+        ...
+Outbound HTTP traffic through requests is measured by instrument_requests, callbacks of a Dash app by
+instrument_dash_callbacks.
+
+With several worker processes (e.g. gunicorn), each worker has its own metrics; if the environment variable METRICS_DIR
+is set (to a directory shared by the workers), workers write snapshots of their metrics there every
+SNAPSHOT_INTERVAL seconds, and /metrics sums the snapshots of all workers (gauges only of the living ones).
+"""
+
+import bisect
+import contextlib
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+from . import callbacks
+
+
+logger = logging.getLogger(__name__)
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+# in seconds; from fast cache lookups to slow downloads of datasets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30., 60., 120.)
+SNAPSHOT_INTERVAL = 5.
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_lock = threading.Lock()
+_metrics = {}
+_collectors = []
+_snapshot_thread = None
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'metric {self.name} has labels {self.labelnames}; got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        """
+        :return: dict {tuple of label values: value}; a value is a float, or for a histogram, a tuple (list of counts
+        per bucket, sum, count)
+        """
+        with self._lock:
+            return {key: (list(v[0]), v[1], v[2]) if isinstance(v, list) else v for key, v in self._values.items()}
+
+
+class Counter(_Metric):
+    kind = COUNTER
+
+    def inc(self, amount=1., **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.) + amount
+        _ensure_snapshots()
+
+
+class Gauge(_Metric):
+    kind = GAUGE
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+        _ensure_snapshots()
+
+    def inc(self, amount=1., **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.) + amount
+        _ensure_snapshots()
+
+
+class Histogram(_Metric):
+    kind = HISTOGRAM
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            v = self._values.get(key)
+            if v is None:
+                # counts per bucket (the last one is +Inf), sum, count
+                v = self._values[key] = [[0] * (len(self.buckets) + 1), 0., 0]
+            v[0][bisect.bisect_left(self.buckets, value)] += 1
+            v[1] += value
+            v[2] += 1
+        _ensure_snapshots()
+
+
+def _get_or_create(cls, name, documentation, labelnames, **kwargs):
+    with _lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = _metrics[name] = cls(name, documentation, labelnames, **kwargs)
+        elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+            raise ValueError(f'metric {name} already exists as {metric.kind} with labels {metric.labelnames}')
+        return metric
+
+
+def counter(name, documentation, labelnames=()):
+    """
+    :return: Counter; the existing one, if a counter of the name exists
+    """
+    return _get_or_create(Counter, name, documentation, labelnames)
+
+
+def gauge(name, documentation, labelnames=()):
+    return _get_or_create(Gauge, name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+
+@contextlib.contextmanager
+def timer(histogram, **labels):
+    """
+    Observe the duration of the block (also if it raises an exception) in the histogram.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, **labels)
+
+
+def timed(histogram, **labels):
+    """
+    Decorator observing durations of calls of a function in the histogram.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(histogram, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _reset_after_fork():
+    # a forked worker starts with empty metrics; what was observed before the fork belongs to the parent process
+    global _snapshot_thread
+    _snapshot_thread = None
+    for metric in list(_metrics.values()):
+        metric._reset()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _get_snapshot():
+    return {
+        'pid': os.getpid(),
+        'metrics': {
+            metric.name: {
+                'kind': metric.kind,
+                'documentation': metric.documentation,
+                'labelnames': list(metric.labelnames),
+                'buckets': list(getattr(metric, 'buckets', ())),
+                'samples': [[list(key), value] for key, value in metric.samples().items()],
+            }
+            for metric in list(_metrics.values())
+        },
+    }
+
+
+def write_snapshot():
+    """
+    Write a snapshot of the metrics of this process to the directory METRICS_DIR (if set).
+    """
+    metrics_dir = os.environ.get('METRICS_DIR')
+    if not metrics_dir:
+        return
+    os.makedirs(metrics_dir, exist_ok=True)
+    path = os.path.join(metrics_dir, f'{os.getpid()}.json')
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(_get_snapshot(), f)
+    os.replace(tmp_path, path)
+
+
+def _write_snapshots_periodically():
+    while True:
+        time.sleep(SNAPSHOT_INTERVAL)
+        try:
+            write_snapshot()
+        except OSError as e:
+            logger.warning(f'writing a snapshot of metrics failed: {e}')
+
+
+def _ensure_snapshots():
+    global _snapshot_thread
+    if _snapshot_thread is None and os.environ.get('METRICS_DIR'):
+        with _lock:
+            if _snapshot_thread is None:
+                _snapshot_thread = threading.Thread(
+                    target=_write_snapshots_periodically, name='metrics-snapshots', daemon=True
+                )
+                _snapshot_thread.start()
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_snapshots():
+    metrics_dir = os.environ.get('METRICS_DIR')
+    if not metrics_dir:
+        return [_get_snapshot()]
+    write_snapshot()
+    snapshots = []
+    for file_name in os.listdir(metrics_dir):
+        if not file_name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(metrics_dir, file_name)) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def _merge(snapshots):
+    merged = {}
+    for snapshot in snapshots:
+        alive = snapshot['pid'] == os.getpid() or _is_alive(snapshot['pid'])
+        for name, m in snapshot['metrics'].items():
+            if m['kind'] == GAUGE and not alive:
+                continue
+            target = merged.setdefault(name, dict(m, samples={}))
+            for key, value in m['samples']:
+                key = tuple(key)
+                if m['kind'] == HISTOGRAM:
+                    counts, total, count = target['samples'].get(key, ([0] * len(value[0]), 0., 0))
+                    target['samples'][key] = ([a + b for a, b in zip(counts, value[0])], total + value[1],
+                                              count + value[2])
+                else:
+                    target['samples'][key] = target['samples'].get(key, 0.) + value
+    return merged
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(labelnames, key, extra=()):
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def add_collector(collector):
+    """
+    Register a function with no arguments called before the metrics are rendered, e.g. to update gauges.
+    """
+    with _lock:
+        if collector not in _collectors:
+            _collectors.append(collector)
+
+
+def render():
+    """
+    :return: str; the metrics (of all worker processes, if METRICS_DIR is set) in the Prometheus text format
+    """
+    for collector in list(_collectors):
+        try:
+            collector()
+        except Exception as e:
+            logger.exception(f'metrics collector {collector} failed', exc_info=e)
+    lines = []
+    for name, m in sorted(_merge(_read_snapshots()).items()):
+        lines.append(f'# HELP {name} {m["documentation"]}')
+        lines.append(f'# TYPE {name} {m["kind"]}')
+        for key, value in sorted(m['samples'].items()):
+            if m['kind'] == HISTOGRAM:
+                counts, total, count = value
+                cumulative = 0
+                for upper, bucket_count in zip(list(m['buckets']) + [float('inf')], counts):
+                    cumulative += bucket_count
+                    le = (('le', _format_value(upper)), )
+                    lines.append(f'{name}_bucket{_format_labels(m["labelnames"], key, le)} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(m["labelnames"], key)} {_format_value(total)}')
+                lines.append(f'{name}_count{_format_labels(m["labelnames"], key)} {count}')
+            else:
+                lines.append(f'{name}{_format_labels(m["labelnames"], key)} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def install_metrics_route(server, path='/metrics'):
+    """
+    :param server: flask.Flask
+    """
+    import flask
+
+    @server.route(path)
+    def metrics_route():
+        return flask.Response(render(), content_type=CONTENT_TYPE)
+
+
+HTTP_REQUEST_SECONDS = histogram(
+    'http_client_request_seconds', 'Duration of outbound HTTP requests (through requests)', ['host', 'method'])
+HTTP_RESPONSES = counter('http_client_responses_total', 'Outbound HTTP responses', ['host', 'status'])
+HTTP_RESPONSE_BYTES = counter('http_client_response_bytes_total', 'Bytes of outbound HTTP responses', ['host'])
+CACHE_LOOKUPS = counter('cache_lookups_total', 'Lookups in caches', ['cache', 'result'])
+CACHE_BYTES = counter('cache_bytes_total', 'Bytes of values got from and put to caches', ['cache', 'operation'])
+CACHE_SECONDS = histogram('cache_operation_seconds', 'Duration of operations on caches', ['cache', 'operation'])
+FIGURE_BUILD_SECONDS = histogram('figure_build_seconds', 'Duration of building figures', ['figure'])
+CALLBACK_SECONDS = histogram('dash_callback_seconds', 'Duration of Dash callbacks', ['callback', 'outcome'])
+
+_requests_instrumented = False
+_http_observers = []
+
+
+def add_http_observer(observer):
+    """
+    Register a function called after each outbound HTTP request measured by instrument_requests, with the arguments
+    (url, duration, nbytes, status, error): duration in seconds, size of the response in bytes, its status code (None, if
+    the request failed) and the exception raised by the request (or None).
+    """
+    with _lock:
+        if observer not in _http_observers:
+            _http_observers.append(observer)
+
+
+def _notify_http_observers(*args):
+    for observer in list(_http_observers):
+        try:
+            observer(*args)
+        except Exception as e:
+            logger.exception(f'HTTP observer {observer} failed', exc_info=e)
+
+
+def instrument_requests():
+    """
+    Measure outbound HTTP requests made with requests (e.g. by the RI query modules): duration, status and size of
+    responses, by host (see also add_http_observer). requests.Session.send is wrapped, so URL's are the ones requested
+    by the app (also if a stand-in server answers, see the package offline).
+    """
+    global _requests_instrumented
+    import requests
+    from urllib.parse import urlsplit
+
+    with _lock:
+        if _requests_instrumented:
+            return
+        _requests_instrumented = True
+        original_send = requests.Session.send
+
+    @functools.wraps(original_send)
+    def send(session, request, **kwargs):
+        host = urlsplit(request.url).hostname or ''
+        start = time.perf_counter()
+        try:
+            response = original_send(session, request, **kwargs)
+        except Exception as e:
+            duration = time.perf_counter() - start
+            HTTP_REQUEST_SECONDS.observe(duration, host=host, method=request.method)
+            HTTP_RESPONSES.inc(host=host, status=type(e).__name__)
+            _notify_http_observers(request.url, duration, 0, None, e)
+            raise
+        duration = time.perf_counter() - start
+        HTTP_REQUEST_SECONDS.observe(duration, host=host, method=request.method)
+        HTTP_RESPONSES.inc(host=host, status=response.status_code)
+        if kwargs.get('stream'):
+            nbytes = int(response.headers.get('Content-Length') or 0)
+        else:
+            nbytes = len(response.content or b'')
+        HTTP_RESPONSE_BYTES.inc(nbytes, host=host)
+        _notify_http_observers(request.url, duration, nbytes, response.status_code, None)
+        return response
+
+    requests.Session.send = send
+
+
+@contextlib.contextmanager
+def _measure_callback(name, args):
+    start = time.perf_counter()
+    invocation = {'outcome': 'error'}
+    try:
+        yield invocation
+    finally:
+        CALLBACK_SECONDS.observe(time.perf_counter() - start, callback=name, outcome=invocation['outcome'])
+
+
+def instrument_dash_callbacks(dash_app):
+    """
+    Measure durations of all callbacks registered so far in a Dash app, labelled with the names of the callback
+    functions and with the outcome: 'ok', 'prevented' (PreventUpdate) or 'error'.
+    :param dash_app: dash.Dash
+    """
+    callbacks.wrap_callbacks(dash_app, _measure_callback, '_metrics_instrumented')
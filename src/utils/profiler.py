@@ -0,0 +1,272 @@
+"""
+Opt-in profiler of Dash callbacks. Each invocation of a callback is recorded with its wall and CPU time, the sizes of
+its inputs and outputs (as JSON, i.e. what is sent between the browser and the server, e.g. contents of dcc.Store and
+figures) and, for a sample of invocations, the functions taking most time according to cProfile.
+
+Records are written as JSON lines to rolling files callbacks-<pid>.jsonl in a directory (rotated when they exceed
+max_bytes, keeping backup_count older files), so that several worker processes do not write to the same file. The
+report (see summarize and get_report_html) is served at /profiler by install, or printed by
+    python -m utils.profiler <directory>
+
+In the app, profiling is enabled by the environment variable CALLBACK_PROFILE_DIR; CALLBACK_PROFILE_SAMPLE_RATE is the
+fraction of invocations profiled with cProfile (0 by default).
+"""
+
+import contextlib
+import cProfile
+import glob
+import html
+import io
+import json
+import logging
+import logging.handlers
+import os
+import pstats
+import random
+import threading
+import time
+
+import numpy as np
+
+from . import callbacks
+
+
+logger = logging.getLogger(__name__)
+
+N_TOP_FUNCTIONS = 15
+N_SLOWEST = 20
+
+_lock = threading.Lock()
+_records_logger = None
+
+
+def _get_records_logger(directory, max_bytes, backup_count):
+    global _records_logger
+    with _lock:
+        if _records_logger is None:
+            os.makedirs(directory, exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                os.path.join(directory, f'callbacks-{os.getpid()}.jsonl'),
+                maxBytes=max_bytes, backupCount=backup_count
+            )
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            _records_logger = logging.getLogger(f'{__name__}.records')
+            _records_logger.setLevel(logging.INFO)
+            _records_logger.propagate = False
+            _records_logger.handlers = [handler]
+        return _records_logger
+
+
+def _reset_after_fork():
+    # a forked worker writes its records to its own file
+    global _records_logger
+    if _records_logger is not None:
+        for handler in _records_logger.handlers:
+            handler.close()
+    _records_logger = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _get_json_size(value):
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _get_output_sizes(response):
+    # response is the JSON string returned by a Dash callback: {'response': {id: {property: value}}, ...}
+    try:
+        outputs = json.loads(response)['response']
+    except (TypeError, ValueError, KeyError):
+        return {}
+    return {
+        f'{component_id}.{prop}': _get_json_size(value)
+        for component_id, props in outputs.items()
+        for prop, value in props.items()
+    }
+
+
+def _get_top_functions(profile, n=N_TOP_FUNCTIONS):
+    stats = pstats.Stats(profile, stream=io.StringIO())
+    rows = []
+    for (file_name, line, func_name), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+        rows.append({
+            'function': f'{func_name} ({os.path.basename(file_name)}:{line})',
+            'ncalls': ncalls,
+            'tottime': round(tottime, 6),
+            'cumtime': round(cumtime, 6),
+        })
+    rows.sort(key=lambda row: row['cumtime'], reverse=True)
+    return rows[:n]
+
+
+def profile_callbacks(dash_app, directory, sample_rate=0., max_bytes=16 * 2**20, backup_count=3):
+    """
+    Wrap all callbacks registered so far in a Dash app, so that their invocations are recorded in the directory.
+    :param dash_app: dash.Dash
+    :param directory: str; directory of the rolling files with records
+    :param sample_rate: float; fraction of invocations profiled with cProfile
+    :param max_bytes: int; size of a file above which it is rotated
+    :param backup_count: int; number of rotated files kept
+    """
+    @contextlib.contextmanager
+    def record_callback(name, args):
+        profile = cProfile.Profile() if sample_rate > 0 and random.random() < sample_rate else None
+        invocation = {'outcome': 'error'}
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield invocation
+        finally:
+            if profile is not None:
+                profile.disable()
+            result = invocation.get('result')
+            record = {
+                'time': time.time(),
+                'callback': name,
+                'outcome': invocation['outcome'],
+                'wall_s': time.perf_counter() - wall_start,
+                'cpu_s': time.thread_time() - cpu_start,
+                'input_bytes': sum(_get_json_size(arg) for arg in args),
+                'output_bytes': len(result) if isinstance(result, str) else 0,
+                'output_sizes': _get_output_sizes(result) if isinstance(result, str) else {},
+            }
+            if profile is not None:
+                record['profile'] = _get_top_functions(profile)
+            try:
+                _get_records_logger(directory, max_bytes, backup_count).info(json.dumps(record))
+            except OSError as e:
+                logger.warning(f'writing a profile record of {name} failed: {e}')
+
+    callbacks.wrap_callbacks(dash_app, record_callback, '_profiled')
+
+
+def read_records(directory):
+    """
+    :param directory: str; directory with files written by profile_callbacks
+    :return: list of dict; records of all processes, ordered by time
+    """
+    records = []
+    for path in glob.glob(os.path.join(directory, 'callbacks-*.jsonl*')):
+        try:
+            with open(path) as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError:
+            continue
+    records.sort(key=lambda record: record['time'])
+    return records
+
+
+def summarize(records):
+    """
+    :param records: list of dict; see read_records
+    :return: list of dict, with statistics for each callback, ordered by the total wall time (descending)
+    """
+    by_callback = {}
+    for record in records:
+        by_callback.setdefault(record['callback'], []).append(record)
+    summary = []
+    for callback, callback_records in by_callback.items():
+        wall = np.array([r['wall_s'] for r in callback_records])
+        cpu = np.array([r['cpu_s'] for r in callback_records])
+        output_sizes = {}
+        for r in callback_records:
+            for output, size in r.get('output_sizes', {}).items():
+                output_sizes[output] = max(output_sizes.get(output, 0), size)
+        summary.append({
+            'callback': callback,
+            'calls': len(callback_records),
+            'errors': sum(r['outcome'] == 'error' for r in callback_records),
+            'total_wall_s': float(wall.sum()),
+            'p50_wall_s': float(np.percentile(wall, 50)),
+            'p95_wall_s': float(np.percentile(wall, 95)),
+            'max_wall_s': float(wall.max()),
+            'mean_cpu_s': float(cpu.mean()),
+            'mean_input_bytes': float(np.mean([r['input_bytes'] for r in callback_records])),
+            'mean_output_bytes': float(np.mean([r['output_bytes'] for r in callback_records])),
+            'max_output_bytes': int(max(r['output_bytes'] for r in callback_records)),
+            'largest_output': max(output_sizes, key=output_sizes.get) if output_sizes else None,
+        })
+    summary.sort(key=lambda row: row['total_wall_s'], reverse=True)
+    return summary
+
+
+def _html_table(rows, columns):
+    def fmt(value):
+        if isinstance(value, float):
+            return f'{value:.4g}'
+        return html.escape(str(value))
+
+    header = ''.join(f'<th>{html.escape(col)}</th>' for col in columns)
+    body = ''.join(
+        '<tr>' + ''.join(f'<td>{fmt(row.get(col, ""))}</td>' for col in columns) + '</tr>'
+        for row in rows
+    )
+    return f'<table border="1" cellpadding="3"><tr>{header}</tr>{body}</table>'
+
+
+def get_report_html(records):
+    """
+    :return: str; HTML page with the summary of callbacks and the slowest invocations (with their profiles, if any)
+    """
+    summary = summarize(records)
+    slowest = sorted(records, key=lambda r: r['wall_s'], reverse=True)[:N_SLOWEST]
+    parts = [
+        '<html><head><title>Callback profiler</title></head><body>',
+        f'<h2>Callbacks ({len(records)} invocations)</h2>',
+        _html_table(summary, list(summary[0]) if summary else ['callback']),
+        '<h2>Slowest invocations</h2>',
+    ]
+    for r in slowest:
+        when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(r['time']))
+        parts.append(
+            f'<h4>{html.escape(r["callback"])} at {when}: wall {r["wall_s"]:.3f}s, cpu {r["cpu_s"]:.3f}s, '
+            f'{html.escape(r["outcome"])}, in {r["input_bytes"]}B, out {r["output_bytes"]}B</h4>'
+        )
+        if r.get('profile'):
+            parts.append(_html_table(r['profile'], ['function', 'ncalls', 'tottime', 'cumtime']))
+    parts.append('</body></html>')
+    return '\n'.join(parts)
+
+
+def install(dash_app, directory, sample_rate=0., path='/profiler'):
+    """
+    Profile all callbacks registered so far in a Dash app (see profile_callbacks) and add the report at the path.
+    :param dash_app: dash.Dash
+    """
+    import flask
+
+    profile_callbacks(dash_app, directory, sample_rate=sample_rate)
+
+    @dash_app.server.route(path)
+    def profiler_report():
+        return flask.Response(get_report_html(read_records(directory)), mimetype='text/html')
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Print the summary of profiled callbacks')
+    parser.add_argument('directory', help='directory with files written by the profiler (CALLBACK_PROFILE_DIR)')
+    args = parser.parse_args()
+
+    summary = summarize(read_records(args.directory))
+    columns = ['callback', 'calls', 'errors', 'total_wall_s', 'p50_wall_s', 'p95_wall_s', 'mean_cpu_s',
+               'mean_output_bytes', 'largest_output']
+    print(' '.join(f'{col:>18}' for col in columns))
+    for row in summary:
+        print(' '.join(f'{row[col]:>18.4g}' if isinstance(row[col], float) else f'{str(row[col])[:18]:>18}'
+                       for col in columns))
+
+
+if __name__ == '__main__':
+    main()
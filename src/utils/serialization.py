@@ -0,0 +1,104 @@
+"""
+Compact serialization of figures sent to the browser.
+
+- use_fast_json_engine switches Plotly (and so Dash, which serializes callback outputs with plotly.io.json) to
+  the orjson engine, if orjson is installed; it serializes numpy arrays natively, much faster than the default encoder,
+  and writes datetime64 values without trailing zero nanoseconds and float32 values in their shortest form.
+- compact_figure rewrites data arrays of traces: regularly spaced datetime64 coordinates are replaced by a start
+  and a step (x0, dx), other datetime64 coordinates by epoch milliseconds (the axis is then explicitly of 'date' type),
+  and, with the orjson engine, float64 values are downcast to float32, which is enough for plotting.
+- get_compress_algorithms provides the algorithms for compression of HTTP responses (flask-compress).
+
+Base64-encoded typed arrays are not used, as they are not supported by the plotly.js bundled with dash<2.1.
+"""
+
+import numpy as np
+import plotly.io as pio
+
+
+def use_fast_json_engine():
+    """
+    Make orjson the default JSON engine of Plotly, if orjson is installed.
+    :return: str; the name of the JSON engine in use
+    """
+    try:
+        import orjson  # noqa: F401
+    except ImportError:
+        pass
+    else:
+        pio.json.config.default_engine = 'orjson'
+    return pio.json.config.default_engine or 'json'
+
+
+def get_compress_algorithms():
+    """
+    :return: list of str; ['br', 'gzip'] if brotli is installed, ['gzip'] otherwise
+    """
+    try:
+        import brotli  # noqa: F401
+    except ImportError:
+        return ['gzip']
+    return ['br', 'gzip']
+
+
+def _datetime64_to_epoch_ms(values):
+    return values.astype('M8[ms]').astype('i8')
+
+
+def _get_regular_step_ms(epoch_ms):
+    # step in milliseconds, if values are regularly spaced; None otherwise
+    if len(epoch_ms) < 3:
+        return None
+    steps = np.diff(epoch_ms)
+    step = steps[0]
+    if step <= 0 or np.any(steps != step):
+        return None
+    return int(step)
+
+
+def _compact_coordinate(trace, coord, layout_axes):
+    values = trace[coord]
+    if not isinstance(values, np.ndarray) or values.dtype.kind != 'M' or np.isnat(values).any():
+        return
+    epoch_ms = _datetime64_to_epoch_ms(values)
+    step = _get_regular_step_ms(epoch_ms)
+    if step is not None and f'd{coord}' in trace and f'{coord}0' in trace:
+        trace.update({
+            coord: None,
+            f'{coord}0': np.datetime_as_string(values[0].astype('M8[ms]')),
+            f'd{coord}': step,
+        })
+    else:
+        trace[coord] = epoch_ms
+    axis_ref = trace[f'{coord}axis'] if f'{coord}axis' in trace else None
+    layout_axes.add(f'{coord}axis' + (axis_ref[1:] if axis_ref else ''))
+
+
+def compact_figure(fig, float_dtype=None):
+    """
+    Make data arrays of traces of a figure more compact for serialization (in place); see the module docstring.
+    :param fig: plotly.graph_objects.Figure or None
+    :param float_dtype: numpy dtype or None; if None, float32 is used with the orjson engine, otherwise float values
+    are left intact (the default JSON encoder writes float32 values with the digits of their float64 representation)
+    :return: fig
+    """
+    if fig is None:
+        return fig
+    if float_dtype is None and pio.json.config.default_engine == 'orjson':
+        float_dtype = 'f4'
+    date_axes = set()
+    for trace in fig.data:
+        for coord in ('x', 'y'):
+            if coord in trace:
+                _compact_coordinate(trace, coord, date_axes)
+        if float_dtype is not None:
+            for coord in ('x', 'y', 'z'):
+                if coord not in trace:
+                    continue
+                values = trace[coord]
+                if isinstance(values, np.ndarray) and values.dtype.kind == 'f' and values.dtype.itemsize > 4:
+                    trace[coord] = values.astype(float_dtype)
+    for axis in date_axes:
+        if fig.layout[axis].type in (None, '-'):
+            fig.layout[axis].type = 'date'
+    return fig
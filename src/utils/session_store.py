@@ -0,0 +1,257 @@
+"""
+Server-side, memory-bounded store of per-session data (e.g. datasets metadata found by a search). Only a small handle
+{'session_id': str, 'version': int} is sent to the browser (e.g. in a dcc.Store), while the typed pandas DataFrames
+stay on the server; this avoids sending the data back and forth and parsing it on every callback.
+
+Eviction policy:
+- a session keeps at most max_versions_per_session most recent versions,
+- sessions not accessed for longer than session_ttl seconds are dropped,
+- when the total size of the stored data exceeds max_bytes, the least recently used sessions are dropped
+  (the most recently used one is always kept).
+
+If a directory is given, the data is also pickled there, so that it is shared by all worker processes of the app
+(requests of one browser session may be served by different workers); a worker missing a version in memory loads it
+from the directory. The same eviction policy applies to the files, with max_disk_bytes as the size limit.
+"""
+
+import collections
+import glob
+import os
+import pickle
+import re
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+from . import metrics
+from .file_lock import file_lock, atomic_write_pickle
+
+
+def get_nbytes(obj):
+    """
+    Estimate the memory used by an object stored in a session (for pandas objects, including the contents of object
+    columns).
+    """
+    try:
+        nbytes = obj.memory_usage(deep=True)
+    except AttributeError:
+        return getattr(obj, 'nbytes', 0)
+    return int(nbytes.sum()) if hasattr(nbytes, 'sum') else int(nbytes)
+
+
+def _is_valid_session_id(session_id):
+    # handles come from browsers; a session id becomes a part of file paths, so it must be one generated by put
+    return isinstance(session_id, str) and re.fullmatch(r'[0-9a-f]{32}', session_id) is not None
+
+
+class SessionStore:
+    def __init__(self, max_bytes=512 * 2**20, max_versions_per_session=2, session_ttl=2 * 3600, directory=None,
+                 max_disk_bytes=4 * 2**30, name='sessions'):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.max_versions_per_session = max_versions_per_session
+        self.session_ttl = session_ttl
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        # session_id -> {'versions': OrderedDict(version -> (data, nbytes, fingerprint)), 'last_version': int,
+        # 'last_access': float}
+        self._sessions = collections.OrderedDict()
+        self._nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, data, handle=None, fingerprint=None):
+        """
+        Store a new version of data for the session of the handle (or for a new session, if handle is None).
+        :param data: pandas.DataFrame or any object
+        :param handle: dict or None; a handle returned by a previous call of put
+        :param fingerprint: str or None; a content hash of data (see utils.figure_cache), kept with the data on the
+        server, since handles come from browsers (see get_fingerprint)
+        :return: dict; a new handle {'session_id': str, 'version': int}; a handle with an invalid session id is treated
+        as None
+        """
+        session_id = handle.get('session_id') if handle else None
+        if not _is_valid_session_id(session_id):
+            session_id = uuid.uuid4().hex
+        version = self._write(session_id, data, fingerprint) if self.directory is not None else None
+        with self._lock:
+            version = self._put_in_memory(session_id, data, fingerprint, version)
+        if self.directory is not None:
+            self._evict_disk()
+        return {'session_id': session_id, 'version': version}
+
+    def _put_in_memory(self, session_id, data, fingerprint, version=None):
+        nbytes = get_nbytes(data)
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = {'versions': collections.OrderedDict(), 'last_version': 0}
+            self._sessions[session_id] = session
+        if version is None:
+            version = session['last_version'] + 1
+        session['last_version'] = max(session['last_version'], version)
+        session['versions'][version] = (data, nbytes, fingerprint)
+        session['last_access'] = time.monotonic()
+        self._sessions.move_to_end(session_id)
+        self._nbytes += nbytes
+        while len(session['versions']) > self.max_versions_per_session:
+            _, (_, old_nbytes, _) = session['versions'].popitem(last=False)
+            self._nbytes -= old_nbytes
+        self._evict()
+        return version
+
+    def _get_path(self, session_id, version):
+        return os.path.join(self.directory, f'{session_id}-{version}.pkl')
+
+    def _get_disk_versions(self, session_id):
+        paths = glob.glob(os.path.join(self.directory, f'{session_id}-*.pkl'))
+        return sorted(int(os.path.basename(path)[len(session_id) + 1:-len('.pkl')]) for path in paths)
+
+    def _write(self, session_id, data, fingerprint):
+        # versions are numbered across all workers
+        with file_lock(os.path.join(self.directory, session_id)):
+            versions = self._get_disk_versions(session_id)
+            version = versions[-1] + 1 if versions else 1
+            atomic_write_pickle((data, fingerprint), self._get_path(session_id, version))
+        return version
+
+    def _read(self, session_id, version):
+        """
+        :return: tuple (data, fingerprint) or None, if the file is missing
+        """
+        path = self._get_path(session_id, version)
+        try:
+            with open(path, 'rb') as f:
+                data, fingerprint = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return data, fingerprint
+
+    def _get_item(self, handle):
+        # (data, nbytes or None, fingerprint) of the version of the handle, loaded from the directory if needed; or None
+        if not handle:
+            return None
+        session_id, version = handle.get('session_id'), handle.get('version')
+        if not _is_valid_session_id(session_id) or not isinstance(version, int) or isinstance(version, bool):
+            return None
+        with self._lock:
+            session = self._sessions.get(session_id)
+            item = session['versions'].get(version) if session is not None else None
+            if item is not None:
+                session['last_access'] = time.monotonic()
+                self._sessions.move_to_end(session_id)
+                return item
+        if self.directory is None:
+            return None
+        data_and_fingerprint = self._read(session_id, version)
+        if data_and_fingerprint is None:
+            return None
+        data, fingerprint = data_and_fingerprint
+        with self._lock:
+            self._put_in_memory(session_id, data, fingerprint, version)
+        return data, None, fingerprint
+
+    def get(self, handle):
+        """
+        :param handle: dict or None; a handle returned by put
+        :return: the stored data or None, if the handle is None or invalid or the data has been evicted; a
+        pandas.DataFrame or Series is returned as a shallow copy, so that adding columns does not alter the stored one;
+        other objects are returned as stored
+        """
+        if not handle:
+            return None
+        item = self._get_item(handle)
+        with self._lock:
+            if item is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        metrics.CACHE_LOOKUPS.inc(cache=self.name, result='hit' if item is not None else 'miss')
+        if item is None:
+            return None
+        data, nbytes, _ = item
+        metrics.CACHE_BYTES.inc(nbytes if nbytes is not None else get_nbytes(data), cache=self.name, operation='get')
+        return data.copy(deep=False) if isinstance(data, (pd.DataFrame, pd.Series)) else data
+
+    def get_fingerprint(self, handle):
+        """
+        :param handle: dict or None; a handle returned by put
+        :return: str or None; the fingerprint given to put with the data of the handle, or None, if the handle is None or
+        invalid or the data has been evicted
+        """
+        item = self._get_item(handle)
+        return item[2] if item is not None else None
+
+    def _drop_session(self, session_id):
+        session = self._sessions.pop(session_id)
+        self._nbytes -= sum(nbytes for _, nbytes, _ in session['versions'].values())
+
+    def _evict(self):
+        now = time.monotonic()
+        for session_id, session in list(self._sessions.items()):
+            if now - session['last_access'] > self.session_ttl:
+                self._drop_session(session_id)
+        while self._nbytes > self.max_bytes and len(self._sessions) > 1:
+            self._drop_session(next(iter(self._sessions)))
+
+    def evict(self, nbytes):
+        """
+        Drop least recently used sessions from memory holding at least nbytes, e.g. to fit in a memory budget; the most
+        recently used session is kept, and dropped sessions can still be loaded from the directory (if any).
+        :return: int; number of bytes freed
+        """
+        with self._lock:
+            nbytes_before = self._nbytes
+            while self._nbytes > nbytes_before - nbytes and len(self._sessions) > 1:
+                self._drop_session(next(iter(self._sessions)))
+            return nbytes_before - self._nbytes
+
+    def _evict_disk(self):
+        # files are dropped by the worker which writes a new version; concurrent removals are harmless
+        files = []
+        for path in glob.glob(os.path.join(self.directory, '*-*.pkl')):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            session_id, version = os.path.basename(path)[:-len('.pkl')].rsplit('-', 1)
+            files.append((stat.st_mtime, session_id, int(version), stat.st_size, path))
+        files.sort()
+        now = time.time()
+        versions_by_session = collections.Counter(session_id for _, session_id, _, _, _ in files)
+        total_size = sum(size for _, _, _, size, _ in files)
+        for mtime, session_id, version, size, path in files:
+            expired = now - mtime > self.session_ttl
+            too_many_versions = versions_by_session[session_id] > self.max_versions_per_session
+            if expired or too_many_versions or total_size > self.max_disk_bytes:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                versions_by_session[session_id] -= 1
+                total_size -= size
+        for path in glob.glob(os.path.join(self.directory, '*.lock')):
+            try:
+                if now - os.stat(path).st_mtime > self.session_ttl:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'versions': sum(len(s['versions']) for s in self._sessions.values()),
+                'nbytes': self._nbytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -0,0 +1,246 @@
+"""
+Tracing of user actions through the app. Each invocation of a Dash callback starts a trace; spans opened while it runs
+(e.g. by get_datasets, connector calls, read_dataset and outbound HTTP requests) become its descendants, so that a slow
+action can be broken down into its upstream calls. The current span is kept in a context variable; code running in
+other threads inherits it only if run in a copy of the context (see run_in_context).
+
+Finished spans are written as JSON lines, one span per line, in the shape of spans of the OpenTelemetry protocol
+(OTLP/JSON: traceId, spanId, parentSpanId, name, kind, startTimeUnixNano, endTimeUnixNano, attributes, status), to the
+file given by the environment variable TRACE_FILE (the pid of the process is appended to the name, so that worker
+processes do not write to the same file). Without TRACE_FILE, spans are not recorded at all.
+"""
+
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+
+from . import callbacks
+
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = 'atmo-access-timeseries'
+
+# values of 'kind' and of 'status.code' as in OTLP
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+STATUS_CODE_OK = 1
+STATUS_CODE_ERROR = 2
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+_lock = threading.Lock()
+_exporter_file = None
+_exporter_pid = None
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_span_id=None, kind=SPAN_KIND_INTERNAL, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent_span_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.start_time = time.time_ns()
+        self.end_time = None
+        self.status_code = STATUS_CODE_OK
+        self.status_message = ''
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_error(self, exc):
+        self.status_code = STATUS_CODE_ERROR
+        self.status_message = f'{type(exc).__name__}: {exc}'
+
+    def to_otlp(self):
+        """
+        :return: dict; the span in the OTLP/JSON shape
+        """
+        return {
+            'resource': {'attributes': [_get_otlp_attribute('service.name', SERVICE_NAME)]},
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_span_id or '',
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_time),
+            'endTimeUnixNano': str(self.end_time),
+            'attributes': [_get_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            'status': {'code': self.status_code, 'message': self.status_message},
+        }
+
+
+def _get_otlp_attribute(key, value):
+    if isinstance(value, bool):
+        value = {'boolValue': value}
+    elif isinstance(value, int):
+        value = {'intValue': str(value)}
+    elif isinstance(value, float):
+        value = {'doubleValue': value}
+    elif isinstance(value, (list, tuple)):
+        value = {'arrayValue': {'values': [{'stringValue': str(v)} for v in value]}}
+    else:
+        value = {'stringValue': str(value)}
+    return {'key': key, 'value': value}
+
+
+def is_enabled():
+    return bool(os.environ.get('TRACE_FILE'))
+
+
+def _export(span):
+    global _exporter_file, _exporter_pid
+    line = json.dumps(span.to_otlp())
+    with _lock:
+        try:
+            if _exporter_file is None or _exporter_pid != os.getpid():
+                # after a fork, the worker writes to its own file
+                _exporter_pid = os.getpid()
+                _exporter_file = open(f'{os.environ["TRACE_FILE"]}.{_exporter_pid}', 'a', buffering=1)
+            _exporter_file.write(line + '\n')
+        except OSError as e:
+            logger.warning(f'exporting a span failed: {e}')
+
+
+def get_current_span():
+    """
+    :return: Span or None
+    """
+    return _current_span.get()
+
+
+def get_trace_id():
+    """
+    :return: str or None; id of the current trace
+    """
+    span = _current_span.get()
+    return span.trace_id if span is not None else None
+
+
+def annotate(**attributes):
+    """
+    Set attributes of the current span (if any).
+    """
+    s = _current_span.get()
+    if s is not None:
+        s.attributes.update(attributes)
+
+
+def record_error(exc):
+    """
+    Set the status of the current span (if any) to error, e.g. for an exception which is handled and not propagated.
+    """
+    s = _current_span.get()
+    if s is not None:
+        s.set_error(exc)
+
+
+@contextlib.contextmanager
+def span(name, kind=SPAN_KIND_INTERNAL, **attributes):
+    """
+    Open a span, a child of the current one (or the root of a new trace), for the duration of the block. An exception
+    raised in the block sets the status of the span to error and is propagated.
+    :return: Span or None, if tracing is not enabled
+    """
+    if not is_enabled():
+        yield None
+        return
+    parent = _current_span.get()
+    s = Span(
+        name,
+        trace_id=parent.trace_id if parent is not None else secrets.token_hex(16),
+        parent_span_id=parent.span_id if parent is not None else None,
+        kind=kind,
+        attributes=attributes,
+    )
+    token = _current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.set_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        s.end_time = time.time_ns()
+        _export(s)
+
+
+def traced(name=None, **attributes):
+    """
+    Decorator opening a span (named as the function, by default) for each call of a function.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name or func.__qualname__, **attributes):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def run_in_context(func):
+    """
+    :return: callable running func in a copy of the current context (e.g. to be submitted to an executor), so that its
+    spans are children of the current span
+    """
+    return functools.partial(contextvars.copy_context().run, func)
+
+
+_requests_instrumented = False
+
+
+def instrument_requests():
+    """
+    Open a client span for each outbound HTTP request made with requests.
+    """
+    global _requests_instrumented
+    import requests
+
+    with _lock:
+        if _requests_instrumented:
+            return
+        _requests_instrumented = True
+        original_send = requests.Session.send
+
+    @functools.wraps(original_send)
+    def send(session, request, **kwargs):
+        with span(f'HTTP {request.method}', kind=SPAN_KIND_CLIENT,
+                  **{'http.method': request.method, 'http.url': request.url}) as s:
+            response = original_send(session, request, **kwargs)
+            if s is not None:
+                s.set_attribute('http.status_code', response.status_code)
+                if response.headers.get('Content-Length'):
+                    s.set_attribute('http.response_content_length', int(response.headers['Content-Length']))
+            return response
+
+    requests.Session.send = send
+
+
+@contextlib.contextmanager
+def _trace_callback(name, args):
+    # each invocation starts a new trace, also if the server runs it in a thread with a span open
+    token = _current_span.set(None)
+    try:
+        with span(f'callback {name}', kind=SPAN_KIND_SERVER, **{'dash.callback': name}) as s:
+            invocation = {}
+            yield invocation
+            if s is not None and invocation.get('outcome') == 'prevented':
+                s.set_attribute('dash.prevent_update', True)
+    finally:
+        _current_span.reset(token)
+
+
+def instrument_dash_callbacks(dash_app):
+    """
+    Start a trace for each invocation of the callbacks registered so far in a Dash app.
+    :param dash_app: dash.Dash
+    """
+    callbacks.wrap_callbacks(dash_app, _trace_callback, '_traced')
@@ -0,0 +1,11 @@
+"""
+WSGI entry point of the ATMO-ACCESS time series service, e.g. for uWSGI (which loads the app in the master process
+before forking the workers, unless lazy-apps is set):
+    SESSION_STORE_DIR=/tmp/atmo-access-sessions uwsgi --http :9235 --master --processes 4 --wsgi-file wsgi.py
+For gunicorn, see gunicorn.conf.py.
+"""
+
+from app import create_app
+
+
+application = create_app()